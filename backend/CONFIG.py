@@ -3,19 +3,64 @@ params = {
     "MODEL_ARCH": "DenseNet",
     "MODEL_NAME": "densenet201",
     "PRETRAINED": True,
+    "WEIGHTS_DIR": None, # local cache of the pretrained weights, defaults to ROOT_DIR/weights
+    "OFFLINE": False, # only read the pretrained weights from WEIGHTS_DIR, never download them
     "EPOCHS": 50,
     "LR": 0.0001, # use = 0.0001
     "OPTIMIZER": "AdamW",
     "WEIGHT_DECAY": 0.00001,  # best = 0.00001
     "MOMENTUM": 0.9,  # Default = 0.9 for timm
     "BATCH_SIZE": 16,
+    "ACCUMULATE_GRAD_BATCHES": 1, # batches whose gradients are summed per optimizer step
+    "BASE_BATCH_SIZE": 32, # effective batch size (BATCH_SIZE x ACCUMULATE_GRAD_BATCHES x DEVICES) LR is tuned for
+    "LR_SCALING": "sqrt", # scale LR to the effective batch size: linear, sqrt (AdamW) or none
+    "WARMUP_EPOCHS": 0, # linear LR warm-up, can be fractional
+    "SYNC_BATCHNORM": False, # compute the batch norm statistics over the batches of all the devices
     "IMAGE_SIZE": 512,
     "SHOW_PLOTS": False,
     "NUM_WORKERS": 20,
+    "PIN_MEMORY": False, # for the training and validation loaders, the test loader always pins
     "NUM_CLASSES": 14,
     "DEVICES": 2,
     "TRAIN_SIZE": 0.75,
     "VAL_SIZE": 0.1,
     "TEST_SIZE": 0.15,
     "ROOT_DIR": "/u20/<MacId>", # replace <MacId> with your mac id
+    "CHECKPOINT_DIR": None, # defaults to ROOT_DIR/checkpoints/MODEL_NAME
+    "KEEP_LAST": 3, # number of most recent checkpoints kept next to the best one and last.ckpt
+    "CHECKPOINT_EVERY_N_STEPS": None, # None saves at the end of every epoch
+    "RESUME": None, # checkpoint to resume training from, or "last"
+    "USE_CACHE": False, # build the cache first with utility/build_cache.py
+    "PROGRESSIVE_SIZES": None, # e.g. [256, 384, 512], needs USE_CACHE and ends at IMAGE_SIZE
+    "PROGRESSIVE_EPOCHS": None, # e.g. [0, 5, 10], the epoch at which every size starts
+    "USE_SHARDS": False, # stream the tar shards written by utility/write_shards.py
+    "SHARD_BUFFER": 2000, # samples in the shuffle buffer of every DataLoader worker
+    "FAST_DECODE": False, # decode the JPEGs at the smallest scale that is still at least IMAGE_SIZE
+    "BATCH_AUGMENT": False, # augment whole batches on the device instead of in the DataLoader workers
+    "MEMORY_EFFICIENT": False, # DenseNet only, recompute the dense layer bottlenecks in the backward pass to fit larger batches
+    "CHANNELS_LAST": False, # NHWC memory format for the model and its inputs
+    "COMPILE": False, # compile the model with torch.compile
+    "COMPILE_MODE": "default", # default, reduce-overhead, max-autotune or max-autotune-no-cudagraphs
+    "COMPILE_WARMUP": 2, # training steps run on random data before fitting, so compilation is not timed as training
+    "MEAN": [0.5057019, 0.5057019, 0.5057019],
+    "STD": [0.24987267, 0.24987267, 0.24987267],
+    "STATS_FILE": None, # json written by utility/find_mean_std.py, overrides MEAN and STD
+    "PROFILE": None, # host profile written by utility/tune.py, defaults to ROOT_DIR/profiles/<hostname>.json
+    "TRAIN_METRICS": ["accuracy"], # any of accuracy, precision, recall, f1_score, auroc, auprc
+    "VAL_METRICS": ["accuracy", "auroc"], # must contain accuracy, which the early stopping and the scheduler monitor
+    "TEST_METRICS": ["accuracy", "precision", "recall", "f1_score", "auroc", "auprc"],
+    "METRIC_THRESHOLDS": 200, # threshold bins of auroc and auprc, None computes the exact curves
+    "TEST_AUC_BINS": 10000, # probability bins of the per-class test ROC AUC histograms
+    "TTA": False, # test and serve on the logits of augmented views of every image, run as one batch
+    "TTA_FLIP": True, # add the horizontal flip
+    "TTA_SHIFTS": [0.05], # fractions of the image size, each adds shifts left, right, up and down
+    "TTA_SCALES": [0.9], # center crops of these fractions of the image, resized back
+    "TTA_AGGREGATION": "mean", # mean or max of the logits of the views
+    "TTA_MEMORY_MB": 2048, # activation memory of a forward pass of views, the views are chunked to fit
+    "TEACHER_CHECKPOINT": None, # .ckpt or .pth of a trained model, trains MODEL_NAME as its distilled student
+    "TEACHER_ARCH": "DenseNet", # architecture of the teacher checkpoint
+    "TEACHER_NAME": "densenet201", # timm model name of the teacher checkpoint
+    "TEACHER_IMAGE_SIZE": 512, # image size the teacher was trained at
+    "DISTILL_ALPHA": 0.5, # weight of the teacher targets in the loss, the labels get the rest
+    "DISTILL_TEMPERATURE": 2.0, # softens the teacher and student logits of the teacher term
 }
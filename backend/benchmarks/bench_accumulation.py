@@ -0,0 +1,163 @@
+import json
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Any
+import torch
+from lightning import Callback, LightningModule, Trainer, seed_everything
+from torch.utils.data import DataLoader, TensorDataset
+from backend.CONFIG import params
+from backend.utility.get_model import get_model
+
+
+def make_task(num_samples: int, image_size: int, num_classes: int, seed: int = 0) -> TensorDataset:
+    """
+    Builds a learnable synthetic multilabel task: every label is a noisy linear function of the mean intensity of the
+    quadrants of the image channels.
+
+    Args:
+        num_samples (int): The number of samples.
+        image_size (int): The image size.
+        num_classes (int): The number of labels.
+        seed (int): The random seed.
+
+    Returns:
+        TensorDataset: The images and their labels.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    images = torch.randn(num_samples, 3, image_size, image_size, generator=generator)
+    quadrants = torch.nn.functional.adaptive_avg_pool2d(images, 2).flatten(1) * image_size / 2
+    weights = torch.randn(quadrants.shape[1], num_classes, generator=generator)
+    logits = quadrants @ weights + 0.5 * torch.randn(num_samples, num_classes, generator=generator)
+    return TensorDataset(images, (logits > 0).float())
+
+
+class EpochTimer(Callback):
+    def __init__(self):
+        """
+        Records the training time and the validation metrics of every epoch.
+        """
+        super(EpochTimer, self).__init__()
+        self.epochs: list[dict[str, float]] = []
+        self._start = 0.0
+        self._train_time = 0.0
+
+    def on_train_epoch_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self._start = time.perf_counter()
+
+    def on_train_batch_end(self, trainer: Trainer, pl_module: LightningModule, *args: Any) -> None:
+        # Validation runs inside the training epoch, only the training batches are timed
+        self._train_time = time.perf_counter() - self._start
+
+    def on_validation_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if trainer.sanity_checking:
+            return
+        self.epochs.append(
+            {
+                "epoch": trainer.current_epoch,
+                "optimizer_steps": trainer.global_step,
+                "train_s": self._train_time,
+                "val_loss": float(trainer.callback_metrics["loss/val"]),
+                "val_auroc": float(trainer.callback_metrics["auroc/val"]),
+            }
+        )
+
+
+def run(args: Namespace, train_set: TensorDataset, val_set: TensorDataset) -> dict[str, Any]:
+    """
+    Trains a model with the batch size, accumulation and learning rate scaling of the arguments.
+
+    Args:
+        args (Namespace): The arguments of get_model and the Trainer.
+        train_set (TensorDataset): The training set.
+        val_set (TensorDataset): The validation set.
+
+    Returns:
+        dict[str, Any]: The effective batch size, the scaled learning rate, the training throughput and the
+            metrics of every epoch.
+    """
+    seed_everything(0, verbose=False)
+    model = get_model(args)
+    timer = EpochTimer()
+    trainer = Trainer(
+        accelerator="cpu",
+        devices=1,
+        max_epochs=args.epochs,
+        accumulate_grad_batches=args.accumulate_grad_batches,
+        callbacks=[timer],
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        num_sanity_val_steps=0,
+    )
+    trainer.fit(
+        model,
+        DataLoader(train_set, batch_size=args.batch_size, shuffle=True, drop_last=True),
+        DataLoader(val_set, batch_size=64),
+    )
+    train_time = sum(epoch["train_s"] for epoch in timer.epochs)
+    return {
+        "batch_size": args.batch_size,
+        "accumulate_grad_batches": args.accumulate_grad_batches,
+        "effective_batch_size": model.effective_batch_size,
+        "lr": model.lr,
+        "images_per_sec": len(timer.epochs) * (len(train_set) // args.batch_size * args.batch_size) / train_time,
+        "epochs": timer.epochs,
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compare the throughput and the convergence of a large batch, the same effective batch reached "
+        "by accumulating small batches, and the small batches alone, on the CPU."
+    )
+    parser.add_argument("--model_arch", type=str, default="ResNet", help="The model architecture.")
+    parser.add_argument("--model_name", type=str, default="resnet10t", help="The model name.")
+    parser.add_argument("--image_size", type=int, default=64, help="The image size.")
+    parser.add_argument("--batch_size", type=int, default=64, help="The large batch size.")
+    parser.add_argument("--accumulate_grad_batches", type=int, default=4, help="The number of accumulated small batches per large batch.")
+    parser.add_argument("--epochs", type=int, default=5, help="The number of epochs.")
+    parser.add_argument("--num_samples", type=int, default=2048, help="The number of synthetic training samples.")
+    parser.add_argument("--warmup_epochs", type=float, default=1, help="The number of warm-up epochs.")
+    parser.add_argument("--output", type=str, default="bench_accumulation.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    train_set = make_task(args.num_samples, args.image_size, params["NUM_CLASSES"], seed=0)
+    val_set = make_task(args.num_samples // 4, args.image_size, params["NUM_CLASSES"], seed=1)
+    small = args.batch_size // args.accumulate_grad_batches
+    configs = {
+        "large_batch": (args.batch_size, 1),
+        "accumulated": (small, args.accumulate_grad_batches),
+        "small_batch": (small, 1),
+    }
+    results = {}
+    for name, (batch_size, accumulate_grad_batches) in configs.items():
+        run_args = Namespace(**{key.lower(): value for key, value in params.items()})
+        run_args.__dict__.update(
+            model_arch=args.model_arch,
+            model_name=args.model_name,
+            pretrained=False,
+            image_size=args.image_size,
+            batch_size=batch_size,
+            accumulate_grad_batches=accumulate_grad_batches,
+            devices=1,
+            # The learning rate of CONFIG.py is the one of the large batch
+            base_batch_size=args.batch_size,
+            warmup_epochs=args.warmup_epochs,
+            epochs=args.epochs,
+            val_metrics=["accuracy", "auroc"],
+        )
+        results[name] = run(run_args, train_set, val_set)
+        last = results[name]["epochs"][-1]
+        print(
+            f"{name:12s} batch {batch_size:4d} x {accumulate_grad_batches}: lr {results[name]['lr']:.2e}, "
+            f"{results[name]['images_per_sec']:8.1f} images/sec, val loss {last['val_loss']:.4f}, "
+            f"val auroc {last['val_auroc']:.4f}"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump({"image_size": args.image_size, "model_name": args.model_name, "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
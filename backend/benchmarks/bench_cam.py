@@ -0,0 +1,115 @@
+import json
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Callable
+import numpy as np
+import torch
+from torch import Tensor
+from backend.CONFIG import params
+from backend.classes.GradCAM import GradCAM
+from backend.utility.get_model import create_model
+
+
+def backward_cam(cam: GradCAM, x: Tensor, classes: list[int]) -> Tensor:
+    """
+    Computes the Grad-CAM heatmaps the usual way, with one backward pass per class. Like the hook based
+    implementations, the backward pass goes through the whole model and computes the gradients of its weights.
+
+    Args:
+        cam (GradCAM): The Grad-CAM of the model, for its feature map and its head.
+        x (Tensor): The batch of images.
+        classes (list[int]): The indices of the classes.
+
+    Returns:
+        Tensor: The heatmaps of shape (batch, classes, height, width), each scaled to its maximum.
+    """
+    features = cam.features(x)
+    features.retain_grad()
+    logits = cam.head(cam.pool(features))
+    cams = []
+    for i, c in enumerate(classes):
+        cam.model.zero_grad(set_to_none=True)
+        features.grad = None
+        logits[:, c].sum().backward(retain_graph=i < len(classes) - 1)
+        gradient = features.grad
+        heatmap = torch.relu((gradient.mean(dim=(-2, -1), keepdim=True) * features).sum(1))
+        cams.append(heatmap / heatmap.amax(dim=(-2, -1), keepdim=True).clamp_min(torch.finfo(heatmap.dtype).tiny))
+    return torch.stack(cams, 1).detach()
+
+
+def time_per_image(function: Callable[[], object], batch_size: int, steps: int) -> float:
+    """
+    Times a function, after one warm-up call.
+
+    Args:
+        function (Callable[[], object]): The function to time.
+        batch_size (int): The number of images it processes.
+        steps (int): The number of timed calls.
+
+    Returns:
+        float: The mean time per image in milliseconds.
+    """
+    function()
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.mean(times)) / batch_size
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measure the latency Grad-CAM adds per image: the heatmaps of all the classes from the forward pass of the predictions, against one backward pass per class."
+    )
+    parser.add_argument("--model_arch", type=str, default=params["MODEL_ARCH"], help="The model architecture.")
+    parser.add_argument("--model_name", type=str, default=params["MODEL_NAME"], help="The model name.")
+    parser.add_argument("--image_size", type=int, default=params["IMAGE_SIZE"], help="The image size.")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8], help="The batch sizes to measure.")
+    parser.add_argument("--steps", type=int, default=3, help="The number of timed calls per configuration.")
+    parser.add_argument("--output", type=str, default="bench_cam.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    model_args = Namespace(**{key.lower(): value for key, value in params.items()})
+    model_args.__dict__.update(model_arch=args.model_arch, model_name=args.model_name, pretrained=False)
+    torch.manual_seed(0)
+    cam = GradCAM(create_model(model_args).eval())
+    classes = list(range(model_args.num_classes))
+
+    results = []
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, 3, args.image_size, args.image_size)
+        with torch.inference_mode():
+            predictions_ms = time_per_image(lambda: cam.model(x), batch_size, args.steps)
+            cam_ms = time_per_image(lambda: cam(x, classes), batch_size, args.steps)
+            heatmaps = cam(x, classes)[1]
+        backward_ms = time_per_image(lambda: backward_cam(cam, x, classes), batch_size, args.steps)
+        reference = (backward_cam(cam, x, classes) * 255).round()
+        results.append(
+            {
+                "batch_size": batch_size,
+                "predictions_ms": predictions_ms,
+                "cam_ms": cam_ms,
+                "backward_cam_ms": backward_ms,
+                "added_ms": cam_ms - predictions_ms,
+                "backward_added_ms": backward_ms - predictions_ms,
+                # In uint8 levels, from rounding
+                "max_difference": (heatmaps.float() - reference).abs().max().item(),
+            }
+        )
+        print(
+            f"batch {batch_size:3d}: predictions {predictions_ms:8.1f} ms/image, with the heatmaps of "
+            f"{len(classes)} classes {cam_ms:8.1f} ms/image (+{cam_ms - predictions_ms:.1f}), "
+            f"with a backward pass per class {backward_ms:8.1f} ms/image (+{backward_ms - predictions_ms:.1f})"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {"model_name": args.model_name, "image_size": args.image_size, "classes": len(classes), "results": results},
+            f,
+            indent=4,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import json
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Any
+import numpy as np
+import torch
+from torch import nn
+from backend.CONFIG import params
+from backend.classes.Classifier import Classifier
+from backend.utility.get_model import get_model
+
+
+def train_step(classifier: Classifier, optimizer: torch.optim.Optimizer, images: torch.Tensor, labels: torch.Tensor) -> float:
+    """
+    Runs a training step (forward, backward and optimizer step) and measures its duration.
+
+    Args:
+        classifier (Classifier): The model.
+        optimizer (torch.optim.Optimizer): The optimizer of the model.
+        images (torch.Tensor): The batch of images.
+        labels (torch.Tensor): The batch of labels.
+
+    Returns:
+        float: The duration of the step in seconds.
+    """
+    start = time.perf_counter()
+    optimizer.zero_grad(set_to_none=True)
+    loss = nn.functional.binary_cross_entropy_with_logits(classifier(images), labels)
+    loss.backward()
+    optimizer.step()
+    return time.perf_counter() - start
+
+
+def bench_mode(args: Namespace, steps: int) -> dict[str, Any]:
+    """
+    Builds the model through get_model in the execution mode set by the arguments and times its training steps.
+
+    Args:
+        args (Namespace): The arguments of get_model, including channels_last, compile and compile_mode.
+        steps (int): The number of timed steps after the warm-up.
+
+    Returns:
+        dict[str, Any]: The warm-up time (including the compilation) in seconds and the mean and p50 step time in
+            milliseconds.
+    """
+    torch.manual_seed(0)
+    classifier = get_model(args)
+    optimizer = torch.optim.SGD(classifier.parameters(), lr=args.lr, momentum=args.momentum)
+    images = torch.randn(args.batch_size, 3, args.image_size, args.image_size)
+    labels = (torch.rand(args.batch_size, args.num_classes) > 0.5).float()
+    classifier.train()
+
+    start = time.perf_counter()
+    classifier.warm_up(max(args.compile_warmup, 1), args.batch_size, args.image_size)
+    warmup = time.perf_counter() - start
+    times = [train_step(classifier, optimizer, images, labels) for _ in range(steps)]
+    return {
+        "warmup_s": warmup,
+        "step_ms": 1000 * float(np.mean(times)),
+        "step_p50_ms": 1000 * float(np.median(times)),
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compare the training step time of every architecture in eager mode, channels_last and compiled, on the CPU."
+    )
+    parser.add_argument(
+        "--models",
+        type=str,
+        nargs="+",
+        default=["EfficientNet:efficientnet_b0", "ResNet:resnet50", f"DenseNet:{params['MODEL_NAME']}"],
+        help="The models to compare as <model_arch>:<model_name>.",
+    )
+    parser.add_argument("--image_size", type=int, default=params["IMAGE_SIZE"], help="The image size.")
+    parser.add_argument("--batch_size", type=int, default=2, help="The batch size.")
+    parser.add_argument("--steps", type=int, default=5, help="The number of timed training steps per mode.")
+    parser.add_argument("--compile_mode", type=str, default=params["COMPILE_MODE"], help="The torch.compile mode.")
+    parser.add_argument("--compile_warmup", type=int, default=params["COMPILE_WARMUP"], help="The number of warm-up steps.")
+    parser.add_argument("--output", type=str, default="bench_compile.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    modes = {
+        "eager": {"channels_last": False, "compile": False},
+        "channels_last": {"channels_last": True, "compile": False},
+        "compiled": {"channels_last": False, "compile": True},
+        "compiled_channels_last": {"channels_last": True, "compile": True},
+    }
+    results = []
+    for model in args.models:
+        model_arch, model_name = model.split(":")
+        result = {"model_arch": model_arch, "model_name": model_name}
+        for mode, options in modes.items():
+            model_args = Namespace(**{key.lower(): value for key, value in params.items()})
+            model_args.__dict__.update(
+                model_arch=model_arch,
+                model_name=model_name,
+                pretrained=False,
+                image_size=args.image_size,
+                batch_size=args.batch_size,
+                compile_mode=args.compile_mode,
+                compile_warmup=args.compile_warmup,
+                **options,
+            )
+            torch._dynamo.reset()
+            result[mode] = bench_mode(model_args, args.steps)
+            print(
+                f"{model_name:20s} {mode:24s}: {result[mode]['step_ms']:9.1f} ms/step "
+                f"(warm-up {result[mode]['warmup_s']:.1f} s)"
+            )
+        result["compiled_speedup"] = result["eager"]["step_ms"] / result["compiled"]["step_ms"]
+        results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "image_size": args.image_size,
+                "batch_size": args.batch_size,
+                "compile_mode": args.compile_mode,
+                "num_threads": torch.get_num_threads(),
+                "results": results,
+            },
+            f,
+            indent=4,
+        )
+
+
+if __name__ == "__main__":
+    main()
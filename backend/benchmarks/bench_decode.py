@@ -0,0 +1,81 @@
+import json
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from backend.benchmarks.synthetic import make_chexpert
+from backend.classes.CheXpert_Dataset import CheXpert
+from backend.utility.open_image import open_image
+
+
+def decode(image_path: str, image_size: int, fast_decode: bool) -> tuple[np.ndarray, float]:
+    """
+    Decodes an image and resizes it to image_size x image_size the same way train.py does.
+
+    Args:
+        image_path (str): The path to the image.
+        image_size (int): The size to resize to.
+        fast_decode (bool): Whether to use the reduced-resolution decode.
+
+    Returns:
+        tuple[np.ndarray, float]: The resized uint8 image and the time it took in seconds.
+    """
+    start = time.perf_counter()
+    image = open_image(image_path, image_size if fast_decode else None)
+    image = image.convert("L").resize((image_size, image_size), resample=Image.Resampling.BICUBIC)
+    pixels = np.asarray(image)
+    return pixels, time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compare the decode time and output fidelity of the full and the reduced-resolution decode paths."
+    )
+    parser.add_argument("--root_dir", type=str, default=None, help="The root directory of the dataset. Defaults to a synthetic dataset.")
+    parser.add_argument("--num_images", type=int, default=200, help="The number of images to decode.")
+    parser.add_argument("--image_size", type=int, default=512, help="The target image size.")
+    parser.add_argument("--output", type=str, default="bench_decode.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    # The synthetic images have the size of the full resolution CheXpert radiographs
+    root_dir = args.root_dir or make_chexpert(
+        Path(tempfile.gettempdir()) / "synthetic_chexpert_full", args.num_images, image_size=(2320, 2828)
+    )
+    dataset = CheXpert(root_dir=root_dir)
+    count = min(args.num_images, len(dataset))
+
+    times = {"full": [], "fast": []}
+    psnr, max_error = [], []
+    for idx in range(count):
+        image_path = dataset.image_path(idx)
+        full, full_time = decode(image_path, args.image_size, fast_decode=False)
+        fast, fast_time = decode(image_path, args.image_size, fast_decode=True)
+        times["full"].append(full_time)
+        times["fast"].append(fast_time)
+        error = full.astype(np.float64) - fast.astype(np.float64)
+        mse = np.mean(error**2)
+        psnr.append(float("inf") if mse == 0 else 10 * np.log10(255**2 / mse))
+        max_error.append(float(np.abs(error).max()))
+
+    result = {
+        "num_images": count,
+        "image_size": args.image_size,
+        "full_ms": 1000 * float(np.mean(times["full"])),
+        "fast_ms": 1000 * float(np.mean(times["fast"])),
+        "speedup": float(np.sum(times["full"]) / np.sum(times["fast"])),
+        "psnr_db_mean": float(np.mean(psnr)),
+        "psnr_db_min": float(np.min(psnr)),
+        "max_abs_error": float(np.max(max_error)),
+    }
+    print(
+        f"full decode {result['full_ms']:.1f} ms, fast decode {result['fast_ms']:.1f} ms "
+        f"({result['speedup']:.2f}x), PSNR {result['psnr_db_mean']:.1f} dB (min {result['psnr_db_min']:.1f} dB)"
+    )
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+import numpy as np
+import psutil
+import torch
+from torch import nn
+from backend.CONFIG import params
+from backend.utility.get_model import get_model
+
+
+def peak_rss() -> int:
+    """
+    Gets the peak resident memory of this process.
+
+    Returns:
+        int: The peak resident memory in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(model_args: Namespace, device: str, steps: int) -> dict[str, Any]:
+    """
+    Times the training steps of the model and measures their peak memory. Runs in a fresh process for every
+    configuration, so the peak resident memory on the CPU only covers this configuration.
+
+    Args:
+        model_args (Namespace): The arguments of get_model, including batch_size, image_size and memory_efficient.
+        device (str): The device to train on.
+        steps (int): The number of timed steps, after one warm-up step.
+
+    Returns:
+        dict[str, Any]: The mean step time in milliseconds, the memory of the model and the peak memory of the
+            training steps in MiB, or "oom" when the batch does not fit.
+    """
+    torch.manual_seed(0)
+    classifier = get_model(model_args).to(device).train()
+    optimizer = torch.optim.SGD(classifier.parameters(), lr=model_args.lr, momentum=model_args.momentum)
+    images = torch.randn(model_args.batch_size, 3, model_args.image_size, model_args.image_size, device=device)
+    labels = (torch.rand(model_args.batch_size, model_args.num_classes, device=device) > 0.5).float()
+
+    cuda = device.startswith("cuda")
+    if cuda:
+        torch.cuda.synchronize()
+        model_memory = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        model_memory = psutil.Process().memory_info().rss
+
+    times = []
+    try:
+        for step in range(steps + 1):
+            start = time.perf_counter()
+            optimizer.zero_grad(set_to_none=True)
+            loss = nn.functional.binary_cross_entropy_with_logits(classifier(images), labels)
+            loss.backward()
+            optimizer.step()
+            if cuda:
+                torch.cuda.synchronize()
+            if step > 0:
+                times.append(time.perf_counter() - start)
+    except torch.OutOfMemoryError:
+        return {"oom": True}
+    peak = torch.cuda.max_memory_allocated() if cuda else peak_rss()
+    return {
+        "oom": False,
+        "step_ms": 1000 * float(np.mean(times)),
+        "images_per_sec": model_args.batch_size * len(times) / float(np.sum(times)),
+        "model_mib": model_memory / 2**20,
+        "peak_mib": peak / 2**20,
+        "peak_above_model_mib": (peak - model_memory) / 2**20,
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measure the peak memory and the step time of DenseNet per batch size, with and without the memory-efficient dense layers."
+    )
+    parser.add_argument("--model_name", type=str, default=params["MODEL_NAME"], help="The DenseNet version.")
+    parser.add_argument("--image_size", type=int, default=params["IMAGE_SIZE"], help="The image size.")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[8, 16, 32, 64, 128], help="The batch sizes to measure.")
+    parser.add_argument("--steps", type=int, default=3, help="The number of timed steps per configuration.")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="The device to train on.")
+    parser.add_argument("--output", type=str, default="bench_densenet_memory.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    results = []
+    for memory_efficient in (False, True):
+        for batch_size in args.batch_sizes:
+            model_args = Namespace(**{key.lower(): value for key, value in params.items()})
+            model_args.__dict__.update(
+                model_arch="DenseNet",
+                model_name=args.model_name,
+                pretrained=False,
+                image_size=args.image_size,
+                batch_size=batch_size,
+                memory_efficient=memory_efficient,
+            )
+            # A fresh process per configuration, so the peak memory of one does not carry over to the next
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                result = pool.submit(measure, model_args, args.device, args.steps).result()
+            results.append({"memory_efficient": memory_efficient, "batch_size": batch_size, **result})
+            if result["oom"]:
+                print(f"memory_efficient {memory_efficient!s:5s} batch {batch_size:4d}: out of memory")
+                break
+            print(
+                f"memory_efficient {memory_efficient!s:5s} batch {batch_size:4d}: "
+                f"peak {result['peak_mib']:9.1f} MiB ({result['peak_above_model_mib']:9.1f} MiB above the model), "
+                f"{result['step_ms']:9.1f} ms/step, {result['images_per_sec']:7.1f} images/sec"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {"model_name": args.model_name, "image_size": args.image_size, "device": args.device, "results": results},
+            f,
+            indent=4,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import io
+import itertools
+import json
+import platform
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Callable, Iterable
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, default_collate
+from backend.CONFIG import params
+from backend.benchmarks.synthetic import make_chexpert, make_nih
+from backend.classes.CheXpert_Dataset import CheXpert
+from backend.classes.NIH_Dataset import CheXpert as NIH
+from backend.utility.get_transforms import get_transforms
+from backend.utility.load_data import load_data
+
+
+def summarize(seconds: list[float], images_per_step: int = 1) -> dict[str, float]:
+    """
+    Summarizes the timings of a stage.
+
+    Args:
+        seconds (list[float]): The duration of every step in seconds.
+        images_per_step (int): The number of images processed by every step.
+
+    Returns:
+        dict[str, float]: The mean, p50 and p95 latency in milliseconds and the throughput in images per second.
+    """
+    seconds = np.asarray(seconds)
+    return {
+        "mean_ms": 1000 * float(seconds.mean()),
+        "p50_ms": 1000 * float(np.percentile(seconds, 50)),
+        "p95_ms": 1000 * float(np.percentile(seconds, 95)),
+        "images_per_sec": images_per_step * len(seconds) / float(seconds.sum()),
+    }
+
+
+def timed(function: Callable, *args: Any) -> tuple[Any, float]:
+    """
+    Calls a function and measures its duration.
+
+    Args:
+        function (Callable): The function to call.
+        *args (Any): The arguments of the function.
+
+    Returns:
+        tuple[Any, float]: The return value of the function and its duration in seconds.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_stages(
+    image_paths: list[str], labels: np.ndarray, transforms: list[Callable], batch_size: int
+) -> dict[str, dict[str, float] | None]:
+    """
+    Times every stage of the input pipeline separately, in the main process: reading the file, decoding it, every
+    transform, collating the samples into batches and copying the batches to the GPU.
+
+    Args:
+        image_paths (list[str]): The images to load.
+        labels (np.ndarray): The labels of the images.
+        transforms (list[Callable]): The transforms of the Compose used for training, applied in order.
+        batch_size (int): The batch size used for the collation and the copy.
+
+    Returns:
+        dict[str, dict[str, float] | None]: The summary of every stage, the copy is None without a GPU.
+    """
+    times: dict[str, list[float]] = {"read": [], "decode": []}
+    names = [f"transform_{i}_{type(transform).__name__}" for i, transform in enumerate(transforms)]
+    times.update({name: [] for name in names})
+
+    def read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def decode(data: bytes) -> Image.Image:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    samples = []
+    for path, label in zip(image_paths, labels):
+        data, seconds = timed(read, path)
+        times["read"].append(seconds)
+        image, seconds = timed(decode, data)
+        times["decode"].append(seconds)
+        for name, transform in zip(names, transforms):
+            image, seconds = timed(transform, image)
+            times[name].append(seconds)
+        samples.append((image, torch.from_numpy(label)))
+
+    result: dict[str, dict[str, float] | None] = {name: summarize(seconds) for name, seconds in times.items()}
+    batches, collate_times = [], []
+    for start in range(0, len(samples) - batch_size + 1, batch_size):
+        batch, seconds = timed(default_collate, samples[start : start + batch_size])
+        batches.append(batch)
+        collate_times.append(seconds)
+    result["collate"] = summarize(collate_times, batch_size) if collate_times else None
+
+    result["host_to_device"] = None
+    if torch.cuda.is_available() and batches:
+        copy_times = []
+        for images, _ in batches:
+            images = images.pin_memory()
+            torch.cuda.synchronize()
+            start = time.perf_counter()
+            images.to("cuda", non_blocking=True)
+            torch.cuda.synchronize()
+            copy_times.append(time.perf_counter() - start)
+        result["host_to_device"] = summarize(copy_times, batch_size)
+    return result
+
+
+def bench_loader(loader: Iterable, batch_size: int, num_batches: int) -> dict[str, float]:
+    """
+    Times the batches of a DataLoader end to end. The first batch includes the startup of the workers and is reported
+    separately.
+
+    Args:
+        loader (Iterable): The DataLoader.
+        batch_size (int): The batch size of the DataLoader.
+        num_batches (int): The number of batches to time after the first one.
+
+    Returns:
+        dict[str, float]: The time to the first batch in seconds, the p50 and p95 batch latency in milliseconds and
+            the throughput in images per second.
+    """
+    start = time.perf_counter()
+    batches = iter(loader)
+    next(batches)
+    first_batch = time.perf_counter() - start
+    latencies = []
+    start = time.perf_counter()
+    for _ in itertools.islice(batches, num_batches):
+        now = time.perf_counter()
+        latencies.append(now - start)
+        start = now
+    summary = summarize(latencies, batch_size)
+    return {
+        "first_batch_s": first_batch,
+        "batches": len(latencies),
+        "p50_batch_ms": summary["p50_ms"],
+        "p95_batch_ms": summary["p95_ms"],
+        "images_per_sec": summary["images_per_sec"],
+    }
+
+
+def make_args(root_dir: str, image_size: int, **overrides: Any) -> Namespace:
+    """
+    Builds the arguments train.py would get from CONFIG.py.
+
+    Args:
+        root_dir (str): The root directory of the CheXpert dataset.
+        image_size (int): The size the images are resized to.
+        **overrides (Any): Other arguments to override.
+
+    Returns:
+        Namespace: The arguments.
+    """
+    args = Namespace(**{key.lower(): value for key, value in params.items()})
+    args.root_dir = root_dir
+    args.image_size = image_size
+    # load_data only builds the DistributedSampler of the test loader (which needs DDP) for a single device
+    args.devices = 2
+    for key, value in overrides.items():
+        setattr(args, key, value)
+    return args
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measure the throughput and latency of every stage of the input pipeline and of the DataLoaders "
+        "of the CheXpert and NIH datasets, over a sweep of num_workers, batch_size and pin_memory."
+    )
+    parser.add_argument("--root_dir", type=str, default=None, help="The root directory of the CheXpert dataset. Defaults to a synthetic dataset.")
+    parser.add_argument("--nih_dir", type=str, default=None, help="The data directory of the NIH dataset. Defaults to a synthetic dataset.")
+    parser.add_argument("--num_images", type=int, default=2000, help="The number of synthetic images of each dataset.")
+    parser.add_argument("--image_size", type=int, default=params["IMAGE_SIZE"], help="The size the images are resized to.")
+    parser.add_argument("--stage_samples", type=int, default=256, help="The number of samples timed stage by stage.")
+    parser.add_argument("--num_workers", type=int, nargs="+", default=[0, 2, 4], help="The num_workers to sweep.")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[16, 64], help="The batch sizes to sweep.")
+    parser.add_argument("--num_batches", type=int, default=20, help="The number of batches timed per configuration.")
+    parser.add_argument("--output", type=str, default="bench_pipeline.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    synthetic_dir = Path(tempfile.gettempdir()) / "synthetic_pipeline"
+    root_dir = args.root_dir or str(make_chexpert(synthetic_dir, args.num_images, image_size=(2320, 2828)))
+    nih_dir = args.nih_dir or str(make_nih(synthetic_dir, args.num_images))
+    transforms = get_transforms(make_args(root_dir, args.image_size)).transforms
+    chexpert = CheXpert(root_dir=root_dir)
+    nih = NIH(root_dir=str(synthetic_dir), data_dir=nih_dir)
+
+    result: dict[str, Any] = {
+        "host": platform.node(),
+        "cuda": torch.cuda.is_available(),
+        "image_size": args.image_size,
+        "transforms": [repr(transform) for transform in transforms],
+        "stages": {},
+        "loaders": [],
+    }
+    for name, dataset, image_paths in (
+        ("CheXpert", chexpert, [chexpert.image_path(idx) for idx in range(len(chexpert))]),
+        ("NIH", nih, [str(nih.DATA_DIR / nih.image_paths[row]) for row in nih.rows]),
+    ):
+        count = min(args.stage_samples, len(image_paths))
+        labels = dataset.labels if name == "CheXpert" else dataset.labels[dataset.rows]
+        result["stages"][name] = bench_stages(image_paths[:count], labels[:count], transforms, max(args.batch_sizes))
+        print(f"{name} stages:")
+        for stage, summary in result["stages"][name].items():
+            if summary is not None:
+                print(f"  {stage:40s} {summary['mean_ms']:8.2f} ms  {summary['images_per_sec']:10.1f} images/sec")
+
+    for num_workers, batch_size, pin_memory in itertools.product(args.num_workers, args.batch_sizes, (False, True)):
+        train_args = make_args(
+            root_dir, args.image_size, num_workers=num_workers, batch_size=batch_size, pin_memory=pin_memory
+        )
+        nih.transform = get_transforms(train_args)
+        loaders: dict[str, Iterable] = {
+            "CheXpert": load_data(_args=train_args, _transforms=get_transforms(train_args))[0],
+            "NIH": DataLoader(
+                nih,
+                batch_size=batch_size,
+                shuffle=True,
+                num_workers=num_workers,
+                pin_memory=pin_memory,
+            ),
+        }
+        for name, loader in loaders.items():
+            summary = bench_loader(loader, batch_size, args.num_batches)
+            result["loaders"].append(
+                {
+                    "dataset": name,
+                    "num_workers": num_workers,
+                    "batch_size": batch_size,
+                    "pin_memory": pin_memory,
+                    **summary,
+                }
+            )
+            print(
+                f"{name:8s} workers {num_workers:2d} batch {batch_size:4d} pin {pin_memory!s:5s}: "
+                f"{summary['images_per_sec']:8.1f} images/sec, p50 {summary['p50_batch_ms']:8.1f} ms, "
+                f"p95 {summary['p95_batch_ms']:8.1f} ms"
+            )
+        # Shut down the persistent workers before the next configuration
+        del loaders
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any
+import aiohttp
+import numpy as np
+
+SAMPLE_IMAGE = Path(__file__).parents[1] / "sample_xrays" / "patient00002" / "study1" / "view1_frontal.jpg"
+
+
+async def send(session: aiohttp.ClientSession, url: str, image: bytes) -> tuple[float, int]:
+    """
+    Posts an image to the inference server.
+
+    Args:
+        session (aiohttp.ClientSession): The client session.
+        url (str): The URL of the prediction route.
+        image (bytes): The encoded image.
+
+    Returns:
+        tuple[float, int]: The latency in seconds and the status code of the response, 0 when it timed out or the
+            connection failed.
+    """
+    start = time.perf_counter()
+    try:
+        async with session.post(url, data=image, headers={"Content-Type": "image/jpeg"}) as response:
+            await response.read()
+            return time.perf_counter() - start, response.status
+    except (asyncio.TimeoutError, aiohttp.ClientError):
+        return time.perf_counter() - start, 0
+
+
+async def run_rate(
+    session: aiohttp.ClientSession, url: str, images: list[bytes], rate: float, duration: float, seed: int = 0
+) -> dict[str, Any]:
+    """
+    Sends requests with Poisson arrivals at the given rate. The load is open loop, the requests are sent on
+    schedule whether or not the earlier ones were answered, like independent users would.
+
+    Args:
+        session (aiohttp.ClientSession): The client session.
+        url (str): The URL of the prediction route.
+        images (list[bytes]): The encoded images, sent in turn.
+        rate (float): The requests per second.
+        duration (float): The seconds during which requests are sent.
+        seed (int): The random seed of the arrivals.
+
+    Returns:
+        dict[str, Any]: The latency percentiles in milliseconds of the successful requests, the achieved
+            throughput and the number of failed requests.
+    """
+    rng = np.random.default_rng(seed)
+    arrivals = np.cumsum(rng.exponential(1 / rate, int(rate * duration * 2) + 1))
+    arrivals = arrivals[arrivals < duration]
+    start = time.perf_counter()
+    tasks = []
+    for i, arrival in enumerate(arrivals):
+        await asyncio.sleep(max(arrival - (time.perf_counter() - start), 0))
+        tasks.append(asyncio.create_task(send(session, url, images[i % len(images)])))
+    results = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, status in results if status == 200]
+    return {
+        "rate": rate,
+        "requests": len(results),
+        "failed": len(results) - len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "latency_ms_p50": 1000 * float(np.percentile(latencies, 50)) if latencies else None,
+        "latency_ms_p99": 1000 * float(np.percentile(latencies, 99)) if latencies else None,
+        "latency_ms_mean": 1000 * float(np.mean(latencies)) if latencies else None,
+    }
+
+
+async def run(args) -> list[dict[str, Any]]:
+    images = [Path(image).read_bytes() for image in args.images]
+    results = []
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    # No connection limit, or the client would queue the requests instead of the server
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        for rate in args.rates:
+            async with session.get(f"{args.url}/health") as response:
+                before = await response.json()
+            result = await run_rate(session, f"{args.url}/predict", images, rate, args.duration)
+            async with session.get(f"{args.url}/health") as response:
+                after = await response.json()
+            batches = after["batches"] - before["batches"]
+            result["mean_batch_size"] = (after["requests"] - before["requests"]) / batches if batches else 0.0
+            if after["cache"] is not None:
+                lookups = {
+                    name: after["cache"][name] - before["cache"][name] for name in ("memory_hits", "disk_hits", "misses")
+                }
+                result["cache_hit_rate"] = 1 - lookups["misses"] / max(sum(lookups.values()), 1)
+            results.append(result)
+            print(
+                f"{rate:7.1f} requests/sec: {result['throughput']:7.1f} served/sec, "
+                f"p50 {result['latency_ms_p50'] or 0:8.1f} ms, p99 {result['latency_ms_p99'] or 0:8.1f} ms, "
+                f"mean batch {result['mean_batch_size']:5.2f}, cache hit rate {result.get('cache_hit_rate', 0):.2f}, "
+                f"{result['failed']} failed"
+            )
+    return results
+
+
+def main():
+    parser = ArgumentParser(
+        description="Load test the inference server of utility/serve.py: the p50 and p99 latency per request rate."
+    )
+    parser.add_argument("--url", type=str, default="http://localhost:8000", help="The URL of the server.")
+    parser.add_argument(
+        "--images",
+        type=str,
+        nargs="+",
+        default=[str(SAMPLE_IMAGE)],
+        help="The images to send in turn. Repeated images hit the prediction cache of the server, unless it runs with --no-cache.",
+    )
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 2, 5, 10, 20], help="The requests per second to test.")
+    parser.add_argument("--duration", type=float, default=20, help="The seconds of load per rate.")
+    parser.add_argument("--timeout", type=float, default=60, help="The seconds after which a request fails.")
+    parser.add_argument("--output", type=str, default="bench_server.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump({"url": args.url, "images": args.images, "duration": args.duration, "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import json
+import time
+from argparse import ArgumentParser, BooleanOptionalAction, Namespace
+from typing import Callable
+import numpy as np
+import torch
+from torch import Tensor
+from backend.CONFIG import params
+from backend.classes.Classifier import Classifier
+from backend.utility.get_model import create_model
+from backend.utility.get_tta_views import get_tta_views
+
+
+def separate_tta(classifier: Classifier, x: Tensor) -> Tensor:
+    """
+    Computes the test-time augmentation logits the usual way, with one call of the model per view.
+
+    Args:
+        classifier (Classifier): The classifier, for its model and its views.
+        x (Tensor): The batch of images.
+
+    Returns:
+        Tensor: The aggregated logits of every image.
+    """
+    logits = torch.stack(
+        [
+            classifier(get_tta_views(x, classifier.tta_thetas, view * len(x), (view + 1) * len(x)))
+            for view in range(len(classifier.tta_thetas))
+        ]
+    )
+    return logits.mean(dim=0) if classifier.tta_aggregation == "mean" else logits.amax(dim=0)
+
+
+def time_per_image(function: Callable[[], object], batch_size: int, steps: int) -> float:
+    """
+    Times a function, after one warm-up call.
+
+    Args:
+        function (Callable[[], object]): The function to time.
+        batch_size (int): The number of images it processes.
+        steps (int): The number of timed calls.
+
+    Returns:
+        float: The mean time per image in milliseconds.
+    """
+    function()
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.mean(times)) / batch_size
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measure the latency of test-time augmentation per image: all the views stacked in one forward pass, against one call of the model per view."
+    )
+    parser.add_argument("--model_arch", type=str, default=params["MODEL_ARCH"], help="The model architecture.")
+    parser.add_argument("--model_name", type=str, default=params["MODEL_NAME"], help="The model name.")
+    parser.add_argument("--image_size", type=int, default=params["IMAGE_SIZE"], help="The image size.")
+    parser.add_argument(
+        "--tta_flip", action=BooleanOptionalAction, default=params["TTA_FLIP"], help="Whether to add the flipped view."
+    )
+    parser.add_argument(
+        "--tta_shifts", type=float, nargs="*", default=params["TTA_SHIFTS"], help="The shifts of the views."
+    )
+    parser.add_argument(
+        "--tta_scales", type=float, nargs="*", default=params["TTA_SCALES"], help="The crop scales of the views."
+    )
+    parser.add_argument(
+        "--tta_memory_mb", type=float, default=params["TTA_MEMORY_MB"], help="The memory budget of the views."
+    )
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8], help="The batch sizes to measure.")
+    parser.add_argument("--steps", type=int, default=3, help="The number of timed calls per configuration.")
+    parser.add_argument("--output", type=str, default="bench_tta.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    model_args = Namespace(**{key.lower(): value for key, value in params.items()})
+    model_args.__dict__.update(
+        model_arch=args.model_arch,
+        model_name=args.model_name,
+        pretrained=False,
+        tta_flip=args.tta_flip,
+        tta_shifts=args.tta_shifts,
+        tta_scales=args.tta_scales,
+        tta_memory_mb=args.tta_memory_mb,
+    )
+    torch.manual_seed(0)
+    classifier = Classifier(create_model(model_args), model_args).eval()
+    num_views = len(classifier.tta_thetas)
+
+    results = []
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, 3, args.image_size, args.image_size)
+        with torch.inference_mode():
+            single_ms = time_per_image(lambda: classifier(x), batch_size, args.steps)
+            stacked_ms = time_per_image(lambda: classifier.forward_tta(x), batch_size, args.steps)
+            separate_ms = time_per_image(lambda: separate_tta(classifier, x), batch_size, args.steps)
+            difference = (classifier.forward_tta(x) - separate_tta(classifier, x)).abs().max().item()
+        chunk_size = max(int(classifier.tta_memory_bytes // classifier._activation_bytes_per_image(x)), 1)
+        results.append(
+            {
+                "batch_size": batch_size,
+                "views": num_views,
+                "chunks": -(-num_views * batch_size // chunk_size),
+                "single_ms": single_ms,
+                "stacked_ms": stacked_ms,
+                "separate_ms": separate_ms,
+                "speedup": separate_ms / stacked_ms,
+                "max_difference": difference,
+            }
+        )
+        print(
+            f"batch {batch_size:3d}: one view {single_ms:8.1f} ms/image, {num_views} views stacked "
+            f"{stacked_ms:8.1f} ms/image ({stacked_ms / single_ms:.1f}x), {num_views} separate calls "
+            f"{separate_ms:8.1f} ms/image ({separate_ms / single_ms:.1f}x)"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {"model_name": args.model_name, "image_size": args.image_size, "views": num_views, "results": results},
+            f,
+            indent=4,
+        )
+
+
+if __name__ == "__main__":
+    main()
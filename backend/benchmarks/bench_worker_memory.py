@@ -0,0 +1,97 @@
+import json
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+import psutil
+from torch.utils.data import DataLoader
+from torchvision.transforms import Compose, Grayscale, PILToTensor, Resize
+from backend.benchmarks.synthetic import make_chexpert
+from backend.classes.CheXpert_Dataset import CheXpert
+
+
+def worker_memory() -> list[dict[str, int]]:
+    """
+    Measures the memory of the DataLoader worker processes (the children of this process).
+
+    Returns:
+        list[dict[str, int]]: The rss and uss (memory unique to the worker, i.e. pages copied on write) in bytes.
+    """
+    memory = []
+    for child in psutil.Process().children(recursive=True):
+        try:
+            info = child.memory_full_info()
+        except psutil.Error:
+            continue
+        memory.append({"pid": child.pid, "rss": info.rss, "uss": info.uss})
+    return memory
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measure the memory of the DataLoader workers over a full epoch of the CheXpert dataset."
+    )
+    parser.add_argument("--root_dir", type=str, default=None, help="The root directory of the dataset. Defaults to a synthetic dataset.")
+    parser.add_argument("--num_images", type=int, default=20000, help="The number of synthetic images.")
+    parser.add_argument("--num_workers", type=int, default=8, help="The number of DataLoader workers.")
+    parser.add_argument("--batch_size", type=int, default=64, help="The batch size.")
+    parser.add_argument("--image_size", type=int, default=64, help="The size the images are resized to.")
+    parser.add_argument("--samples", type=int, default=20, help="The number of memory samples over the epoch.")
+    parser.add_argument("--output", type=str, default="bench_worker_memory.json", help="The json file to write the results to.")
+    args = parser.parse_args()
+
+    root_dir = args.root_dir or make_chexpert(
+        Path(tempfile.gettempdir()) / "synthetic_chexpert", args.num_images
+    )
+    dataset = CheXpert(
+        root_dir=root_dir,
+        transform=Compose([Grayscale(), Resize((args.image_size, args.image_size)), PILToTensor()]),
+    )
+    loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.num_workers,
+        persistent_workers=True,
+    )
+
+    every = max(len(loader) // args.samples, 1)
+    timeline = []
+    start = time.perf_counter()
+    for batch_idx, _ in enumerate(loader):
+        if batch_idx % every == 0 or batch_idx == len(loader) - 1:
+            workers = worker_memory()
+            timeline.append(
+                {
+                    "batch": batch_idx,
+                    "seconds": time.perf_counter() - start,
+                    "mean_rss": sum(w["rss"] for w in workers) / max(len(workers), 1),
+                    "mean_uss": sum(w["uss"] for w in workers) / max(len(workers), 1),
+                    "workers": workers,
+                }
+            )
+            print(
+                f"batch {batch_idx:6d}/{len(loader)}: "
+                f"worker rss {timeline[-1]['mean_rss'] / 2**20:8.1f} MiB, "
+                f"uss {timeline[-1]['mean_uss'] / 2**20:8.1f} MiB"
+            )
+
+    first, last = timeline[0], timeline[-1]
+    result = {
+        "num_images": len(dataset),
+        "num_workers": args.num_workers,
+        "batch_size": args.batch_size,
+        "rss_growth": last["mean_rss"] - first["mean_rss"],
+        "uss_growth": last["mean_uss"] - first["mean_uss"],
+        "timeline": timeline,
+    }
+    print(
+        f"Worker growth over the epoch: rss {result['rss_growth'] / 2**20:.1f} MiB, "
+        f"uss {result['uss_growth'] / 2**20:.1f} MiB"
+    )
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
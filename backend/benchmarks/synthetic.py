@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from PIL import Image
+from tqdm import tqdm
+from backend.classes.CheXpert_Dataset import CheXpert
+from backend.classes.NIH_Dataset import CheXpert as NIH
+
+
+def make_chexpert(
+    root_dir: str | Path,
+    num_images: int,
+    image_size: tuple[int, int] = (320, 390),
+    seed: int = 0,
+) -> Path:
+    """
+    Writes a synthetic CheXpert dataset with the same directory layout and listfile as the real one, for benchmarks
+    that run without the real data. The images are smooth random noise saved as grayscale JPEGs.
+
+    Args:
+        root_dir (str | Path): The root directory, the dataset is written to root_dir/CheXpert.
+        num_images (int): The number of images to write.
+        image_size (tuple[int, int]): The (width, height) of the images.
+        seed (int): The random seed.
+
+    Returns:
+        Path: The root directory to pass to CheXpert.
+    """
+    rng = np.random.default_rng(seed)
+    data_dir = Path(root_dir) / "CheXpert"
+    listfile = data_dir / "train_visualCheXbert.csv"
+    if listfile.exists() and len(pd.read_csv(listfile, usecols=["Path"])) == num_images:
+        return Path(root_dir)
+
+    # Two views per study and two studies per patient, spread over all the batch directories
+    patient_ids = np.linspace(1, 64540 + num_images // 4, max(num_images // 4, 1)).astype(int)
+    width, height = image_size
+    # A low resolution noise image upscaled, so the JPEGs compress like smooth radiographs
+    base = Image.fromarray(rng.integers(0, 256, (height // 16, width // 16), dtype=np.uint8))
+    base = base.resize(image_size, resample=Image.Resampling.BICUBIC)
+
+    rows = []
+    for i in tqdm(range(num_images), desc="Writing synthetic CheXpert"):
+        patient = patient_ids[i // 4 % len(patient_ids)]
+        study, view = i // 2 % 2 + 1, i % 2 + 1
+        kind = "frontal" if view == 1 else "lateral"
+        path = f"patient{patient:05d}/study{study}/view{view}_{kind}.jpg"
+        batch_dir = CheXpert.BATCH_DIRS[np.searchsorted(CheXpert.BATCH_BOUNDS, patient, side="right")]
+        image_file = data_dir / batch_dir / path
+        image_file.parent.mkdir(parents=True, exist_ok=True)
+        # Vary every image cheaply so the decoder cannot reuse anything
+        base.rotate(i % 360).save(image_file, quality=90)
+        row = {
+            "Path": f"CheXpert-v1.0/train/{path}",
+            "Sex": "Female",
+            "Age": 60,
+            "Frontal/Lateral": kind.capitalize(),
+            "AP/PA": "AP",
+        }
+        row.update(zip(CheXpert.CLASSES, rng.choice([1.0, 0.0, -1.0, np.nan], len(CheXpert.CLASSES))))
+        rows.append(row)
+    pd.DataFrame(rows).to_csv(listfile, index=False)
+    return Path(root_dir)
+
+
+def make_nih(
+    root_dir: str | Path,
+    num_images: int,
+    image_size: tuple[int, int] = (1024, 1024),
+    seed: int = 0,
+) -> Path:
+    """
+    Writes a synthetic NIH dataset with the same files as the Kaggle download, for benchmarks that run without the
+    real data. The images are smooth random noise saved as grayscale PNGs.
+
+    Args:
+        root_dir (str | Path): The root directory, the dataset is written to root_dir/nih.
+        num_images (int): The number of images to write.
+        image_size (tuple[int, int]): The (width, height) of the images.
+        seed (int): The random seed.
+
+    Returns:
+        Path: The data directory to pass to NIH as data_dir.
+    """
+    rng = np.random.default_rng(seed)
+    data_dir = Path(root_dir) / "nih"
+    entries = data_dir / "Data_Entry_2017.csv"
+    if entries.exists() and len(pd.read_csv(entries)) == num_images:
+        return data_dir
+
+    width, height = image_size
+    names = [f"{i:08d}_000.png" for i in range(num_images)]
+    findings = []
+    for i, name in enumerate(tqdm(names, desc="Writing synthetic NIH")):
+        # The Kaggle download spreads the images over 12 directories
+        image_file = data_dir / f"images_{i % 12 + 1:03d}" / "images" / name
+        image_file.parent.mkdir(parents=True, exist_ok=True)
+        noise = rng.integers(0, 256, (height // 16, width // 16), dtype=np.uint8)
+        Image.fromarray(noise).resize(image_size, resample=Image.Resampling.BICUBIC).save(image_file)
+        if rng.random() < 0.5:
+            findings.append("No Finding")
+        else:
+            findings.append("|".join(rng.choice(NIH.CLASSES[:-1], rng.integers(1, 4), replace=False)))
+    split = int(num_images * 0.8)
+    (data_dir / "train_val_list.txt").write_text("\n".join(names[:split]))
+    (data_dir / "test_list.txt").write_text("\n".join(names[split:]))
+    pd.DataFrame({"Image Index": names, "Finding Labels": findings}).to_csv(entries, index=False)
+    return data_dir
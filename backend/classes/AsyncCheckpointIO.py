@@ -0,0 +1,60 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+from lightning.fabric.utilities.apply_func import apply_to_collection
+from lightning.fabric.utilities.types import _PATH
+from lightning.pytorch.plugins.io import TorchCheckpointIO
+from torch import Tensor
+
+
+class AsyncCheckpointIO(TorchCheckpointIO):
+    def __init__(self):
+        """
+        Initializes the checkpoint writer that saves from a background thread. The checkpoint is first copied to a
+        CPU snapshot, so the training loop only waits for the device to host copy, and can keep updating the weights
+        and the optimizer state while the snapshot is written to disk. The saves and the removals of old checkpoints
+        run in order on a single thread.
+        """
+        super(AsyncCheckpointIO, self).__init__()
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: list[Future] = []
+
+    def _submit(self, function: Callable, *args: Any) -> None:
+        """
+        Runs a function on the writer thread, after the ones submitted before it.
+
+        Args:
+            function (Callable): The function to run.
+            *args (Any): The arguments of the function.
+        """
+        # Raise the errors of the writes that already finished instead of losing them
+        for future in [future for future in self._pending if future.done()]:
+            self._pending.remove(future)
+            future.result()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending.append(self._executor.submit(function, *args))
+
+    def save_checkpoint(self, checkpoint: dict[str, Any], path: _PATH, storage_options: Any | None = None) -> None:
+        snapshot = apply_to_collection(checkpoint, Tensor, lambda tensor: tensor.detach().to("cpu", copy=True))
+        self._submit(super(AsyncCheckpointIO, self).save_checkpoint, snapshot, path, storage_options)
+
+    def remove_checkpoint(self, path: _PATH) -> None:
+        self._submit(super(AsyncCheckpointIO, self).remove_checkpoint, path)
+
+    def load_checkpoint(self, path: _PATH, *args: Any, **kwargs: Any) -> dict[str, Any]:
+        self.wait()
+        return super(AsyncCheckpointIO, self).load_checkpoint(path, *args, **kwargs)
+
+    def wait(self) -> None:
+        """
+        Waits for all the pending writes, raising the first error.
+        """
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def teardown(self) -> None:
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
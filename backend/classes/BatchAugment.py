@@ -0,0 +1,131 @@
+import math
+import torch
+from torch import Tensor, nn
+from torch.nn import functional as F
+
+
+class BatchAugment(nn.Module):
+    def __init__(
+        self,
+        mean: list[float],
+        std: list[float],
+        degrees: float = 30.0,
+        translate: tuple[float, float] = (0.30, 0.30),
+        scale: tuple[float, float] = (0.70, 1.30),
+        brightness: float = 0.30,
+        contrast: float = 0.30,
+        flip_p: float = 0.5,
+        interpolation: str = "bilinear",
+    ):
+        """
+        Initializes the batched augmentation stage. It replaces the per-sample RandomHorizontalFlip, RandomAffine,
+        ColorJitter, ToTensor and Normalize transforms of train.py and runs on whole uint8 batches on the device,
+        with independent random parameters for every sample.
+
+        Args:
+            mean (list[float]): The per-channel mean used for normalization.
+            std (list[float]): The per-channel standard deviation used for normalization.
+            degrees (float): The range of the random rotation in degrees (-degrees, +degrees).
+            translate (tuple[float, float]): The maximum horizontal and vertical translation as a fraction of the image size.
+            scale (tuple[float, float]): The range of the random scaling factor.
+            brightness (float): The brightness factor is chosen uniformly from [1 - brightness, 1 + brightness].
+            contrast (float): The contrast factor is chosen uniformly from [1 - contrast, 1 + contrast].
+            flip_p (float): The probability of a horizontal flip.
+            interpolation (str): The interpolation mode passed to grid_sample.
+        """
+        super(BatchAugment, self).__init__()
+        self.degrees = degrees
+        self.translate = translate
+        self.scale = scale
+        self.brightness = brightness
+        self.contrast = contrast
+        self.flip_p = flip_p
+        self.interpolation = interpolation
+        # Not persistent so the model state_dict is unchanged
+        self.register_buffer("mean", torch.tensor(mean).view(1, -1, 1, 1), persistent=False)
+        self.register_buffer("std", torch.tensor(std).view(1, -1, 1, 1), persistent=False)
+
+    def forward(self, images: Tensor, augment: bool = True) -> Tensor:
+        """
+        Augments and normalizes a batch of images.
+
+        Args:
+            images: The uint8 batch with shape (B, H, W), (B, 1, H, W) or (B, 3, H, W).
+            augment: Whether to apply the random augmentations. Only normalization is applied otherwise.
+
+        Returns:
+            The normalized float batch with shape (B, 3, H, W).
+        """
+        if images.ndim == 3:
+            images = images.unsqueeze(1)
+        x = images.to(torch.float32).div_(255)
+        if augment:
+            x = self._affine(x)
+            x = self._color_jitter(x)
+        # A single channel batch is broadcast to the 3 channels of mean and std
+        return (x - self.mean) / self.std
+
+    def _uniform(self, low: float, high: float, n: int, device: torch.device) -> Tensor:
+        """
+        Samples n values uniformly from [low, high).
+        """
+        return torch.empty(n, device=device).uniform_(low, high)
+
+    def _affine(self, x: Tensor) -> Tensor:
+        """
+        Applies a random horizontal flip followed by a random affine transform (rotation, translation and scale)
+        to every sample with a single grid_sample call.
+
+        Args:
+            x: The float batch with shape (B, C, H, W).
+
+        Returns:
+            The transformed batch. Pixels outside the source image are filled with 0.
+        """
+        n, _, h, w = x.shape
+        device = x.device
+        angle = self._uniform(-self.degrees, self.degrees, n, device) * (math.pi / 180)
+        scale = self._uniform(self.scale[0], self.scale[1], n, device)
+        tx = self._uniform(-self.translate[0], self.translate[0], n, device) * w
+        ty = self._uniform(-self.translate[1], self.translate[1], n, device) * h
+        flip = torch.where(torch.rand(n, device=device) < self.flip_p, -1.0, 1.0)
+
+        # Inverse mapping from output to input pixel coordinates (relative to the image center):
+        # p_in = Flip @ Rotate(-angle) @ (p_out - t) / scale
+        cos, sin = torch.cos(angle) / scale, torch.sin(angle) / scale
+        inverse = torch.stack(
+            [
+                torch.stack([flip * cos, flip * sin], dim=-1),
+                torch.stack([-sin, cos], dim=-1),
+            ],
+            dim=1,
+        )
+        # Convert from pixel coordinates to the normalized [-1, 1] coordinates of affine_grid
+        half = torch.tensor([w / 2, h / 2], device=device)
+        matrix = inverse * half.view(1, 1, 2) / half.view(1, 2, 1)
+        offset = -(inverse @ torch.stack([tx, ty], dim=-1).unsqueeze(-1)) / half.view(1, 2, 1)
+        theta = torch.cat([matrix, offset], dim=-1)
+
+        grid = F.affine_grid(theta, list(x.shape), align_corners=False)
+        return F.grid_sample(
+            x, grid, mode=self.interpolation, padding_mode="zeros", align_corners=False
+        )
+
+    def _color_jitter(self, x: Tensor) -> Tensor:
+        """
+        Applies a random brightness and contrast change to every sample.
+
+        Args:
+            x: The float batch in [0, 1] with shape (B, C, H, W).
+
+        Returns:
+            The jittered batch clamped to [0, 1].
+        """
+        n = x.shape[0]
+        shape = (n, 1, 1, 1)
+        brightness = self._uniform(1 - self.brightness, 1 + self.brightness, n, x.device)
+        x = (x * brightness.view(shape)).clamp_(0, 1)
+        contrast = self._uniform(1 - self.contrast, 1 + self.contrast, n, x.device).view(shape)
+        # Blend with the mean intensity of each image, as ColorJitter does for grayscale images
+        mean = x.mean(dim=(1, 2, 3), keepdim=True)
+        return (contrast * x + (1 - contrast) * mean).clamp_(0, 1)
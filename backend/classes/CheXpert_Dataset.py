@@ -1,3 +1,6 @@
+import os
+from functools import cached_property
+from multiprocessing.sharedctypes import RawValue
 import pandas as pd
 import numpy as np
 from pathlib import Path
@@ -6,6 +9,7 @@ from PIL import Image
 from torch import Tensor, torch
 from torch.utils.data import Dataset
 import tqdm
+from backend.utility.open_image import open_image
 
 
 class CheXpert(Dataset):
@@ -48,22 +52,96 @@ class CheXpert(Dataset):
         "Support Devices",
     ]
 
-    def __init__(self, root_dir: str = ".", train: bool = True, transform: Any = None):
+    # Directories of the patient id ranges, indexed by the batch code of a sample
+    BATCH_DIRS = [
+        "CheXpert-v1.0 batch 2 (train 1)",
+        "CheXpert-v1.0 batch 3 (train 2)",
+        "CheXpert-v1.0 batch 4 (train 3)",
+        "CheXpert-v1.0 batch 1 (validate & csv)/valid",
+    ]
+    # First patient id of the next batch directory
+    BATCH_BOUNDS = [21514, 43018, 64541]
+
+    # Bit i of a packed label is the label of CLASSES[i]
+    LABEL_SHIFTS = np.arange(14, dtype=np.uint16)
+
+    # Bump when the manifest layout changes so old manifests are rebuilt
+    MANIFEST_VERSION = 2
+
+    def __init__(
+        self,
+        root_dir: str = ".",
+        train: bool = True,
+        transform: Any = None,
+        use_cache: bool = False,
+        image_size: int = 512,
+        fast_decode: bool = False,
+        cache_sizes: list[int] | None = None,
+    ):
         """Initialize the CheXpert dataset.
 
         Args:
             root (str, optional): root directory. Defaults to ".".
             train (bool, optional): Whether to load training data. Defaults to True.
             transform (Any, optional): Image transforms. Defaults to None.
+            use_cache (bool, optional): Whether to read the images from the preprocessed cache built by
+                utility/build_cache.py instead of decoding the JPEGs. Defaults to False.
+            image_size (int, optional): The image size of the cache to read from, and the size the fast decode
+                path decodes to. Defaults to 512.
+            fast_decode (bool, optional): Whether to decode the JPEGs at the smallest scale that is still at least
+                image_size. Defaults to False.
+            cache_sizes (list[int], optional): The cached image sizes that set_image_size can switch between, for
+                progressive resizing. Defaults to only image_size.
         """
         self.ROOT_DIR = Path(root_dir)
         self.DATA_DIR: Path = Path(self.ROOT_DIR) / "CheXpert"
         self.train = train
         self.transform = transform
-        self.image_paths, self.labels = self._get_image_paths_labels()
-        self.image_paths = np.array(self.image_paths)
-        self.labels = np.array(self.labels)
+        self.use_cache = use_cache
+        self.image_size = image_size
+        self.fast_decode = fast_decode
+        self._data_dir = str(self.DATA_DIR.absolute())
+        # Per-sample metadata is kept in flat numeric arrays so that the DataLoader workers never touch
+        # per-sample Python objects, whose refcount updates would copy the shared pages (copy-on-write).
+        samples = self._get_samples()
+        self.batch_codes: np.ndarray = samples["batch_codes"]
+        self.patients: np.ndarray = samples["patients"]
+        self.studies: np.ndarray = samples["studies"]
+        self.views: np.ndarray = samples["views"]
+        self.lateral: np.ndarray = samples["lateral"]
+        self.label_bits: np.ndarray = samples["label_bits"]
+        # The memory-mapped caches are opened lazily so that every DataLoader worker maps them itself
+        self._caches: dict[int, np.memmap] = {}
+        self.cache_sizes = sorted(set(cache_sizes or []) | {image_size})
+        # Shared with the DataLoader workers, so set_image_size also reaches persistent workers
+        self._current_size = RawValue("i", image_size)
+        if self.use_cache:
+            paths = self.relative_paths()
+            for size in self.cache_sizes:
+                self._check_cache(size, paths)
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Drop the memory-mapped caches when pickling the dataset for the DataLoader workers.
 
+        Returns:
+            dict[str, Any]: The state of the dataset without the opened caches and the decoded labels.
+        """
+        state = self.__dict__.copy()
+        state["_caches"] = {}
+        # The workers decode the labels of their samples from the packed bits
+        state.pop("labels", None)
+        return state
+
+    def set_image_size(self, image_size: int) -> None:
+        """Switch the cache level that the samples are read from, in this process and in the DataLoader workers.
+        Call it between epochs, before the DataLoader iterator is created.
+
+        Args:
+            image_size (int): One of the cache_sizes.
+        """
+        if image_size not in self.cache_sizes:
+            raise ValueError(f"Image size {image_size} is not one of the cache sizes {self.cache_sizes}.")
+        self._current_size.value = image_size
 
     def __len__(self):
         """Get the length of the dataset.
@@ -71,7 +149,7 @@ class CheXpert(Dataset):
         Returns:
             Int: The length of the dataset (number of images).
         """
-        return len(self.image_paths)
+        return len(self.patients)
 
     def __getitem__(self, idx: int) -> tuple[Image.Image, Tensor]:
         """Get the image and label at the given index.
@@ -82,90 +160,110 @@ class CheXpert(Dataset):
         Returns:
             tuple[Image.Image, Tensor]: The image and label at the given index.
         """
-        image_path = self.image_paths[idx]
-        image = Image.open(image_path)
+        if self.use_cache:
+            size = self._current_size.value
+            if size not in self._caches:
+                self._caches[size] = self._open_cache(size)
+            # Image.fromarray maps the memory of the cache row, the image is not copied
+            image = Image.fromarray(self._caches[size][idx])
+        else:
+            image = open_image(
+                self.image_path(idx), self.image_size if self.fast_decode else None
+            )
         if self.transform:
             image = self.transform(image)
 
-        return image, self.labels[idx]
+        label = (self.label_bits[idx] >> CheXpert.LABEL_SHIFTS) & 1
+        return image, torch.from_numpy(label.astype(np.float32))
 
-    def _read_listfile(self, listfile: Path) -> tuple[list[str], list[Tensor]]:
-        """Read the listfile and return the image paths and labels.
+    @cached_property
+    def labels(self) -> np.ndarray:
+        """Get the labels of all the samples, decoded from the packed bits on the first access.
+
+        Returns:
+            np.ndarray: The (N, 14) float32 label matrix.
+        """
+        return ((self.label_bits[:, None] >> CheXpert.LABEL_SHIFTS) & 1).astype(np.float32)
+
+    def relative_path(self, idx: int) -> str:
+        """Rebuild the path of an image relative to the data directory from its numeric metadata.
+
+        Args:
+            idx (int): The index of the image.
+
+        Returns:
+            str: The relative image path.
+        """
+        view = "lateral" if self.lateral[idx] else "frontal"
+        return (
+            f"{CheXpert.BATCH_DIRS[self.batch_codes[idx]]}/patient{self.patients[idx]:05d}"
+            f"/study{self.studies[idx]}/view{self.views[idx]}_{view}.jpg"
+        )
+
+    def image_path(self, idx: int) -> str:
+        """Rebuild the absolute path of an image from its numeric metadata.
+
+        Args:
+            idx (int): The index of the image.
+
+        Returns:
+            str: The absolute image path.
+        """
+        return f"{self._data_dir}/{self.relative_path(idx)}"
+
+    def _read_listfile(self, listfile: Path) -> dict[str, np.ndarray]:
+        """Read the listfile and return the numeric metadata of the images.
 
         Args:
             listfile (Path): csv file containing the image paths and labels.
 
         Returns:
-            tuple[list[str], list[Tensor]]: The image paths and corresponding labels.
+            dict[str, np.ndarray]: The batch codes, patient, study and view numbers, lateral flags and packed labels.
         """
         data = pd.read_csv(listfile)
         # training on only frontal x-rays
         # data = data[data["Frontal/Lateral"] == "Frontal"]
 
-        images_paths: list[str] = data["Path"].tolist()
-
-        images_paths = list(
-            map(
-                lambda s: s.replace("CheXpert-v1.0/train/", "").replace(
-                    "CheXpert-v1.0/valid/", ""
-                ),
-                images_paths,
-            )
+        parts = data["Path"].str.extract(
+            r"^CheXpert-v1\.0/(?:train|valid)/patient(\d+)/study(\d+)/view(\d+)_(frontal|lateral)\.jpg$"
         )
-        images_paths = self._generate_full_patient_paths(images_paths)
+        if parts.isna().any(axis=None):
+            raise ValueError(f"Unexpected image paths in {listfile}")
+        patients = parts[0].astype(np.int32).to_numpy()
 
         # Assigning uncertain labels according to each class's performance.
-        labels = data[CheXpert.CLASSES].replace(-1, 0).fillna(0)
-        labels.update((data[CheXpert.POS_CLASSES].replace(-1, 1).fillna(0)))
-        labels = labels.values
-        labels = [torch.from_numpy(row) for row in labels]
-
-        return images_paths, labels
+        labels = data[CheXpert.CLASSES].to_numpy(dtype=np.float32)
+        positive = np.isin(CheXpert.CLASSES, CheXpert.POS_CLASSES).astype(np.float32)
+        labels = np.where(labels == -1, positive, labels)
+        labels = np.nan_to_num(labels, nan=0.0).astype(np.uint16)
+
+        return {
+            "batch_codes": self._get_batch_codes(patients),
+            "patients": patients,
+            "studies": parts[1].astype(np.int16).to_numpy(),
+            "views": parts[2].astype(np.int8).to_numpy(),
+            "lateral": (parts[3] == "lateral").to_numpy(),
+            "label_bits": (labels << CheXpert.LABEL_SHIFTS).sum(axis=1, dtype=np.uint16),
+        }
 
-    def _generate_full_patient_paths(self, paths: list[str]) -> list[str]:
-        """Generate the full path to the images based on the patient id.
+    @staticmethod
+    def _get_batch_codes(patient_ids: np.ndarray) -> np.ndarray:
+        """Get the batch directory of every image from its patient id.
 
         Args:
-            paths (list[str]): The list of incomplete image paths.
+            patient_ids (np.ndarray): The patient ids.
 
         Returns:
-            list[str]: The list of full image paths.
-        """
-
-        for p, path in enumerate(paths):
-            patient_id = int(path[7:12])
-            if patient_id < 21514:
-                paths[p] = (
-                    str(self.DATA_DIR.absolute())
-                    + "/CheXpert-v1.0 batch 2 (train 1)/"
-                    + path
-                )
-            elif patient_id < 43018:
-                paths[p] = (
-                    str(self.DATA_DIR.absolute())
-                    + "/CheXpert-v1.0 batch 3 (train 2)/"
-                    + path
-                )
-            elif patient_id < 64541:
-                paths[p] = (
-                    str(self.DATA_DIR.absolute())
-                    + "/CheXpert-v1.0 batch 4 (train 3)/"
-                    + path
-                )
-            else:
-                paths[p] = (
-                    str(self.DATA_DIR.absolute())
-                    + "/CheXpert-v1.0 batch 1 (validate & csv)/valid/"
-                    + path
-                )
-
-        return paths
-
-    def _get_image_paths_labels(self) -> tuple[list[str], list[Tensor]]:
-        """Get the image paths and labels from the csv file.
+            np.ndarray: The indices into BATCH_DIRS.
+        """
+        return np.searchsorted(CheXpert.BATCH_BOUNDS, patient_ids, side="right").astype(np.uint8)
+
+    def _get_samples(self) -> dict[str, np.ndarray]:
+        """Get the numeric metadata of the images from the manifest, parsing the csv file and writing the manifest
+        if it is missing or older than the csv file.
 
         Returns:
-            tuple[list[str], list[Tensor]]: The image paths and corresponding labels.
+            dict[str, np.ndarray]: The batch codes, patient, study and view numbers, lateral flags and packed labels.
         """
         if self.train:
             # using only binary labels
@@ -177,7 +275,113 @@ class CheXpert(Dataset):
                 / "valid.csv"
             )
 
-        return self._read_listfile(listfile)
+        stat = listfile.stat()
+        manifest = self.manifest_file()
+        if manifest.exists():
+            with np.load(manifest) as data:
+                if (
+                    int(data["version"]) == CheXpert.MANIFEST_VERSION
+                    and int(data["source_size"]) == stat.st_size
+                    and int(data["source_mtime_ns"]) == stat.st_mtime_ns
+                ):
+                    return {key: data[key] for key in data.files}
+
+        samples = self._read_listfile(listfile)
+        self._write_manifest(
+            manifest,
+            version=CheXpert.MANIFEST_VERSION,
+            source_size=stat.st_size,
+            source_mtime_ns=stat.st_mtime_ns,
+            **samples,
+        )
+        return samples
+
+    def manifest_file(self) -> Path:
+        """Get the path of the manifest of this split.
+
+        Returns:
+            Path: The npz manifest file.
+        """
+        split = "train" if self.train else "valid"
+        return self.DATA_DIR / "manifest" / f"{split}.npz"
+
+    @staticmethod
+    def _write_manifest(manifest: Path, **arrays: Any) -> None:
+        """Write the manifest atomically, so ranks constructing the dataset at the same time never read a partial file.
+
+        Args:
+            manifest (Path): The npz manifest file.
+            **arrays (Any): The arrays to store in the manifest.
+        """
+        manifest.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = manifest.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "wb") as f:
+            np.savez(f, **arrays)
+        tmp_file.replace(manifest)
+
+    def cache_files(self, image_size: int) -> tuple[Path, Path]:
+        """Get the paths of the cache data file and its index file for the given image size.
+
+        Args:
+            image_size (int): The size of the cached images.
+
+        Returns:
+            tuple[Path, Path]: The raw uint8 data file and the npz index file.
+        """
+        split = "train" if self.train else "valid"
+        cache_dir = self.DATA_DIR / "cache"
+        return (
+            cache_dir / f"{split}_{image_size}.u8",
+            cache_dir / f"{split}_{image_size}_index.npz",
+        )
+
+    def relative_paths(self) -> np.ndarray:
+        """Get the image paths relative to the data directory.
+
+        Returns:
+            np.ndarray: The relative image paths, in dataset order.
+        """
+        return np.array([self.relative_path(idx) for idx in range(len(self))])
+
+    def _check_cache(self, image_size: int, paths: np.ndarray) -> None:
+        """Check that the cache exists and was built from the same listfile as this dataset.
+
+        Args:
+            image_size (int): The size of the cached images.
+            paths (np.ndarray): The relative image paths of this dataset.
+
+        Raises:
+            FileNotFoundError: If the cache has not been built for this split and image size.
+            RuntimeError: If the cache does not match the images of this dataset.
+        """
+        data_file, index_file = self.cache_files(image_size)
+        if not data_file.exists() or not index_file.exists():
+            raise FileNotFoundError(
+                f"No image cache found at {data_file}. Build it with utility/build_cache.py first."
+            )
+        with np.load(index_file) as index:
+            cached_paths = index["paths"]
+        if len(cached_paths) != len(self) or not np.array_equal(cached_paths, paths):
+            raise RuntimeError(
+                f"The image cache at {data_file} is out of date. Rebuild it with utility/build_cache.py."
+            )
+
+    def _open_cache(self, image_size: int) -> np.memmap:
+        """Open the memory-mapped cache read-only.
+
+        Args:
+            image_size (int): The size of the cached images.
+
+        Returns:
+            np.memmap: The cached images with shape (N, image_size, image_size).
+        """
+        data_file, _ = self.cache_files(image_size)
+        return np.memmap(
+            data_file,
+            dtype=np.uint8,
+            mode="r",
+            shape=(len(self), image_size, image_size),
+        )
 
     @staticmethod
     def get_decoded(encoded: Tensor) -> list[str]:
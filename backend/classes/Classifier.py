@@ -1,17 +1,18 @@
-import numpy as np
 import timm
 import timm.optim
 import torch
 from argparse import Namespace
+from contextlib import nullcontext
 from lightning import LightningModule
 from torch import Tensor, nn
-from torchmetrics.functional import accuracy, confusion_matrix, f1_score, auroc, precision_recall_curve, precision, recall
-from torcheval.metrics.functional.aggregation.auc import auc
+from torchmetrics import MetricCollection
 from typing import Any, Literal
+from backend.classes.BatchAugment import BatchAugment
+from backend.classes.HistogramAUC import HistogramAUC
+from backend.utility.get_metrics import get_metrics
+from backend.utility.get_tta_views import get_tta_thetas, get_tta_views
 #from backend.classes.ClearMLLogger import ClearMLLogger
 import matplotlib.pyplot as plt
-from sklearn.metrics import roc_auc_score
-import numpy as np
 
 
 class FocalLoss(nn.Module):
@@ -58,6 +59,26 @@ class FocalLoss(nn.Module):
         else:
             return focal_loss  # Return un-reduced loss
 
+def scale_lr(lr: float, ratio: float, scaling: str) -> float:
+    """
+    Scales the learning rate tuned for the base batch size to the effective batch size.
+    Args:
+        lr: The learning rate at the base batch size.
+        ratio: The effective batch size divided by the base batch size.
+        scaling: "linear" (SGD), "sqrt" (adaptive optimizers such as AdamW) or "none".
+
+    Returns: The learning rate at the effective batch size.
+
+    """
+    if scaling == "linear":
+        return lr * ratio
+    elif scaling == "sqrt":
+        return lr * ratio**0.5
+    elif scaling == "none":
+        return lr
+    raise ValueError("Invalid learning rate scaling. Please choose either linear, sqrt or none.")
+
+
 class Classifier(LightningModule):
     def __init__(self, model: nn.Module, args: Namespace):
         """
@@ -69,11 +90,42 @@ class Classifier(LightningModule):
         super(Classifier, self).__init__()
         self.clearml_logger = None
         self.model = model
-        self.lr = args.lr
+        # Samples per optimizer step, over the accumulated batches of all the devices
+        self.effective_batch_size = (
+            args.batch_size * getattr(args, "accumulate_grad_batches", 1) * getattr(args, "devices", 1)
+        )
+        self.lr = scale_lr(
+            args.lr,
+            self.effective_batch_size / getattr(args, "base_batch_size", self.effective_batch_size),
+            getattr(args, "lr_scaling", "none"),
+        )
+        self.warmup_epochs = getattr(args, "warmup_epochs", 0)
         self.weight_decay = args.weight_decay
         self.momentum = args.momentum
         self.optimizer = args.optimizer
         self.num_classes = args.num_classes
+        # Execution mode, the model itself is converted and compiled by get_model
+        self.channels_last = getattr(args, "channels_last", False)
+        self.compile_warmup = getattr(args, "compile_warmup", 0) if getattr(args, "compile", False) else 0
+        self.warmup_batch_size = args.batch_size
+        self.warmup_image_size = args.image_size
+        # Batched augmentation on the device, the DataLoader workers then only decode and collate uint8 images
+        self.augment = (
+            BatchAugment(mean=args.mean, std=args.std)
+            if getattr(args, "batch_augment", False)
+            else None
+        )
+        # Stateful metrics of every stage, updated every step and computed once per epoch
+        thresholds = getattr(args, "metric_thresholds", 200)
+        self.train_metrics = get_metrics(
+            getattr(args, "train_metrics", ["accuracy"]), self.num_classes, "train", thresholds
+        )
+        self.val_metrics = get_metrics(
+            getattr(args, "val_metrics", ["accuracy"]), self.num_classes, "val", thresholds
+        )
+        self.test_metrics = get_metrics(
+            getattr(args, "test_metrics", ["accuracy"]), self.num_classes, "test", thresholds
+        )
 
         self.class_names = [
             "Enlarged Cardiomediastinum", 
@@ -98,20 +150,129 @@ class Classifier(LightningModule):
         self.val_losses = []
         self.val_accs = []
         
-        self.roc = []
+        # Per-class test ROC AUC, with a memory that does not grow with the test set
+        self.test_auc = HistogramAUC(self.num_classes, getattr(args, "test_auc_bins", 10000))
+
+        # Test-time augmentation, the views of a batch run through the model as stacked batches
+        self.tta = getattr(args, "tta", False)
+        self.tta_aggregation = getattr(args, "tta_aggregation", "mean")
+        if self.tta_aggregation not in ("mean", "max"):
+            raise ValueError("Invalid test-time augmentation aggregation. Please choose either mean or max.")
+        self.tta_memory_bytes = getattr(args, "tta_memory_mb", 2048) * 2**20
+        self.register_buffer(
+            "tta_thetas",
+            get_tta_thetas(
+                getattr(args, "tta_flip", True), getattr(args, "tta_shifts", [0.05]), getattr(args, "tta_scales", [0.9])
+            ),
+            persistent=False,
+        )
+        # Estimated activation memory of one image, per image size
+        self._activation_bytes: dict[tuple[int, ...], int] = {}
 
     def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
         return self.model(x)
 
+    def forward_tta(self, x: Tensor) -> Tensor:
+        """
+        Runs the test-time augmentation views of a batch through the model, in as few stacked batches as the memory
+        budget allows, and aggregates the logits of the views of every image.
+        Args:
+            x: The batch of images.
+
+        Returns: The aggregated logits of every image.
+
+        """
+        num_views = len(self.tta_thetas) * len(x)
+        chunk_size = max(int(self.tta_memory_bytes // self._activation_bytes_per_image(x)), 1)
+        logits = torch.cat(
+            [
+                self(get_tta_views(x, self.tta_thetas, start, min(start + chunk_size, num_views)))
+                for start in range(0, num_views, chunk_size)
+            ]
+        ).view(len(self.tta_thetas), len(x), -1)
+        return logits.mean(dim=0) if self.tta_aggregation == "mean" else logits.amax(dim=0)
+
+    def _activation_bytes_per_image(self, x: Tensor) -> int:
+        """
+        Estimates the activation memory of one image as the sum of the outputs of all the layers, measured once per
+        image size. It is an upper bound without gradients, where the outputs are freed as the forward pass goes.
+        Args:
+            x: The batch of images.
+
+        Returns: The estimated bytes per image, including the image itself.
+
+        """
+        size = tuple(x.shape[1:])
+        if size not in self._activation_bytes:
+            total = x[0].numel() * x.element_size()
+
+            def count(module: nn.Module, inputs: Any, output: Any) -> None:
+                nonlocal total
+                if isinstance(output, Tensor):
+                    total += output.numel() * output.element_size()
+
+            handles = [
+                module.register_forward_hook(count)
+                for module in self.model.modules()
+                if next(module.children(), None) is None
+            ]
+            try:
+                with torch.no_grad():
+                    self(x[:1])
+            finally:
+                for handle in handles:
+                    handle.remove()
+            self._activation_bytes[size] = total
+        return self._activation_bytes[size]
+
+    def warm_up(self, steps: int, batch_size: int, image_size: int) -> None:
+        """
+        Runs training steps (forward and backward, no optimizer step) on random data, which triggers the
+        compilation of a compiled model. The batch norm statistics are restored and the gradients are cleared
+        afterward, so the warm-up does not change the model.
+        Args:
+            steps: The number of steps.
+            batch_size: The batch size of the random data.
+            image_size: The image size of the random data.
+
+        """
+        buffers = {name: buffer.clone() for name, buffer in self.model.named_buffers()}
+        # Same autocast as the training steps, e.g. bf16-mixed, so the same graphs are compiled
+        context = self._trainer.precision_plugin.forward_context if self._trainer is not None else nullcontext
+        was_training = self.training
+        self.train()
+        for _ in range(steps):
+            with context():
+                logits = self(torch.randn(batch_size, 3, image_size, image_size, device=self.device))
+            logits.float().mean().backward()
+        self.train(was_training)
+        self.model.zero_grad(set_to_none=True)
+        with torch.no_grad():
+            for name, buffer in self.model.named_buffers():
+                buffer.copy_(buffers[name])
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        """
+        Augments and normalizes the uint8 images of the batch on the device when batch augmentation is enabled.
+        The random augmentations are only applied while training, validation and test batches are only normalized.
+        """
+        if self.augment is None:
+            return batch
+        _images, _labels = batch
+        return self.augment(_images, augment=self.trainer.training), _labels
+
     def training_step(self, batch: Any, batch_idx: int):
         metrics = self._calculate_metrics(batch)
+        self.train_metrics.update(metrics["probabilities"], metrics["labels"])
         self.log("loss/train", metrics["loss"], on_epoch=True, on_step=False, sync_dist=True)
-        self.log("accuracy/train", metrics["accuracy"], on_epoch=True, on_step=False, sync_dist=True)
         return metrics["loss"]
     
     def on_train_epoch_end(self):
         """Print training metrics after each epoch"""
 
+        self._log_epoch_metrics(self.train_metrics)
         avg_loss = self.trainer.callback_metrics.get("loss/train")
         avg_acc = self.trainer.callback_metrics.get("accuracy/train")
 
@@ -126,13 +287,14 @@ class Classifier(LightningModule):
 
     def validation_step(self, batch: Any, batch_idx: int):
         metrics = self._calculate_metrics(batch)
+        self.val_metrics.update(metrics["probabilities"], metrics["labels"])
         self.log("loss/val", metrics["loss"], on_epoch=True, sync_dist=True)
-        self.log("accuracy/val", metrics["accuracy"], on_epoch=True, sync_dist=True)
         return metrics["loss"]
     
     def on_validation_epoch_end(self):
         """Print validation metrics after each epoch"""
 
+        self._log_epoch_metrics(self.val_metrics)
         avg_loss = self.trainer.callback_metrics.get("loss/val")
         avg_acc = self.trainer.callback_metrics.get("accuracy/val")
 
@@ -145,6 +307,19 @@ class Classifier(LightningModule):
               f"Val Loss: {avg_loss:.4f}, "
               f"Val Acc: {avg_acc:.2f}%")
         
+    def on_save_checkpoint(self, checkpoint: dict[str, Any]) -> None:
+        """Keep the training history in the checkpoints, so the curves of a resumed run are complete"""
+        checkpoint["history"] = {
+            "train_losses": self.train_losses,
+            "train_accs": self.train_accs,
+            "val_losses": self.val_losses,
+            "val_accs": self.val_accs,
+        }
+
+    def on_load_checkpoint(self, checkpoint: dict[str, Any]) -> None:
+        for name, values in checkpoint.get("history", {}).items():
+            setattr(self, name, list(values))
+
     def on_train_end(self):
         """Save training metrics plot at end of training"""
 
@@ -171,14 +346,9 @@ class Classifier(LightningModule):
         plt.close()
 
     def test_step(self, batch: Any, batch_idx: int):
-        metrics = self._calculate_metrics(batch)
+        metrics = self._calculate_metrics(batch, tta=self.tta)
+        self.test_metrics.update(metrics["probabilities"], metrics["labels"])
         self.log("test loss", metrics["loss"], on_epoch=True, sync_dist=True)
-        self.log("test accuracy", metrics["accuracy"], on_epoch=True, sync_dist=True)
-        self.log("test precision", metrics["precision"], on_epoch=True, sync_dist=True)
-        self.log("test recall", metrics["recall"], on_epoch=True, sync_dist=True)
-        self.log("test f1 score", metrics["f1_score"], on_epoch=True, sync_dist=True)
-        self.log("test roc1:", metrics["roc1"], on_epoch=True, sync_dist=True)
-        self.log("test auprc:", metrics["auprc"], on_epoch=True, sync_dist=True)
         # # noinspection all
         # clearml_logger: ClearMLLogger = self.loggers[1]
         # # noinspection PyUnresolvedReferences
@@ -189,49 +359,42 @@ class Classifier(LightningModule):
         #     matrix=metrics["confusion"].numpy(force=True),
         # )
 
-        # Return predictions and labels for ROC AUC calculation
-        
-        self.roc.append({
-            "loss": metrics["loss"],
-            "probabilities": metrics["probabilities"],
-            "labels": metrics["labels"]
-        })
+        # Accumulate the predictions in the fixed-size histograms for the per-class ROC AUC calculation
+        self.test_auc.update(metrics["probabilities"], metrics["labels"])
+        return metrics["loss"]
 
-        return {
-            "loss": metrics["loss"],
-            "probabilities": metrics["probabilities"],
-            "labels": metrics["labels"]
-        }
-    
 
     def on_test_epoch_end(self):
 
-        outputs = self.roc
-        # Concatenate all batches
-        all_probs = torch.cat([x["probabilities"] for x in outputs]).cpu().to(torch.float32).numpy()
-        all_labels = torch.cat([x["labels"] for x in outputs]).cpu().numpy()
-        
-        # Calculate ROC AUC for each disease
-        roc_auc_scores = []
-        for i in range(self.num_classes):
-            try:
-                score = roc_auc_score(all_labels[:, i], all_probs[:, i])
-                self.log(f"roc_auc/{self.class_names[i]}", score, sync_dist=True)
-                roc_auc_scores.append(score)
-                
-            except ValueError as e:
-                print(f"Could not calculate ROC AUC for {self.class_names[i]}: {e}")
+        self._log_epoch_metrics(self.test_metrics)
+        # The histograms of all the ranks are summed before the curves of all the classes are computed at once
+        scores = self.test_auc.compute()
+        for i, class_name in enumerate(self.class_names):
+            if torch.isnan(scores["auroc"][i]):
+                print(f"Could not calculate ROC AUC for {class_name}: it needs positive and negative samples")
                 continue
-        
-        # Calculate weighted average ROC AUC
-        # Using the number of positive samples for each class as weights
-        class_weights = all_labels.sum(axis=0)
-        weighted_avg_roc_auc = np.average(roc_auc_scores, weights=class_weights)
-        
-        self.log("test_weighted_roc_auc", weighted_avg_roc_auc, sync_dist=True)
-    
+            self.log(f"roc_auc/{class_name}", scores["auroc"][i])
+            self.log(f"auprc/{class_name}", scores["auprc"][i])
+
+        # Weighted averages, using the number of positive samples for each class as weights
+        self.log("test_weighted_roc_auc", scores["weighted_auroc"])
+        self.log("test_weighted_auprc", scores["weighted_auprc"])
+        self.test_auc.reset()
+
+    def on_fit_start(self) -> None:
+        """
+        Records the effective batch size and the scaled learning rate with the hyperparameters of the run, and
+        compiles the model before the first epoch, so the compilation is neither timed as training nor run inside
+        the sanity check.
+        """
+        for logger in self.loggers:
+            logger.log_hyperparams(
+                {"effective_batch_size": self.effective_batch_size, "scaled_lr": self.lr}
+            )
+        if self.compile_warmup:
+            self.warm_up(self.compile_warmup, self.warmup_batch_size, self.warmup_image_size)
 
-    def configure_optimizers(self) -> dict[str, dict[str, Any]]:
+    def configure_optimizers(self) -> tuple[list[torch.optim.Optimizer], list[dict[str, Any]]]:
         if self.optimizer.lower() == "sgd-torch":
             optimizer = torch.optim.SGD(
                 params=self.parameters(),
@@ -257,22 +420,49 @@ class Classifier(LightningModule):
             "interval": "epoch",  # "step" or "epoch"
             "name": "Current LR",
         }
-        return {"optimizer": optimizer, "lr_scheduler": scheduler_config}
+        schedulers = [scheduler_config]
+        if self.warmup_epochs > 0:
+            # Linear warm-up over the first optimizer steps, which large effective batches need to stay stable.
+            # LinearLR leaves the learning rate alone once done, so the reductions of the plateau scheduler hold
+            steps_per_epoch = self.trainer.estimated_stepping_batches / self.trainer.max_epochs
+            warmup_steps = max(round(self.warmup_epochs * steps_per_epoch), 1)
+            warmup = torch.optim.lr_scheduler.LinearLR(
+                optimizer, start_factor=1 / warmup_steps, end_factor=1.0, total_iters=warmup_steps
+            )
+            schedulers.append({"scheduler": warmup, "interval": "step", "name": "Warm-up LR"})
+        return [optimizer], schedulers
+
+    def _log_epoch_metrics(self, metrics: MetricCollection) -> None:
+        """
+        Compute the metrics of the epoch once, log them and reset their state.
+        Args:
+            metrics: The metrics of the stage.
+
+        """
+        # compute() already synchronizes the state across the DDP ranks
+        values = metrics.compute()
+        # Accuracy is reported as a percentage, which the early stopping and the scheduler thresholds expect
+        self.log_dict(
+            {name: value * 100 if name.startswith("accuracy/") else value for name, value in values.items()}
+        )
+        metrics.reset()
 
     def _calculate_metrics(
-        self, batch
-    ) -> dict[Literal["loss", "accuracy", "confusion", "f1_score"], Tensor]:
+        self, batch, tta: bool = False
+    ) -> dict[Literal["loss", "probabilities", "labels"], Tensor]:
         """
-        Calculate the metrics for the given batch.
+        Calculate the loss and the probabilities for the given batch. The other metrics are accumulated by the
+        stateful metrics of every stage.
         Args:
             batch: The batch of data to calculate the metrics for.
+            tta: Whether to use the aggregated logits of the test-time augmentation views.
 
-        Returns: The metrics for the given batch as a dictionary.
+        Returns: The loss, the probabilities and the integer labels of the batch as a dictionary.
 
         """
         _images, _labels = batch
-        logits: Tensor = self(_images)
-        probabilities = torch.sigmoid(logits)
+        logits: Tensor = self.forward_tta(_images) if tta else self(_images)
+        probabilities = torch.sigmoid(logits.float())
 
         loss = nn.functional.binary_cross_entropy_with_logits(logits, _labels)
 
@@ -282,78 +472,8 @@ class Classifier(LightningModule):
         # loss = 0.5 * nn.functional.binary_cross_entropy_with_logits(logits, _labels) + \
         #        0.5 * focal_loss_fn(logits, _labels)
 
-
-        acc = accuracy(
-            preds=probabilities,
-            target=_labels,
-            num_classes=self.num_classes,
-            average="weighted",
-            task="multilabel",
-            num_labels=self.num_classes,
-        )
-        # confusion = confusion_matrix(
-        #     preds=probabilities,
-        #     target=_labels,
-        #     num_classes=self.num_classes,
-        #     task="multiclass",
-        #     num_labels=self.num_classes,
-        # )
-        # Precision
-        precision_score = precision(
-            preds=probabilities,
-            target=_labels,
-            num_classes=self.num_classes,
-            average="weighted",
-            task="multilabel",
-            num_labels=self.num_classes,
-        )
-
-        # Recall
-        recall_score = recall(
-            preds=probabilities,
-            target=_labels,
-            num_classes=self.num_classes,
-            average="weighted",
-            task="multilabel",
-            num_labels=self.num_classes,
-        )
-
-        f1 = f1_score(
-            preds=probabilities,
-            target=_labels,
-            num_classes=self.num_classes,
-            average="weighted",
-            task="multilabel",
-            num_labels=self.num_classes,
-        )
-        roc1 = auroc(
-            preds=probabilities,
-            target=_labels.to(torch.int64),
-            num_classes=self.num_classes,
-            average="weighted",
-            task="multilabel",
-            num_labels=self.num_classes,
-        )
-        precisions, recalls, thresholds = precision_recall_curve(
-            preds=probabilities, 
-            target=_labels.to(torch.int64), 
-            num_classes=self.num_classes,
-            average="weighted",
-            task="multilabel",
-            num_labels=self.num_classes,
-        )
-        precisions = torch.cat(precisions).to(torch.float32)
-        recalls = torch.cat(recalls).to(torch.float32)
-        auprc = auc(recalls, precisions, reorder=True)
         return {
             "loss": loss,
-            "accuracy": acc * 100,
-            # "confusion": confusion,
-            "f1_score": f1,
-            "auprc": auprc,
-            "roc1": roc1,
-            "precision": precision_score,
-            "recall": recall_score,
             "probabilities": probabilities,
-            "labels": _labels
+            "labels": _labels.to(torch.int64)
         }
@@ -0,0 +1,52 @@
+import numpy as np
+import torch
+from typing import Any
+from torch import Tensor
+from torch.utils.data import Dataset
+from backend.classes.CheXpert_Dataset import CheXpert
+
+
+class DistillationDataset(Dataset):
+    def __init__(self, dataset: CheXpert, teacher_logits: np.ndarray):
+        """Initialize the dataset of the distillation, the samples of a CheXpert dataset with the teacher logits of
+        their images.
+
+        Args:
+            dataset (CheXpert): The dataset of the images and labels.
+            teacher_logits (np.ndarray): The (N, C) teacher logits of every image of the dataset, from
+                utility/distill.py.
+        """
+        if len(teacher_logits) != len(dataset):
+            raise ValueError(
+                f"The teacher logits hold {len(teacher_logits)} images, the dataset has {len(dataset)}."
+            )
+        self.dataset = dataset
+        self.teacher_logits = teacher_logits
+
+    def set_image_size(self, image_size: int) -> None:
+        """Switch the cache level of the images, see CheXpert.set_image_size.
+
+        Args:
+            image_size (int): One of the cache_sizes.
+        """
+        self.dataset.set_image_size(image_size)
+
+    def __len__(self):
+        """Get the length of the dataset.
+
+        Returns:
+            Int: The length of the dataset (number of images).
+        """
+        return len(self.dataset)
+
+    def __getitem__(self, idx: int) -> tuple[Any, Tensor, Tensor]:
+        """Get the image, the label and the teacher logits at the given index.
+
+        Args:
+            idx (int): The index of the image.
+
+        Returns:
+            tuple[Any, Tensor, Tensor]: The image, the label and the teacher logits at the given index.
+        """
+        image, label = self.dataset[idx]
+        return image, label, torch.from_numpy(self.teacher_logits[idx])
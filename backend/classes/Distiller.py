@@ -0,0 +1,64 @@
+import torch
+from argparse import Namespace
+from torch import Tensor, nn
+from typing import Any
+from backend.classes.Classifier import Classifier
+
+
+def distillation_loss(
+    logits: Tensor, labels: Tensor, teacher_logits: Tensor, alpha: float, temperature: float
+) -> Tensor:
+    """
+    Combines the loss on the labels with the loss on the soft targets of the teacher. Every class is an independent
+    binary problem, so the soft targets are the sigmoids of the teacher logits, not a softmax over the classes.
+    Args:
+        logits: The logits of the student.
+        labels: The binary labels.
+        teacher_logits: The logits of the teacher.
+        alpha: The weight of the teacher term, the label term gets 1 - alpha.
+        temperature: Divides the teacher and student logits of the teacher term. The term is scaled by its square,
+            so its gradients keep their magnitude whatever the temperature.
+
+    Returns: The loss.
+
+    """
+    hard = nn.functional.binary_cross_entropy_with_logits(logits, labels)
+    soft = nn.functional.binary_cross_entropy_with_logits(
+        logits / temperature, torch.sigmoid(teacher_logits.float() / temperature)
+    )
+    return (1 - alpha) * hard + alpha * temperature**2 * soft
+
+
+class Distiller(Classifier):
+    def __init__(self, model: nn.Module, args: Namespace):
+        """
+        Trains the model as the student of a trained teacher, on the labels and the teacher logits of every training
+        image. The teacher is not part of the module: its logits are computed once and cached by
+        utility/distill.py, and the training batches hold them as a third element. Validation and testing are
+        those of the Classifier, and the checkpoints only hold the student, so they load like any Classifier.
+        Args:
+            model: The student model.
+            args: The arguments passed to the script or the default arguments in CONFIG.py.
+        """
+        super(Distiller, self).__init__(model, args)
+        self.alpha = args.distill_alpha
+        self.temperature = args.distill_temperature
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        """
+        Augments and normalizes the images of the training batches, which also hold the teacher logits, like the
+        Classifier does the others.
+        """
+        if len(batch) == 2:
+            return super().on_after_batch_transfer(batch, dataloader_idx)
+        _images, _labels, _teacher_logits = batch
+        _images, _labels = super().on_after_batch_transfer((_images, _labels), dataloader_idx)
+        return _images, _labels, _teacher_logits
+
+    def training_step(self, batch: Any, batch_idx: int):
+        _images, _labels, _teacher_logits = batch
+        logits: Tensor = self(_images)
+        loss = distillation_loss(logits, _labels, _teacher_logits, self.alpha, self.temperature)
+        self.train_metrics.update(torch.sigmoid(logits.float()), _labels.to(torch.int64))
+        self.log("loss/train", loss, on_epoch=True, on_step=False, sync_dist=True)
+        return loss
@@ -0,0 +1,83 @@
+from functools import partial
+import matplotlib
+import torch
+from torch import Tensor, nn
+from backend.classes.Models import DenseNet, EfficientNet, ResNet
+
+
+class GradCAM(nn.Module):
+    def __init__(self, model: nn.Module):
+        """
+        Computes the predictions and the Grad-CAM heatmaps of a batch in the same forward pass, for the models of
+        Models.py. All of them pool the last feature map with a global average, so the gradient of a logit with
+        respect to every position of the feature map is its gradient with respect to the pooled features, divided
+        by the number of positions. That gradient only goes through the classifier head, and is computed for all the
+        classes at once without backpropagating through the backbone. For the linear heads of ResNet and
+        EfficientNet it is the weight matrix, and the heatmaps are the class activation maps.
+
+        Args:
+            model (nn.Module): The EfficientNet, ResNet or DenseNet model, e.g. Classifier.model.
+        """
+        super(GradCAM, self).__init__()
+        self.model = model
+        if isinstance(model, DenseNet):
+            self.features = lambda x: model.features(x)[-1]
+            self.pool = model.classifier[:2]
+            self.head = model.classifier[2:]
+        elif isinstance(model, (EfficientNet, ResNet)):
+            if model.model.global_pool.pool_type != "avg":
+                raise ValueError("Grad-CAM from the pooled features needs a global average pooling.")
+            self.features = model.model.forward_features
+            self.pool = partial(model.model.forward_head, pre_logits=True)
+            self.head = model.model.get_classifier()
+        else:
+            raise ValueError("Invalid model. Please choose either EfficientNet, ResNet or DenseNet.")
+        # Color lookup table of the overlays
+        colormap = matplotlib.colormaps["jet"](torch.arange(256).numpy())[:, :3]
+        self.register_buffer("colormap", torch.from_numpy(colormap * 255).round().to(torch.uint8), persistent=False)
+
+    def forward(self, x: Tensor, classes: list[int] | None = None) -> tuple[Tensor, Tensor]:
+        """
+        Runs the model on a batch and computes the heatmaps of the requested classes.
+
+        Args:
+            x (Tensor): The batch of normalized images.
+            classes (list[int] | None): The indices of the classes to compute the heatmaps of. None computes all.
+
+        Returns:
+            tuple[Tensor, Tensor]: The logits of all the classes, and the heatmaps as uint8 tensors of shape
+                (batch, classes, height, width) at the resolution of the last feature map, each scaled to its maximum.
+        """
+        features = self.features(x)
+        pooled = self.pool(features)
+        logits = self.head(pooled)
+        selected = list(range(logits.shape[1])) if classes is None else classes
+        # Inference tensors cannot be differentiated, clone them out of inference mode
+        with torch.inference_mode(False), torch.enable_grad():
+            pooled = pooled.detach().clone()
+            # The head is applied to every image independently in evaluation mode, so the gradient of the sum over
+            # the batch holds the gradient of every image. One vector-Jacobian product per class, batched by vmap
+            jacobian = torch.func.jacrev(lambda p: self.head(p)[:, selected].sum(0))(pooled)
+        weights = jacobian.to(features.dtype) / (features.shape[-2] * features.shape[-1])
+        cams = torch.relu(torch.einsum("cbk,bkhw->bchw", weights, features.float()))
+        cams = cams / cams.amax(dim=(-2, -1), keepdim=True).clamp_min(torch.finfo(cams.dtype).tiny)
+        return logits, (cams * 255).round().to(torch.uint8)
+
+    def overlay(self, images: Tensor, cams: Tensor, alpha: float = 0.4) -> Tensor:
+        """
+        Upsamples the heatmaps to the size of the images, colors them and blends them over the images.
+
+        Args:
+            images (Tensor): The uint8 grayscale images of shape (batch, height, width).
+            cams (Tensor): One uint8 heatmap per image, of shape (batch, height, width) at any resolution.
+            alpha (float): The opacity of the heatmaps.
+
+        Returns:
+            Tensor: The uint8 RGB overlays of shape (batch, height, width, 3).
+        """
+        cams = nn.functional.interpolate(
+            cams[:, None].float(), size=images.shape[-2:], mode="bilinear", align_corners=False
+        )
+        colors = self.colormap[cams[:, 0].round().clamp(0, 255).long()].float()
+        blended = alpha * colors + (1 - alpha) * images[..., None].float()
+        return blended.round().to(torch.uint8)
@@ -0,0 +1,77 @@
+import torch
+from torch import Tensor
+from torchmetrics import Metric
+
+
+class HistogramAUC(Metric):
+    # The state is reduced across the DDP ranks by summing the histograms
+    full_state_update = False
+
+    def __init__(self, num_classes: int, num_bins: int = 10000, **kwargs):
+        """
+        Initializes the streaming per-class AUROC and AUPRC metric. Instead of keeping the predictions, every class
+        keeps a histogram of the probabilities of its positive and negative samples over num_bins equal bins, so the
+        memory is constant whatever the size of the test set. The curves are then evaluated at the bin edges, which
+        only merges predictions that are closer than 1 / num_bins.
+
+        Args:
+            num_classes (int): The number of labels.
+            num_bins (int): The number of probability bins.
+            **kwargs: Passed to torchmetrics.Metric.
+        """
+        super().__init__(**kwargs)
+        self.num_classes = num_classes
+        self.num_bins = num_bins
+        self.add_state("positives", torch.zeros(num_classes, num_bins, dtype=torch.long), dist_reduce_fx="sum")
+        self.add_state("negatives", torch.zeros(num_classes, num_bins, dtype=torch.long), dist_reduce_fx="sum")
+
+    def update(self, probabilities: Tensor, labels: Tensor) -> None:
+        """
+        Adds a batch to the histograms of all the classes at once.
+
+        Args:
+            probabilities (Tensor): The (N, C) predicted probabilities.
+            labels (Tensor): The (N, C) binary labels.
+        """
+        bins = (probabilities.float() * self.num_bins).long().clamp_(0, self.num_bins - 1)
+        # Offset the bins of every class so a single bincount fills all the histograms
+        bins += torch.arange(self.num_classes, device=bins.device) * self.num_bins
+        positive = labels.bool()
+        size = self.num_classes * self.num_bins
+        self.positives += torch.bincount(bins[positive], minlength=size).view(self.num_classes, self.num_bins)
+        self.negatives += torch.bincount(bins[~positive], minlength=size).view(self.num_classes, self.num_bins)
+
+    def compute(self) -> dict[str, Tensor]:
+        """
+        Computes the ROC and precision-recall curves of all the classes from the histograms, thresholding at every
+        bin edge from the highest to the lowest.
+
+        Returns:
+            dict[str, Tensor]: The per-class "auroc" and "auprc" (NaN for a class without positives or negatives) and
+                their averages weighted by the number of positives of every class, "weighted_auroc" and
+                "weighted_auprc".
+        """
+        # True and false positives when thresholding at every bin edge, starting from nothing predicted positive
+        tp = self.positives.flip(1).cumsum(1).double()
+        fp = self.negatives.flip(1).cumsum(1).double()
+        tp = torch.cat([torch.zeros_like(tp[:, :1]), tp], dim=1)
+        fp = torch.cat([torch.zeros_like(fp[:, :1]), fp], dim=1)
+        num_positives, num_negatives = tp[:, -1], fp[:, -1]
+
+        tpr = tp / num_positives.unsqueeze(1)
+        fpr = fp / num_negatives.unsqueeze(1)
+        auroc = torch.trapezoid(tpr, fpr, dim=1)
+        # Average precision: the precision at every threshold weighted by the recall gained there
+        precision = tp[:, 1:] / (tp[:, 1:] + fp[:, 1:]).clamp(min=1)
+        auprc = ((tpr[:, 1:] - tpr[:, :-1]) * precision).sum(dim=1)
+
+        valid = (num_positives > 0) & (num_negatives > 0)
+        auroc = auroc.masked_fill(~valid, float("nan"))
+        auprc = auprc.masked_fill(~valid, float("nan"))
+        weights = num_positives * valid
+        return {
+            "auroc": auroc.float(),
+            "auprc": auprc.float(),
+            "weighted_auroc": (auroc.nan_to_num() * weights).sum().div(weights.sum()).float(),
+            "weighted_auprc": (auprc.nan_to_num() * weights).sum().div(weights.sum()).float(),
+        }
@@ -0,0 +1,52 @@
+from typing import Any
+from lightning import Callback, LightningModule, Trainer
+from torch.utils.data import DataLoader
+from backend.classes.ResumableSampler import ResumableSampler
+
+
+class LoaderPosition(Callback):
+    def __init__(self, loader: DataLoader):
+        """
+        Initializes the callback that saves the position of the training DataLoader in the checkpoints, so a run
+        resumed from a checkpoint saved in the middle of an epoch continues with the batches that were not trained on
+        yet instead of restarting the epoch.
+
+        Args:
+            loader (DataLoader): The training DataLoader. Its sampler must be a ResumableSampler to resume in the
+                middle of an epoch, other loaders restart the interrupted epoch.
+        """
+        super(LoaderPosition, self).__init__()
+        self.loader = loader
+        self.epoch = 0
+        self.batches = 0
+
+    def on_train_epoch_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self.epoch = trainer.current_epoch
+        self.batches = 0
+
+    def on_train_batch_end(
+        self, trainer: Trainer, pl_module: LightningModule, outputs: Any, batch: Any, batch_idx: int
+    ) -> None:
+        """
+        Counts the batches trained on. Lightning runs the ModelCheckpoint callbacks after the others, so a checkpoint
+        saved at the end of this batch already counts it.
+        """
+        self.batches = batch_idx + 1
+
+    def state_dict(self) -> dict[str, int]:
+        return {"epoch": self.epoch, "batches": self.batches}
+
+    def load_state_dict(self, state_dict: dict[str, int]) -> None:
+        """
+        Makes the sampler skip the batches of the interrupted epoch that were already trained on. Nothing is skipped
+        when the checkpoint was saved at the end of the epoch, since training resumes at the next one.
+        """
+        sampler = self.loader.sampler
+        if not isinstance(sampler, ResumableSampler):
+            return
+        # Lightning creates the iterator of the resumed epoch before it sets the epoch of the sampler
+        if state_dict["batches"] >= len(self.loader):
+            sampler.set_epoch(state_dict["epoch"] + 1)
+        else:
+            sampler.set_epoch(state_dict["epoch"])
+            sampler.resume(state_dict["epoch"], state_dict["batches"] * self.loader.batch_size)
@@ -0,0 +1,124 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Sequence
+import torch
+from torch import Tensor
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        predict: Callable[[Tensor], Sequence[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        executor: Executor | None = None,
+    ):
+        """
+        Groups the single inputs submitted concurrently to an asyncio server into batches. A batch is run as soon as
+        it is full, or max_wait_ms after its first input arrived. The model runs in an executor, so the event loop
+        keeps accepting requests, which form the next batch while the current one runs.
+
+        Args:
+            predict (Callable[[Tensor], Sequence[Any]]): The function running a stacked batch through the model,
+                returning one output per input, e.g. the rows of a tensor.
+            max_batch_size (int): The largest batch.
+            max_wait_ms (float): The longest time the first input of a batch waits for more inputs.
+            executor (Executor | None): The executor running the model. Defaults to a single thread, the model
+                already uses all the cores of the machine through its intra-op threads.
+        """
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self._queue: asyncio.Queue[tuple[Tensor, asyncio.Future]] | None = None
+        self._task: asyncio.Task | None = None
+        self._arrived: asyncio.Event | None = None
+        self.requests = 0
+        self.batches = 0
+
+    async def start(self) -> None:
+        """
+        Starts batching in the running event loop.
+        """
+        self._queue = asyncio.Queue()
+        self._arrived = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops batching, the inputs still waiting are cancelled.
+        """
+        self._task.cancel()
+        while not self._queue.empty():
+            self._queue.get_nowait()[1].cancel()
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, x: Tensor) -> Any:
+        """
+        Adds an input to the next batch and waits for its output.
+
+        Args:
+            x (Tensor): A single input, without the batch dimension.
+
+        Returns:
+            Any: The output of the input.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((x, future))
+        self._arrived.set()
+        return await future
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Gets the counters of the batching.
+
+        Returns:
+            dict[str, Any]: The number of inputs and batches run so far, their mean batch size and the number of
+                inputs waiting.
+        """
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                # Waits for an arrival rather than for the queue, so a timeout can never drop an input
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            # The clients that disconnected while waiting cancelled their futures
+            batch = [(x, future) for x, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            try:
+                outputs = await loop.run_in_executor(self.executor, self._predict, torch.stack([x for x, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.requests += len(batch)
+            self.batches += 1
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+    def _predict(self, x: Tensor) -> Sequence[Any]:
+        # Inference mode is thread local, so it is entered in the thread of the executor
+        with torch.inference_mode():
+            return self.predict(x)
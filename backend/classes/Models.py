@@ -1,9 +1,26 @@
 import timm
 from torch import nn
-import torch
+from typing import Any
+
+
+def _pretrained_kwargs(pretrained: bool, pretrained_file: str | None) -> dict[str, Any]:
+    """
+    Builds the timm.create_model arguments that load the pretrained weights.
+
+    Args:
+        pretrained (bool): Whether to load the pretrained weights.
+        pretrained_file (str | None): A local file of the weights, e.g. from utility/weight_cache.py. None lets timm
+            download them.
+
+    Returns:
+        dict[str, Any]: The arguments for timm.create_model.
+    """
+    if pretrained and pretrained_file:
+        return {"pretrained": True, "pretrained_cfg_overlay": dict(file=str(pretrained_file))}
+    return {"pretrained": pretrained}
 
 class EfficientNet(nn.Module):
-    def __init__(self, num_classes: int, version: str, pretrained: bool):
+    def __init__(self, num_classes: int, version: str, pretrained: bool, pretrained_file: str | None = None):
         """
         Initializes the EfficientNet model.
 
@@ -11,11 +28,12 @@ class EfficientNet(nn.Module):
             num_classes (int): The number of classes for the output layer.
             version (str): The version of the EfficientNet model to load. This is going to be passed to timm's create_model
             pretrained (bool): Whether to load a pretrained model.
+            pretrained_file (str | None): A local file to load the pretrained weights from instead of downloading them.
         """
         super(EfficientNet, self).__init__()
         # Load the EfficientNet model
         self.model = timm.create_model(
-            version, pretrained=pretrained, num_classes=num_classes
+            version, num_classes=num_classes, **_pretrained_kwargs(pretrained, pretrained_file)
         )
 
     def forward(self, x):
@@ -32,7 +50,7 @@ class EfficientNet(nn.Module):
 
 
 class ResNet(nn.Module):
-    def __init__(self, num_classes: int, version: str, pretrained: bool):
+    def __init__(self, num_classes: int, version: str, pretrained: bool, pretrained_file: str | None = None):
         """
         Initializes the ResNet model.
 
@@ -40,11 +58,12 @@ class ResNet(nn.Module):
             num_classes (int): The number of classes for the output layer.
             version (str): The version of the ResNet model to load. This is going to be passed to timm's create_model
             pretrained (bool): Whether to load a pretrained model.
+            pretrained_file (str | None): A local file to load the pretrained weights from instead of downloading them.
         """
         super(ResNet, self).__init__()
         # Load the ResNet model
         self.model = timm.create_model(
-            version, pretrained=pretrained, num_classes=num_classes
+            version, num_classes=num_classes, **_pretrained_kwargs(pretrained, pretrained_file)
         )
 
     def forward(self, x):
@@ -60,7 +79,14 @@ class ResNet(nn.Module):
         return self.model(x)
     
 class DenseNet(nn.Module):
-    def __init__(self, num_classes: int, version: str, pretrained: bool):
+    def __init__(
+        self,
+        num_classes: int,
+        version: str,
+        pretrained: bool,
+        memory_efficient: bool = False,
+        pretrained_file: str | None = None,
+    ):
         """
         Initializes the DenseNet model.
 
@@ -68,6 +94,10 @@ class DenseNet(nn.Module):
             num_classes (int): The number of classes for the output layer.
             version (str): The version of the DenseNet model to load. This is going to be passed to timm's create_model
             pretrained (bool): Whether to load a pretrained model.
+            memory_efficient (bool): Whether to checkpoint the bottleneck (concatenation, norm and 1x1 convolution) of
+            every dense layer. Its activations are recomputed in the backward pass instead of being stored, which
+            makes the activation memory grow linearly instead of quadratically with the depth of the dense blocks.
+            pretrained_file (str | None): A local file to load the pretrained weights from instead of downloading them.
         """
         super(DenseNet, self).__init__()
         # Load the DenseNet model
@@ -77,13 +107,14 @@ class DenseNet(nn.Module):
 
         self.features = timm.create_model(
             version, 
-            pretrained=pretrained,
             features_only=True,
-            drop_rate=0.2  # Add dropout between dense blocks
+            drop_rate=0.2,  # Add dropout between dense blocks
+            memory_efficient=memory_efficient,
+            **_pretrained_kwargs(pretrained, pretrained_file),
         )
         
-        # Get feature dimensions from last layer
-        last_channel = self.features(torch.randn(1,3,512,512))[-1].shape[1]
+        # Get feature dimensions from last layer, from the feature metadata of the backbone
+        last_channel = self.features.feature_info.channels()[-1]
         
         # Enhanced classifier head
         self.classifier = nn.Sequential(
@@ -1,14 +1,15 @@
 import os
-import kagglehub
-import csv
+import numpy as np
+import pandas as pd
+import torch
 from pathlib import Path
 from typing import Any
-from PIL import Image
 from torch import Tensor
 from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms
 
 from backend.utility.find_mean_std import get_mean_std
+from backend.utility.open_image import open_image
 
 
 class CheXpert(Dataset):
@@ -31,11 +32,17 @@ class CheXpert(Dataset):
         "No Finding",
     ]
 
+    # Bump when the index layout changes so old indexes are rebuilt
+    INDEX_VERSION = 1
+
     def __init__(
         self,
         root_dir: str,
         train: bool = True,
         transform: Any = None,
+        offline: bool = False,
+        image_size: int | None = None,
+        data_dir: str | None = None,
     ):
         """
         Initialize the NIH dataset.
@@ -43,32 +50,43 @@ class CheXpert(Dataset):
             root_dir: The directory where the downloader will create the dataset folder.
             train: Whether to use the train or test set.
             transform: The transform to apply to the images.
+            offline: Whether to only read the persisted index and never call the downloader. The index is written
+                the first time the dataset is constructed online.
+            image_size: When set, the images are decoded at the smallest scale that is still at least image_size.
+            data_dir: An already downloaded copy of the dataset to use instead of calling the downloader.
         """
         # Transform to apply to the images
         self.transform = transform
+        # Size to decode the images at, None decodes the full images
+        self.image_size = image_size
         # Directory where the dataset folder should be created by the downloader
         self.ROOT_DIR = Path(root_dir)
-        # Download the dataset and get the path
-        self.DATA_DIR = Path(self._download_dataset())
-        # Get the image names to paths mapping
-        self.image_to_path = {
-            _image.name: _image for _image in self.DATA_DIR.glob("**/*.png")
-        }
-        # Get the image to label mapping
-        self.image_to_label = self._get_image_to_label()
-        # Get the list of images to use
-        self.inputs_list: list[str] = (
-            self._read_listfile(self.DATA_DIR / "train_val_list.txt")
-            if train
-            else self._read_listfile(self.DATA_DIR / "test_list.txt")
-        )
+        self.INDEX_FILE = self.ROOT_DIR / "nih_index.npz"
+        if offline:
+            index = self._load_index()
+            if index is None:
+                raise FileNotFoundError(
+                    f"No NIH index found at {self.INDEX_FILE}. Construct the dataset once with offline=False to build it."
+                )
+            self.DATA_DIR = Path(str(index["data_dir"]))
+        else:
+            # Download the dataset and get the path
+            self.DATA_DIR = Path(data_dir) if data_dir else Path(self._download_dataset())
+            index = self._load_index()
+            if index is None or Path(str(index["data_dir"])) != self.DATA_DIR:
+                index = self._build_index()
+        # Image paths relative to the data directory and one-hot labels, in the order of Data_Entry_2017.csv
+        self.image_paths: np.ndarray = index["paths"]
+        self.labels: np.ndarray = index["labels"].astype(np.float32)
+        # Rows of the images in the train or test list
+        self.rows: np.ndarray = index["train_rows"] if train else index["test_rows"]
 
     def __len__(self) -> int:
         """
         Get the length of the dataset.\n
         Returns: The length of the dataset (number of images).
         """
-        return len(self.inputs_list)
+        return len(self.rows)
 
     def __getitem__(self, idx: int) -> tuple[Any, Tensor]:
         """
@@ -79,22 +97,13 @@ class CheXpert(Dataset):
         Returns: The image with any transformations applied and its label one-hot encoded as a tensor.
 
         """
-        # Get the image name
-        image_name = self.inputs_list[idx]
-        # Get the image path
-        image_path = self.image_to_path[image_name]
+        row = self.rows[idx]
         # Read the image
-        _image = Image.open(image_path)
+        _image = open_image(os.path.join(self.DATA_DIR, self.image_paths[row]), self.image_size)
         # Apply the transform
         if self.transform:
             _image = self.transform(_image)
-        # Get the label
-        _label: str = self.image_to_label[image_name]  # a|b|c
-        # Split the labels
-        labels = _label.split("|")
-        # One hot encode the labels
-        _label: list[int] = [1 if L in labels else 0 for L in CheXpert.CLASSES]
-        return _image, Tensor(_label)
+        return _image, torch.from_numpy(self.labels[row])
 
     def _download_dataset(self) -> str:
         """
@@ -102,6 +111,8 @@ class CheXpert(Dataset):
         Returns: The path to the downloaded dataset.
 
         """
+        import kagglehub
+
         # Set environment variable for kagglehub cache
         os.environ["KAGGLEHUB_CACHE"] = str(self.ROOT_DIR)
         # Download the dataset from kaggle
@@ -109,6 +120,61 @@ class CheXpert(Dataset):
         print(f"Dataset downloaded to: {_path}")
         return _path
 
+    def _load_index(self) -> dict[str, np.ndarray] | None:
+        """
+        Load the persisted index. Helper function for the constructor.
+        Returns: The arrays of the index, or None if it is missing or outdated.
+
+        """
+        if not self.INDEX_FILE.exists():
+            return None
+        with np.load(self.INDEX_FILE) as index:
+            if int(index["version"]) != CheXpert.INDEX_VERSION:
+                return None
+            return dict(index)
+
+    def _build_index(self) -> dict[str, np.ndarray]:
+        """
+        Glob the image files once, encode all the labels and persist them as the index. Helper function for the constructor.
+        Returns: The arrays of the index.
+
+        """
+        name_to_path = {
+            _image.name: str(_image.relative_to(self.DATA_DIR))
+            for _image in self.DATA_DIR.glob("**/*.png")
+        }
+        entries = pd.read_csv(self.DATA_DIR / "Data_Entry_2017.csv")
+        names = entries["Image Index"]
+        missing = ~names.isin(name_to_path.keys())
+        if missing.any():
+            raise FileNotFoundError(
+                f"{missing.sum()} images of Data_Entry_2017.csv were not found in {self.DATA_DIR}"
+            )
+        rows = pd.Index(names)
+        split_rows = {}
+        for split, listfile in (("train_rows", "train_val_list.txt"), ("test_rows", "test_list.txt")):
+            listed = self._read_listfile(self.DATA_DIR / listfile)
+            indexer = rows.get_indexer(listed)
+            # -1 for the names missing from the entries, which would index the last row
+            if (indexer < 0).any():
+                raise FileNotFoundError(
+                    f"{(indexer < 0).sum()} images of {listfile} were not found in Data_Entry_2017.csv"
+                )
+            split_rows[split] = indexer.astype(np.int32)
+        index = {
+            "version": np.array(CheXpert.INDEX_VERSION),
+            "data_dir": np.array(str(self.DATA_DIR)),
+            "paths": names.map(name_to_path).to_numpy(dtype=str),
+            "labels": self._encode_labels(entries["Finding Labels"]),
+            **split_rows,
+        }
+        # Write atomically so a concurrent construction never reads a partial index
+        tmp_file = self.INDEX_FILE.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "wb") as f:
+            np.savez(f, **index)
+        tmp_file.replace(self.INDEX_FILE)
+        return index
+
     # noinspection PyMethodMayBeStatic
     def _read_listfile(self, listfile: Path) -> list[str]:
         """
@@ -122,16 +188,21 @@ class CheXpert(Dataset):
         with open(listfile, "r") as f:
             return f.read().splitlines()
 
-    def _get_image_to_label(self) -> dict[str, str]:
+    @staticmethod
+    def _encode_labels(findings: pd.Series) -> np.ndarray:
         """
-        Get the mapping of image names to labels. Helper function for the constructor.
-        Returns: The mapping of image names to labels.
+        One-hot encode the "Finding Labels" column (a|b|c) for all the images at once. Helper function for the constructor.
+        Args:
+            findings: The "Finding Labels" column of Data_Entry_2017.csv.
+
+        Returns: The (N, 15) uint8 one-hot label matrix.
 
         """
-        label_file = self.DATA_DIR / "Data_Entry_2017.csv"
-        with open(label_file, "r") as f:
-            reader = csv.DictReader(f)
-            return {row["Image Index"]: row["Finding Labels"] for row in reader}
+        return (
+            findings.str.get_dummies(sep="|")
+            .reindex(columns=CheXpert.CLASSES, fill_value=0)
+            .to_numpy(dtype=np.uint8)
+        )
 
     @staticmethod
     def decode_label(_label: Tensor | list[int]) -> list[str]:
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from torch import Tensor
+
+
+class PredictionCache:
+    def __init__(self, model_id: str, cache_file: str | Path | None = None, max_memory_mb: float = 256):
+        """
+        Caches the predictions of a model by the content of the preprocessed images, in a least recently used memory
+        tier bounded by size, backed by a persistent SQLite tier. The entries are scoped to the identity of the
+        model, the entries of any other model are deleted when the cache is opened, so a new checkpoint never
+        serves the predictions of the previous one.
+
+        Args:
+            model_id (str): The identity of the model, e.g. the hash of its checkpoint file.
+            cache_file (str | Path | None): The SQLite file of the disk tier. None keeps the cache in memory only.
+            max_memory_mb (float): The size of the memory tier in MiB.
+        """
+        self.model_id = model_id
+        self.max_memory_bytes = int(max_memory_mb * 2**20)
+        self._memory: OrderedDict[str, tuple[bytes, bytes | None]] = OrderedDict()
+        self._memory_bytes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._lookup_seconds = {"memory_hits": 0.0, "disk_hits": 0.0, "misses": 0.0}
+        self._connection: sqlite3.Connection | None = None
+        # SQLite is only used from this thread, the writes are queued behind the reads in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache")
+        if cache_file is not None:
+            self._executor.submit(self._open, Path(cache_file)).result()
+
+    @staticmethod
+    def key(pixels: Tensor) -> str:
+        """
+        Hashes the preprocessed image, so a re-upload hits the cache whatever its file name or metadata.
+
+        Args:
+            pixels (Tensor): The normalized image the model is run on.
+
+        Returns:
+            str: The hex digest of the pixels and their shape.
+        """
+        digest = hashlib.blake2b(str(tuple(pixels.shape)).encode(), digest_size=16)
+        digest.update(pixels.contiguous().numpy().tobytes())
+        return digest.hexdigest()
+
+    async def get(self, key: str, heatmap: bool = False) -> tuple[bytes, bytes | None] | None:
+        """
+        Looks up the predictions of an image in memory, then on disk. Disk hits are promoted to memory.
+
+        Args:
+            key (str): The key of the image.
+            heatmap (bool): Whether the heatmap is needed, entries stored without one are then a miss.
+
+        Returns:
+            tuple[bytes, bytes | None] | None: The float32 probabilities and the encoded heatmap, or None on a miss.
+        """
+        start = time.perf_counter()
+        entry = self._memory.get(key)
+        outcome = "memory_hits"
+        if entry is not None:
+            self._memory.move_to_end(key)
+        elif self._connection is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(self._executor, self._read, key)
+            outcome = "disk_hits"
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None or (heatmap and entry[1] is None):
+            entry, outcome = None, "misses"
+        self.counters[outcome] += 1
+        self._lookup_seconds[outcome] += time.perf_counter() - start
+        return entry
+
+    def put(self, key: str, probabilities: bytes, heatmap: bytes | None = None) -> None:
+        """
+        Stores the predictions of an image. The disk write happens in the background.
+
+        Args:
+            key (str): The key of the image.
+            probabilities (bytes): The float32 probabilities.
+            heatmap (bytes | None): The encoded heatmap.
+        """
+        self._remember(key, (probabilities, heatmap))
+        if self._connection is not None:
+            self._executor.submit(self._write, key, probabilities, heatmap)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Gets the counters of the cache.
+
+        Returns:
+            dict[str, Any]: The hits per tier, the misses, the hit rate, the mean lookup time in milliseconds per
+                outcome, and the size of the memory tier.
+        """
+        lookups = sum(self.counters.values())
+        return {
+            **self.counters,
+            "hit_rate": (lookups - self.counters["misses"]) / lookups if lookups else 0.0,
+            **{
+                f"{outcome}_lookup_ms": 1000 * seconds / self.counters[outcome] if self.counters[outcome] else 0.0
+                for outcome, seconds in self._lookup_seconds.items()
+            },
+            "memory_entries": len(self._memory),
+            "memory_mb": self._memory_bytes / 2**20,
+        }
+
+    def close(self) -> None:
+        """
+        Finishes the pending disk writes and closes the disk tier.
+        """
+        if self._connection is not None:
+            self._executor.submit(self._connection.close).result()
+        self._executor.shutdown(wait=True)
+
+    def _remember(self, key: str, entry: tuple[bytes, bytes | None]) -> None:
+        size = len(entry[0]) + len(entry[1] or b"")
+        if size > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            old = self._memory.pop(key)
+            self._memory_bytes -= len(old[0]) + len(old[1] or b"")
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted[0]) + len(evicted[1] or b"")
+
+    def _open(self, cache_file: Path) -> None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(cache_file, check_same_thread=False)
+        # Readers do not block the writer, e.g. several server processes sharing the file
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions "
+            "(key TEXT PRIMARY KEY, model_id TEXT NOT NULL, probabilities BLOB NOT NULL, heatmap BLOB)"
+        )
+        self._connection.execute("DELETE FROM predictions WHERE model_id != ?", (self.model_id,))
+        self._connection.commit()
+
+    def _read(self, key: str) -> tuple[bytes, bytes | None] | None:
+        row = self._connection.execute(
+            "SELECT probabilities, heatmap FROM predictions WHERE key = ? AND model_id = ?", (key, self.model_id)
+        ).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def _write(self, key: str, probabilities: bytes, heatmap: bytes | None) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)", (key, self.model_id, probabilities, heatmap)
+        )
+        self._connection.commit()
@@ -0,0 +1,44 @@
+from lightning import Callback, LightningModule, Trainer
+from backend.classes.CheXpert_Dataset import CheXpert
+
+
+class ProgressiveResize(Callback):
+    def __init__(self, dataset: CheXpert, sizes: list[int], epochs: list[int]):
+        """
+        Initializes the progressive resizing schedule. Early epochs read the smaller levels of the preprocessed
+        cache and the image size steps up until the final size, so the first epochs run several times faster.
+
+        Args:
+            dataset (CheXpert): The cached dataset shared by the DataLoaders.
+            sizes (list[int]): The image sizes of the schedule in increasing order. The last one is the final size.
+            epochs (list[int]): The epoch at which every size starts. The first one must be 0.
+        """
+        super(ProgressiveResize, self).__init__()
+        if len(sizes) != len(epochs) or epochs[0] != 0 or sorted(epochs) != list(epochs):
+            raise ValueError(
+                "The progressive epochs must start at 0, be increasing and match the progressive sizes."
+            )
+        self.dataset = dataset
+        self.sizes = sizes
+        self.epochs = epochs
+
+    def size_at(self, epoch: int) -> int:
+        """
+        Returns the image size of the given epoch.
+        """
+        return [size for size, start in zip(self.sizes, self.epochs) if start <= epoch][-1]
+
+    def on_train_epoch_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        """
+        Switches the dataset to the image size of the epoch. The hook runs before the DataLoader iterator of the
+        epoch is created, so no batch is prefetched at the old size. Validation runs at the same size.
+        """
+        size = self.size_at(trainer.current_epoch)
+        self.dataset.set_image_size(size)
+        pl_module.log("image_size", float(size), on_epoch=True, on_step=False, sync_dist=True)
+
+    def on_train_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        """
+        Switches back to the final size for testing.
+        """
+        self.dataset.set_image_size(self.sizes[-1])
@@ -0,0 +1,54 @@
+from typing import Iterator
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class ResumableSampler(Sampler[int]):
+    def __init__(self, num_samples: int, seed: int = 42):
+        """
+        Initializes the shuffling sampler of the training DataLoader. The order of every epoch only depends on the
+        seed and the epoch, so after a restart the same order is drawn again and the batches already trained on
+        can be skipped.
+
+        Args:
+            num_samples (int): The number of samples of the dataset.
+            seed (int): The base seed of the shuffling.
+        """
+        super(ResumableSampler, self).__init__()
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+        # Epoch and number of samples to skip once, set when resuming from a checkpoint
+        self._resume_epoch = -1
+        self._resume_start = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Sets the epoch used to seed the shuffling. Lightning calls it at the start of every epoch.
+
+        Args:
+            epoch (int): The current epoch.
+        """
+        self.epoch = epoch
+
+    def resume(self, epoch: int, start: int) -> None:
+        """
+        Skips the first samples of the given epoch the next time it is iterated.
+
+        Args:
+            epoch (int): The epoch to resume.
+            start (int): The number of samples of that epoch already trained on.
+        """
+        self._resume_epoch = epoch
+        self._resume_start = start
+
+    def __iter__(self) -> Iterator[int]:
+        order = np.random.default_rng([self.seed, self.epoch]).permutation(self.num_samples)
+        if self.epoch == self._resume_epoch:
+            order = order[self._resume_start :]
+            self._resume_epoch = -1
+        return iter(order.tolist())
+
+    def __len__(self) -> int:
+        # The full length even when resuming, Lightning counts the batches already done itself
+        return self.num_samples
@@ -0,0 +1,204 @@
+import io
+import json
+import tarfile
+from itertools import islice
+import numpy as np
+import torch
+from pathlib import Path
+from typing import Any, Iterator
+from PIL import Image
+from torch import Tensor
+from torch.utils.data import IterableDataset, get_worker_info
+
+
+class CheXpertShards(IterableDataset):
+    def __init__(
+        self,
+        shard_files: list[Path],
+        counts: list[int],
+        transform: Any = None,
+        shuffle: bool = True,
+        buffer_size: int = 2000,
+        num_workers: int = 0,
+        seed: int = 42,
+    ):
+        """Initialize the streaming CheXpert dataset over the tar shards written by utility/write_shards.py.
+
+        The shards are split across the DDP ranks and the DataLoader workers, and every worker streams its shards
+        sequentially. While training, every worker yields the same number of samples (its shards are cycled if
+        needed), so all the ranks run the same number of steps. Without shuffling, every sample is yielded once.
+
+        Args:
+            shard_files (list[Path]): The tar shards to read.
+            counts (list[int]): The number of samples in every shard.
+            transform (Any, optional): Image transforms. Defaults to None.
+            shuffle (bool, optional): Whether to shuffle the shard order and the samples. Defaults to True.
+            buffer_size (int, optional): The number of samples of the shuffle buffer of every worker. Defaults to 2000.
+            num_workers (int, optional): The num_workers of the DataLoader, used to compute the length. Defaults to 0.
+            seed (int, optional): The base seed of the shuffling. Defaults to 42.
+        """
+        self.shard_files = [str(shard_file) for shard_file in shard_files]
+        self.counts = list(counts)
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.num_workers = num_workers
+        self.seed = seed
+        self.epoch = 0
+        # Counts the iterations of persistent workers, whose copy of the dataset does not see set_epoch
+        self._iterations = 0
+
+    @staticmethod
+    def read_index(index_file: Path, split: str) -> tuple[list[Path], list[int]]:
+        """Read the shards of a split from the index written by utility/write_shards.py.
+
+        Args:
+            index_file (Path): The json index of the shards.
+            split (str): The split, train, val or test for the training listfile, valid for the validation one.
+
+        Returns:
+            tuple[list[Path], list[int]]: The shard files and their sample counts.
+        """
+        with open(index_file, "r") as f:
+            splits = json.load(f).get("splits", {})
+        if split not in splits:
+            raise ValueError(
+                f"{index_file} has no {split} shards, it was written before the shards were split. Write the shards "
+                "again with utility/write_shards.py."
+            )
+        shards = splits[split]
+        return (
+            [index_file.parent / shard["file"] for shard in shards],
+            [shard["count"] for shard in shards],
+        )
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch used to seed the shuffling.
+
+        Args:
+            epoch (int): The current epoch.
+        """
+        self.epoch = epoch
+
+    @staticmethod
+    def _world() -> tuple[int, int]:
+        """Get the rank and the number of DDP processes.
+
+        Returns:
+            tuple[int, int]: The rank and the world size, (0, 1) when not distributed.
+        """
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return 0, 1
+
+    def _samples_per_worker(self, world_size: int, num_workers: int) -> int:
+        """Get the number of samples every worker of every rank yields per epoch.
+
+        Returns:
+            int: The number of samples per worker.
+        """
+        return sum(self.counts) // (world_size * max(num_workers, 1))
+
+    def __len__(self) -> int:
+        """Get the number of samples this rank yields per epoch.
+
+        Returns:
+            int: The number of samples per epoch on this rank.
+        """
+        rank, world_size = self._world()
+        num_workers = max(self.num_workers, 1)
+        if not self.shuffle:
+            # Every sample once, the shard idx goes to the worker slot idx % (world_size * num_workers), or the
+            # sample idx when there are fewer shards than slots
+            slots = world_size * num_workers
+            first_slot = rank * num_workers
+            if len(self.counts) >= slots:
+                return sum(sum(self.counts[slot::slots]) for slot in range(first_slot, first_slot + num_workers))
+            return sum(
+                len(range(slot, sum(self.counts), slots)) for slot in range(first_slot, first_slot + num_workers)
+            )
+        return self._samples_per_worker(world_size, self.num_workers) * num_workers
+
+    def _stream(self, shard_files: list[str], cycle: bool = True) -> Iterator[tuple[str, bytes, bytes]]:
+        """Stream the samples of the shards sequentially.
+
+        Args:
+            shard_files (list[str]): The shards of this worker.
+            cycle (bool, optional): Whether to cycle through the shards forever, or to read them once.
+                Defaults to True.
+
+        Yields:
+            tuple[str, bytes, bytes]: The key, the JPEG bytes and the label bytes of every sample.
+        """
+        while True:
+            for shard_file in shard_files:
+                sample: dict[str, bytes] = {}
+                with tarfile.open(shard_file, mode="r|") as tar:
+                    for member in tar:
+                        key, extension = member.name.split(".", 1)
+                        sample[extension] = tar.extractfile(member).read()
+                        if len(sample) == 2:
+                            yield key, sample["jpg"], sample["cls"]
+                            sample = {}
+            if not cycle:
+                return
+
+    def _decode(self, image: bytes, label: bytes) -> tuple[Any, Tensor]:
+        """Decode a sample.
+
+        Args:
+            image (bytes): The JPEG bytes.
+            label (bytes): The 14 labels as uint8 bytes.
+
+        Returns:
+            tuple[Any, Tensor]: The transformed image and its label.
+        """
+        _image = Image.open(io.BytesIO(image))
+        if self.transform:
+            _image = self.transform(_image)
+        return _image, torch.from_numpy(np.frombuffer(label, dtype=np.uint8).astype(np.float32))
+
+    def __iter__(self) -> Iterator[tuple[Any, Tensor]]:
+        """Stream the samples of the shards of this rank and worker, shuffled with a bounded buffer.
+
+        Every worker reads its own shards, or the samples of its slot across all the shards when there are fewer
+        shards than workers, so no two workers yield the same samples. Without shuffling (validation and test), the
+        shards are read once, so every sample is yielded exactly once.
+
+        Yields:
+            tuple[Any, Tensor]: The image and label of every sample.
+        """
+        rank, world_size = self._world()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        epoch = self.epoch + self._iterations
+        self._iterations += 1
+        # Same permutation in every rank and worker, so the slots below partition the shards
+        rng = np.random.default_rng([self.seed, epoch])
+        order = rng.permutation(len(self.shard_files)) if self.shuffle else np.arange(len(self.shard_files))
+        slots = world_size * num_workers
+        slot = rank * num_workers + worker_id
+        if len(order) >= slots:
+            stream = self._stream([self.shard_files[i] for i in order[slot::slots]], cycle=self.shuffle)
+        else:
+            stream = islice(self._stream([self.shard_files[i] for i in order], cycle=self.shuffle), slot, None, slots)
+        if self.shuffle:
+            # Same number of samples in every worker, so all the ranks run the same number of steps
+            stream = islice(stream, self._samples_per_worker(world_size, num_workers))
+
+        # Different sample order in every worker
+        rng = np.random.default_rng([self.seed, epoch, slot])
+        buffer: list[tuple[bytes, bytes]] = []
+        for _, image, label in stream:
+            if not self.shuffle:
+                yield self._decode(image, label)
+            elif len(buffer) < self.buffer_size:
+                buffer.append((image, label))
+            else:
+                i = rng.integers(len(buffer))
+                yield self._decode(*buffer[i])
+                buffer[i] = (image, label)
+        # Drain the buffer at the end of the epoch
+        rng.shuffle(buffer)
+        for image, label in buffer:
+            yield self._decode(image, label)
@@ -4,24 +4,20 @@ import torch
 from utility.get_model import get_model
 from utility.load_data import load_data
 from utility.parse_args import parse_arguments
+from utility.find_mean_std import load_stats
+from utility.get_transforms import get_transforms
+from utility.distill import get_teacher_logits
 from classes.Classifier import Classifier
+from classes.ProgressiveResize import ProgressiveResize
+from classes.AsyncCheckpointIO import AsyncCheckpointIO
+from classes.LoaderPosition import LoaderPosition
 #from classes.ClearMLLogger import ClearMLLogger
 #from clearml import Task
 from lightning import LightningModule, seed_everything, Trainer
-from lightning.pytorch.callbacks import LearningRateMonitor, EarlyStopping
+from lightning.pytorch.callbacks import LearningRateMonitor, EarlyStopping, ModelCheckpoint
 from lightning.pytorch.loggers import Logger, TensorBoardLogger
 from torch import nn, Tensor, set_float32_matmul_precision
-from torchvision.transforms import (
-    Compose,
-    ToTensor,
-    InterpolationMode,
-    Normalize,
-    Resize,
-    RandomHorizontalFlip,
-    RandomAffine,
-    ColorJitter,
-    Grayscale,
-)
+from torchvision.transforms import Compose
 from torch.utils.data import DataLoader
 import matplotlib
 
@@ -46,10 +42,40 @@ def train(
     Returns:
         tuple[Classifier, Trainer]: A tuple containing the trained model and the Trainer object.
     """
-    lr_monitor = LearningRateMonitor(logging_interval="epoch")
+    # The warm-up changes the learning rate every optimizer step
+    lr_monitor = LearningRateMonitor(logging_interval="step" if args.warmup_epochs > 0 else "epoch")
     early_stopping = EarlyStopping(
         monitor="accuracy/val", patience=5, mode="max", min_delta=0.0005
     )
+    checkpoint_dir = Path(args.checkpoint_dir or Path(args.root_dir) / "checkpoints" / args.model_name)
+    # Best checkpoint by the validation accuracy
+    best_checkpoint = ModelCheckpoint(
+        dirpath=checkpoint_dir,
+        filename="best-epoch{epoch:03d}",
+        monitor="accuracy/val",
+        mode="max",
+        save_top_k=1,
+        auto_insert_metric_name=False,
+    )
+    # The most recent checkpoints and last.ckpt, to resume from after a crash
+    periodic_checkpoint = ModelCheckpoint(
+        dirpath=checkpoint_dir,
+        filename="epoch{epoch:03d}-step{step:07d}",
+        monitor="step",
+        mode="max",
+        save_top_k=args.keep_last,
+        save_last=True,
+        every_n_train_steps=args.checkpoint_every_n_steps,
+        auto_insert_metric_name=False,
+    )
+    callbacks = [lr_monitor, early_stopping, best_checkpoint, periodic_checkpoint, LoaderPosition(train_loader)]
+    if args.progressive_sizes:
+        # The train, validation and test subsets share the cached dataset
+        callbacks.append(
+            ProgressiveResize(
+                train_loader.dataset.dataset, args.progressive_sizes, args.progressive_epochs
+            )
+        )
     tensorboard_logger = TensorBoardLogger("lightning_logs", name=args.model_name)
     #clearml_logger = ClearMLLogger(task, version=tensorboard_logger.version)
     trainer = Trainer(
@@ -59,17 +85,24 @@ def train(
         strategy='ddp', # ddp_find_unused_parameters_True
         precision="bf16-mixed",
         max_epochs=args.epochs,
-        callbacks=[lr_monitor, early_stopping],
+        accumulate_grad_batches=args.accumulate_grad_batches,
+        sync_batchnorm=args.sync_batchnorm,
+        callbacks=callbacks,
         deterministic=False,
         use_distributed_sampler=False,
-        enable_checkpointing=False,
+        enable_checkpointing=True,
+        # Checkpoints are written from a CPU snapshot by a background thread
+        plugins=[AsyncCheckpointIO()],
         logger=[
             tensorboard_logger,
             #clearml_logger,
         ],  # Tensorboard and clearML must be used together in this order
     )
     
-    trainer.fit(model=model, train_dataloaders=train_loader, val_dataloaders=val_loader)
+    # Restores the weights, the optimizer, the scheduler, the callbacks (early stopping) and the loader position
+    trainer.fit(
+        model=model, train_dataloaders=train_loader, val_dataloaders=val_loader, ckpt_path=args.resume
+    )
     return model, trainer
 
 
@@ -82,6 +115,19 @@ def main():
     )
     # Get the arguments
     args = parse_arguments(parser)
+    if args.stats_file:
+        args.mean, args.std = load_stats(args.stats_file)
+    if args.progressive_sizes and (
+        not args.use_cache
+        or args.use_shards
+        or not args.progressive_epochs
+        or args.progressive_sizes[-1] != args.image_size
+    ):
+        raise ValueError(
+            "Progressive resizing reads the cache levels, needs --progressive_epochs and must end at --image_size."
+        )
+    if "accuracy" not in args.val_metrics:
+        raise ValueError("--val_metrics must contain accuracy, the early stopping and the scheduler monitor it.")
     # Initialize the ClearML task
     # task = Task.init(
     #     project_name="4ZP6A-capstone",
@@ -90,25 +136,12 @@ def main():
     #     reuse_last_task_id=False,
     # )
     # Load the data with the transformations
-    transform: Compose = Compose(
-        [
-            # Convert to 1 channel
-            Grayscale(num_output_channels=3),
-            Resize(
-                (args.image_size, args.image_size),
-                interpolation=InterpolationMode.BICUBIC,
-            ),
-            RandomHorizontalFlip(),
-            RandomAffine(degrees=30, translate=(0.30,0.30), scale=(0.70,1.30)),
-            ColorJitter(brightness=0.30, contrast=0.30),
-            ToTensor(),
-            Normalize(
-                mean=[0.5057019, 0.5057019, 0.5057019],
-                std=[0.24987267, 0.24987267, 0.24987267],
-            ),
-        ]
+    transform: Compose = get_transforms(args)
+    # The teacher logits are computed once and cached, the student epochs only read them
+    teacher_logits = get_teacher_logits(args) if args.teacher_checkpoint else None
+    train_loader, val_loader, test_loader = load_data(
+        _args=args, _transforms=transform, _teacher_logits=teacher_logits
     )
-    train_loader, val_loader, test_loader = load_data(_args=args, _transforms=transform)
     # Initialize the model
     model = get_model(args)
     # Train the model
@@ -0,0 +1,117 @@
+from argparse import ArgumentParser, Namespace
+from multiprocessing import Pool
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+from backend.classes.CheXpert_Dataset import CheXpert
+from backend.utility.open_image import open_image
+from backend.utility.parse_args import parse_arguments
+
+# Memory-mapped caches of the worker process by image size, opened once by _init_worker
+_caches: dict[int, np.memmap] = {}
+
+
+def _init_worker(data_files: dict[int, str], length: int) -> None:
+    """
+    Open the caches for writing in a worker process.
+
+    Args:
+        data_files (dict[int, str]): The paths to the raw uint8 data files by image size.
+        length (int): The number of images in the dataset.
+    """
+    for image_size, data_file in data_files.items():
+        _caches[image_size] = np.memmap(
+            data_file, dtype=np.uint8, mode="r+", shape=(length, image_size, image_size)
+        )
+
+
+def _process_image(task: tuple[int, str, bool]) -> int:
+    """
+    Decode a single image once, convert it to grayscale and resize it into its row of every cache.
+
+    Args:
+        task (tuple[int, str, bool]): The row index, the image path and whether to use the reduced-resolution decode.
+
+    Returns:
+        int: The row index that was written.
+    """
+    idx, image_path, fast_decode = task
+    with open_image(image_path, max(_caches) if fast_decode else None) as image:
+        image = image.convert("L")
+        for image_size, cache in _caches.items():
+            cache[idx] = np.asarray(
+                image.resize((image_size, image_size), resample=Image.Resampling.BICUBIC)
+            )
+    return idx
+
+
+def build_cache(
+    dataset: CheXpert, image_sizes: list[int], num_workers: int, fast_decode: bool = False
+) -> None:
+    """
+    Build the preprocessed memory-mapped image caches for the given dataset, one per image size.
+    Every image is decoded once, converted to grayscale and resized to every image_size x image_size with bicubic
+    interpolation, the same as the Grayscale and Resize transforms in train.py. The index files are written last,
+    so an interrupted build is never picked up by the dataset.
+
+    Args:
+        dataset (CheXpert): The dataset whose images will be cached.
+        image_sizes (list[int]): The sizes of the cached images, for example 256 384 512.
+        num_workers (int): The number of worker processes used to decode the images.
+        fast_decode (bool): Whether to decode the JPEGs at the smallest scale that is still at least the largest size.
+    """
+    data_files = {}
+    for image_size in image_sizes:
+        data_file, index_file = dataset.cache_files(image_size)
+        data_file.parent.mkdir(parents=True, exist_ok=True)
+        index_file.unlink(missing_ok=True)
+        # Allocate the full file up front, the workers fill in their rows
+        np.memmap(
+            data_file, dtype=np.uint8, mode="w+", shape=(len(dataset), image_size, image_size)
+        ).flush()
+        data_files[image_size] = str(data_file)
+
+    tasks = ((idx, dataset.image_path(idx), fast_decode) for idx in range(len(dataset)))
+    with Pool(
+        processes=max(num_workers, 1),
+        initializer=_init_worker,
+        initargs=(data_files, len(dataset)),
+    ) as pool:
+        for _ in tqdm(
+            pool.imap_unordered(_process_image, tasks, chunksize=64),
+            total=len(dataset),
+            desc=f"Caching sizes {' '.join(map(str, image_sizes))}",
+        ):
+            pass
+
+    paths = dataset.relative_paths()
+    for image_size in image_sizes:
+        _, index_file = dataset.cache_files(image_size)
+        np.savez(index_file, paths=paths, image_size=image_size)
+        print(f"Cache written to: {data_files[image_size]}")
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Build the preprocessed image cache for the CheXpert dataset. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--valid",
+        action="store_true",
+        help="Cache the validation listfile instead of the training listfile.",
+    )
+    parser.add_argument(
+        "--cache_sizes",
+        type=int,
+        nargs="+",
+        default=None,
+        help="The image sizes to cache, for example 256 384 512. Defaults to --image_size and the --progressive_sizes.",
+    )
+    args: Namespace = parse_arguments(parser)
+    image_sizes = args.cache_sizes or sorted({args.image_size, *(args.progressive_sizes or [])})
+    dataset = CheXpert(root_dir=args.root_dir, train=not args.valid)
+    build_cache(dataset, image_sizes, args.num_workers, args.fast_decode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import copy
+import hashlib
+import itertools
+import json
+import math
+import os
+from argparse import ArgumentParser, Namespace
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+from backend.classes.CheXpert_Dataset import CheXpert
+from backend.classes.HistogramAUC import HistogramAUC
+from backend.utility.export_model import measure_latency
+from backend.utility.find_mean_std import load_stats
+from backend.utility.get_model import load_classifier
+from backend.utility.get_transforms import get_transforms
+from backend.utility.load_data import load_data
+from backend.utility.parse_args import parse_arguments
+
+
+def get_teacher_args(args: Namespace) -> Namespace:
+    """
+    Builds the arguments of the teacher model from the arguments of the student being trained.
+
+    Args:
+        args (Namespace): The command-line arguments containing the teacher parameters.
+
+    Returns:
+        Namespace: The arguments with the architecture, the name and the image size of the teacher.
+    """
+    teacher_args = copy.copy(args)
+    teacher_args.model_arch = args.teacher_arch
+    teacher_args.model_name = args.teacher_name
+    teacher_args.image_size = args.teacher_image_size
+    # The teacher runs once over the dataset in eager mode, on the images themselves
+    teacher_args.channels_last = False
+    teacher_args.compile = False
+    teacher_args.tta = False
+    return teacher_args
+
+
+def get_teacher_logits(args: Namespace) -> np.ndarray:
+    """
+    Gets the logits of the teacher for every image of the CheXpert training listfile (the train, validation and
+    test splits), computed in one pass and cached on disk, so the epochs of the student and later runs with other
+    splits or students never run the teacher. The cache is keyed by the checkpoint, the model and preprocessing
+    parameters of the teacher and the images of the dataset.
+    The teacher sees the images with the evaluation preprocessing. The student is still trained on its random
+    augmentations, with the teacher logits of the image it was augmented from.
+
+    Args:
+        args (Namespace): The command-line arguments containing the teacher and the data loading parameters.
+
+    Returns:
+        np.ndarray: The (N, C) float32 teacher logits, indexed like the CheXpert dataset.
+    """
+    teacher_args = get_teacher_args(args)
+    dataset = CheXpert(
+        root_dir=args.root_dir,
+        train=True,
+        transform=get_transforms(teacher_args, train=False),
+        use_cache=args.use_cache,
+        image_size=teacher_args.image_size,
+        fast_decode=args.fast_decode,
+    )
+    digest = hashlib.sha256()
+    with open(args.teacher_checkpoint, "rb") as f:
+        digest.update(hashlib.file_digest(f, "sha256").digest())
+    digest.update(
+        json.dumps(
+            [
+                teacher_args.model_arch,
+                teacher_args.model_name,
+                teacher_args.image_size,
+                [float(value) for value in teacher_args.mean],
+                [float(value) for value in teacher_args.std],
+                args.use_cache,
+                args.fast_decode,
+            ]
+        ).encode()
+    )
+    digest.update("\n".join(dataset.relative_paths()).encode())
+    cache_file = Path(args.root_dir) / "cache" / "teacher" / f"{teacher_args.model_name}-{digest.hexdigest()[:16]}.npy"
+    if cache_file.exists():
+        print(f"Teacher logits loaded from: {cache_file}")
+        return np.load(cache_file)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    teacher = load_classifier(args.teacher_checkpoint, teacher_args).to(device)
+    loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=False,
+        num_workers=args.num_workers,
+        pin_memory=args.pin_memory,
+    )
+    logits = np.empty((len(dataset), args.num_classes), dtype=np.float32)
+    start = 0
+    # Same precision as the training, bf16-mixed
+    autocast = torch.autocast("cuda", dtype=torch.bfloat16) if device.type == "cuda" else nullcontext()
+    with torch.inference_mode(), autocast:
+        for images, _ in tqdm(loader, desc="Teacher logits"):
+            batch_logits = teacher(images.to(device, non_blocking=True)).float().cpu().numpy()
+            logits[start : start + len(batch_logits)] = batch_logits
+            start += len(batch_logits)
+    del teacher
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    # Written under a temporary name, an interrupted pass leaves no partial cache
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file = cache_file.with_suffix(".tmp.npy")
+    np.save(temporary_file, logits)
+    os.replace(temporary_file, cache_file)
+    print(f"Teacher logits saved to: {cache_file}")
+    return logits
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Compare a student distilled by train.py with its teacher: the per-class ROC AUC on the test split and the CPU latency of both. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="The .ckpt or .pth file of the student saved by train.py. Defaults to <root_dir>/<model_name>.pth.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="The directory to write report.json to. Defaults to <root_dir>/distill/<model_name>.",
+    )
+    parser.add_argument(
+        "--eval_batches",
+        type=int,
+        default=None,
+        help="The number of test batches the ROC AUC is computed on. Defaults to the whole test split.",
+    )
+    parser.add_argument(
+        "--latency_runs",
+        type=int,
+        default=20,
+        help="The number of single images timed per model.",
+    )
+    parser.add_argument(
+        "--throughput_batches",
+        type=int,
+        default=5,
+        help="The number of batches timed per model.",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="The number of CPU threads, as on the serving machines. Defaults to the PyTorch default.",
+    )
+    args: Namespace = parse_arguments(parser)
+    if not args.teacher_checkpoint:
+        raise ValueError("--teacher_checkpoint is needed to compare the student with its teacher.")
+    if args.stats_file:
+        args.mean, args.std = load_stats(args.stats_file)
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    checkpoint = Path(args.checkpoint or Path(args.root_dir) / f"{args.model_name}.pth")
+    output_dir = Path(args.output_dir or Path(args.root_dir) / "distill" / args.model_name)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # The teacher predictions of the test images are in the cache of the training
+    teacher_logits = get_teacher_logits(args)
+    teacher_args = get_teacher_args(args)
+    teacher = load_classifier(args.teacher_checkpoint, teacher_args)
+    student = load_classifier(checkpoint, args)
+    # load_data only builds the DistributedSampler of the test loader (which needs DDP) for a single device
+    loader_args = copy.copy(args)
+    loader_args.devices = max(args.devices, 2)
+    _, _, test_loader = load_data(_args=loader_args, _transforms=get_transforms(args, train=False))
+    eval_loader = itertools.islice(test_loader, args.eval_batches) if args.eval_batches else test_loader
+
+    scores = {"student": HistogramAUC(args.num_classes, args.test_auc_bins)}
+    scores["teacher"] = HistogramAUC(args.num_classes, args.test_auc_bins)
+    # The test loader is not shuffled, its batches follow the indices of the test split
+    test_indices = iter(test_loader.dataset.indices)
+    with torch.no_grad():
+        for images, labels in tqdm(eval_loader, desc="Evaluating"):
+            labels = labels.to(torch.int64)
+            indices = list(itertools.islice(test_indices, len(labels)))
+            scores["student"].update(torch.sigmoid(student(images).float()), labels)
+            scores["teacher"].update(torch.sigmoid(torch.from_numpy(teacher_logits[indices])), labels)
+
+    results: dict[str, dict[str, Any]] = {}
+    for name, model, model_args in (("teacher", teacher, teacher_args), ("student", student, args)):
+        values = scores[name].compute()
+        results[name] = {
+            "model_name": model_args.model_name,
+            "image_size": model_args.image_size,
+            "parameters": sum(parameter.numel() for parameter in model.parameters()),
+            **measure_latency(
+                model, model_args.image_size, args.batch_size, args.latency_runs, args.throughput_batches
+            ),
+            "weighted_auroc": values["weighted_auroc"].item(),
+            # Classes without positive or negative test samples have no ROC AUC
+            "auroc": {
+                class_name: None if math.isnan(value) else value
+                for class_name, value in zip(model.class_names, values["auroc"].tolist())
+            },
+        }
+        print(
+            f"{name} {model_args.model_name} at {model_args.image_size}px: p50 {results[name]['latency_ms_p50']:8.1f} ms, "
+            f"{results[name]['images_per_sec']:7.1f} images/sec, weighted ROC AUC {results[name]['weighted_auroc']:.4f}"
+        )
+    speedup = results["teacher"]["latency_ms_p50"] / results["student"]["latency_ms_p50"]
+    auroc_gap = results["student"]["weighted_auroc"] - results["teacher"]["weighted_auroc"]
+    print(f"The student is {speedup:.1f}x faster, with a weighted ROC AUC {auroc_gap:+.4f} from the teacher.")
+    with open(output_dir / "report.json", "w") as f:
+        json.dump(
+            {
+                "checkpoint": str(checkpoint),
+                "teacher_checkpoint": str(args.teacher_checkpoint),
+                "num_threads": torch.get_num_threads(),
+                "speedup": speedup,
+                "weighted_auroc_gap": auroc_gap,
+                "results": results,
+            },
+            f,
+            indent=4,
+        )
+    print(f"Report saved to: {output_dir / 'report.json'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import copy
+import importlib.util
+import itertools
+import json
+import math
+import time
+import warnings
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Callable
+import numpy as np
+import torch
+from lightning import seed_everything
+from torch import Tensor, nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+from backend.classes.HistogramAUC import HistogramAUC
+from backend.utility.find_mean_std import load_stats
+from backend.utility.get_model import load_classifier
+from backend.utility.get_transforms import get_transforms
+from backend.utility.load_data import load_data
+from backend.utility.parse_args import parse_arguments
+
+# The eager and FX quantization APIs are deprecated in favor of torchao, which is not a dependency
+warnings.filterwarnings("ignore", message="torch.ao.quantization is deprecated", category=DeprecationWarning)
+
+
+def to_torchscript(model: nn.Module, example: Tensor, file: Path) -> torch.jit.ScriptModule:
+    """
+    Traces the model and freezes it, which inlines the weights and folds the batch norms into the convolutions,
+    then saves it. The file loads with torch.jit.load without the code of this repository.
+
+    Args:
+        model (nn.Module): The model in evaluation mode.
+        example (Tensor): An input batch to trace with.
+        file (Path): The file to save the TorchScript module to.
+
+    Returns:
+        torch.jit.ScriptModule: The frozen module.
+    """
+    with torch.no_grad():
+        module = torch.jit.freeze(torch.jit.trace(model, example))
+    torch.jit.save(module, file)
+    return module
+
+
+def to_onnx(model: nn.Module, example: Tensor, file: Path) -> Callable[[Tensor], Tensor] | None:
+    """
+    Exports the model to ONNX with a dynamic batch size and loads it in ONNX Runtime. Both are optional
+    dependencies, the export is skipped without them.
+
+    Args:
+        model (nn.Module): The model in evaluation mode.
+        example (Tensor): An input batch to export with.
+        file (Path): The file to save the ONNX model to.
+
+    Returns:
+        Callable[[Tensor], Tensor] | None: A function running a batch through the ONNX Runtime session, or None
+            when onnx or onnxruntime is not installed.
+    """
+    try:
+        torch.onnx.export(
+            model,
+            (example,),
+            file,
+            input_names=["images"],
+            output_names=["logits"],
+            dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+        )
+    except ImportError as e:
+        print(f"Skipping the ONNX export: {e}")
+        return None
+    if importlib.util.find_spec("onnxruntime") is None:
+        print(f"ONNX model saved to {file}, install onnxruntime to evaluate it.")
+        return None
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(str(file), providers=["CPUExecutionProvider"])
+    return lambda images: torch.from_numpy(session.run(None, {"images": images.numpy()})[0])
+
+
+def quantize_static_int8(model: nn.Module, calibration_loader: DataLoader, num_batches: int) -> nn.Module:
+    """
+    Quantizes the weights and the activations of the model to int8 with FX graph mode quantization. The ranges of
+    the activations are observed on the calibration batches, so every convolution runs in int8.
+
+    Args:
+        model (nn.Module): The model in evaluation mode, left unchanged.
+        calibration_loader (DataLoader): The loader of the calibration images.
+        num_batches (int): The number of calibration batches.
+
+    Returns:
+        nn.Module: The quantized model.
+    """
+    example = next(iter(calibration_loader))[0]
+    prepared = prepare_fx(
+        copy.deepcopy(model).eval(), get_default_qconfig_mapping(torch.backends.quantized.engine), (example,)
+    )
+    with torch.no_grad():
+        for images, _ in tqdm(
+            itertools.islice(calibration_loader, num_batches), total=num_batches, desc="Calibrating"
+        ):
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    """
+    Quantizes the weights of the linear layers to int8, their activations are quantized on the fly. It needs no
+    calibration, but only speeds up the classifier heads of the convolutional models.
+
+    Args:
+        model (nn.Module): The model in evaluation mode, left unchanged.
+
+    Returns:
+        nn.Module: The quantized model.
+    """
+    return quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def measure_latency(
+    predict: Callable[[Tensor], Tensor], image_size: int, batch_size: int, runs: int, batches: int
+) -> dict[str, float]:
+    """
+    Measures the latency of single images and the throughput of batches.
+
+    Args:
+        predict (Callable[[Tensor], Tensor]): The function running a batch through the model.
+        image_size (int): The image size.
+        batch_size (int): The batch size of the throughput.
+        runs (int): The number of single images timed.
+        batches (int): The number of batches timed.
+
+    Returns:
+        dict[str, float]: The median and 90th percentile latency in milliseconds and the images per second.
+    """
+    single = torch.randn(1, 3, image_size, image_size)
+    batch = torch.randn(batch_size, 3, image_size, image_size)
+    times = []
+    with torch.no_grad():
+        # The TorchScript profiling executor optimizes the graph during the first calls
+        for _ in range(3):
+            predict(single)
+        for _ in range(runs):
+            start = time.perf_counter()
+            predict(single)
+            times.append(time.perf_counter() - start)
+        predict(batch)
+        start = time.perf_counter()
+        for _ in range(batches):
+            predict(batch)
+        batch_time = time.perf_counter() - start
+    return {
+        "latency_ms_p50": 1000 * float(np.percentile(times, 50)),
+        "latency_ms_p90": 1000 * float(np.percentile(times, 90)),
+        "images_per_sec": batch_size * batches / batch_time,
+    }
+
+
+def evaluate(
+    predictors: dict[str, Callable[[Tensor], Tensor]], loader: DataLoader, num_classes: int, bins: int
+) -> tuple[dict[str, Tensor], dict[str, Tensor]]:
+    """
+    Runs every model on the same batches, so the images are only decoded once.
+
+    Args:
+        predictors (dict[str, Callable[[Tensor], Tensor]]): The functions running a batch through every model.
+        loader (DataLoader): The loader of the evaluation images.
+        num_classes (int): The number of classes.
+        bins (int): The probability bins of the ROC AUC histograms.
+
+    Returns:
+        tuple[dict[str, Tensor], dict[str, Tensor]]: The per-class ROC AUC and the probabilities of every model.
+    """
+    scores = {name: HistogramAUC(num_classes, bins) for name in predictors}
+    probabilities = {name: [] for name in predictors}
+    with torch.no_grad():
+        for images, labels in tqdm(loader, desc="Evaluating"):
+            for name, predict in predictors.items():
+                batch_probabilities = torch.sigmoid(predict(images).float())
+                scores[name].update(batch_probabilities, labels.to(torch.int64))
+                probabilities[name].append(batch_probabilities)
+    return (
+        {name: score.compute()["auroc"] for name, score in scores.items()},
+        {name: torch.cat(values) for name, values in probabilities.items()},
+    )
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Export a trained checkpoint to TorchScript and ONNX for CPU inference, with dynamic and static int8 quantization, and report the ROC AUC drift and the latency of every artifact against the fp32 model. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="The .ckpt or .pth file saved by train.py. Defaults to <root_dir>/<model_name>.pth.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="The directory to write the artifacts and report.json to. Defaults to <root_dir>/export/<model_name>.",
+    )
+    parser.add_argument(
+        "--calibration_batches",
+        type=int,
+        default=32,
+        help="The number of training batches the static quantization observes the activations on.",
+    )
+    parser.add_argument(
+        "--eval_batches",
+        type=int,
+        default=None,
+        help="The number of test batches the ROC AUC is computed on. Defaults to the whole test split.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.005,
+        help="The largest per-class ROC AUC drift from the fp32 model an artifact can be selected with.",
+    )
+    parser.add_argument(
+        "--latency_runs",
+        type=int,
+        default=20,
+        help="The number of single images timed per artifact.",
+    )
+    parser.add_argument(
+        "--throughput_batches",
+        type=int,
+        default=5,
+        help="The number of batches timed per artifact.",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="The number of CPU threads, as on the serving machines. Defaults to the PyTorch default.",
+    )
+    args: Namespace = parse_arguments(parser)
+    if args.stats_file:
+        args.mean, args.std = load_stats(args.stats_file)
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    torch.backends.quantized.engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    checkpoint = Path(args.checkpoint or Path(args.root_dir) / f"{args.model_name}.pth")
+    output_dir = Path(args.output_dir or Path(args.root_dir) / "export" / args.model_name)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    classifier = load_classifier(checkpoint, args)
+    model = classifier.model
+    # Same seed as train.py, for the shuffling of the calibration batches
+    seed_everything(42)
+    # load_data only builds the DistributedSampler of the test loader (which needs DDP) for a single device
+    loader_args = copy.copy(args)
+    loader_args.devices = max(args.devices, 2)
+    train_loader, _, test_loader = load_data(_args=loader_args, _transforms=get_transforms(args, train=False))
+    example = next(iter(test_loader))[0]
+
+    # The eager fp32 model is the reference every artifact is compared to
+    predictors: dict[str, Callable[[Tensor], Tensor]] = {"fp32_eager": model}
+    files: dict[str, Path | None] = {"fp32_eager": None}
+    files["fp32_torchscript"] = output_dir / "fp32.pt"
+    predictors["fp32_torchscript"] = to_torchscript(model, example, files["fp32_torchscript"])
+    files["dynamic_int8_torchscript"] = output_dir / "dynamic_int8.pt"
+    predictors["dynamic_int8_torchscript"] = to_torchscript(
+        quantize_dynamic_int8(model), example, files["dynamic_int8_torchscript"]
+    )
+    files["static_int8_torchscript"] = output_dir / "static_int8.pt"
+    predictors["static_int8_torchscript"] = to_torchscript(
+        quantize_static_int8(model, train_loader, args.calibration_batches), example, files["static_int8_torchscript"]
+    )
+    onnx_predict = to_onnx(model, example, output_dir / "fp32.onnx")
+    if onnx_predict is not None:
+        files["fp32_onnx"], predictors["fp32_onnx"] = output_dir / "fp32.onnx", onnx_predict
+
+    eval_loader = itertools.islice(test_loader, args.eval_batches) if args.eval_batches else test_loader
+    aurocs, probabilities = evaluate(predictors, eval_loader, args.num_classes, args.test_auc_bins)
+
+    results: dict[str, dict[str, Any]] = {}
+    for name, predict in predictors.items():
+        drift = aurocs[name] - aurocs["fp32_eager"]
+        # Classes without positive or negative test samples have no ROC AUC
+        valid = ~torch.isnan(drift)
+        results[name] = {
+            "file": str(files[name]) if files[name] else None,
+            "size_mb": files[name].stat().st_size / 2**20 if files[name] else None,
+            **measure_latency(predict, args.image_size, args.batch_size, args.latency_runs, args.throughput_batches),
+            "max_auroc_drift": drift[valid].abs().max().item() if valid.any() else None,
+            "max_probability_error": (probabilities[name] - probabilities["fp32_eager"]).abs().max().item(),
+            "auroc": {
+                class_name: None if math.isnan(value) else value
+                for class_name, value in zip(classifier.class_names, aurocs[name].tolist())
+            },
+            "auroc_drift": {
+                class_name: None if math.isnan(value) else value
+                for class_name, value in zip(classifier.class_names, drift.tolist())
+            },
+        }
+        print(
+            f"{name:25s} p50 {results[name]['latency_ms_p50']:8.1f} ms, {results[name]['images_per_sec']:7.1f} images/sec, "
+            f"max ROC AUC drift {results[name]['max_auroc_drift'] or 0:.4f}"
+        )
+
+    # The fastest single image artifact that stays within the tolerance
+    candidates = [
+        name
+        for name, result in results.items()
+        if result["file"] and (result["max_auroc_drift"] or 0) <= args.tolerance
+    ]
+    selected = min(candidates, key=lambda name: results[name]["latency_ms_p50"]) if candidates else None
+    print(f"Selected: {selected}" if selected else f"No artifact is within a ROC AUC drift of {args.tolerance}.")
+    with open(output_dir / "report.json", "w") as f:
+        json.dump(
+            {
+                "checkpoint": str(checkpoint),
+                "model_name": args.model_name,
+                "image_size": args.image_size,
+                "num_threads": torch.get_num_threads(),
+                "quantized_engine": torch.backends.quantized.engine,
+                "tolerance": args.tolerance,
+                "selected": selected,
+                "results": results,
+            },
+            f,
+            indent=4,
+        )
+    print(f"Report saved to: {output_dir / 'report.json'}")
+
+
+if __name__ == "__main__":
+    main()
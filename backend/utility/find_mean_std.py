@@ -1,26 +1,246 @@
-# https://stackoverflow.com/questions/66678052/how-to-calculate-the-mean-and-the-std-of-cifar10-data
+import json
+from argparse import ArgumentParser, Namespace
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
 import torch
+from torch import Tensor
+from torch.utils.data import Dataset
+from torchvision.transforms import Compose, Grayscale, InterpolationMode, Resize, ToTensor
 from tqdm import tqdm
+from backend.classes.CheXpert_Dataset import CheXpert
+from backend.utility.parse_args import parse_arguments
 
 
-def get_mean_std(trainLoader):
-    imgs = None
+class ChannelStats:
+    """
+    Streaming per-channel mean, variance and histogram. Batches are reduced on their own and merged into the running
+    state with the parallel algorithm of Chan et al., so memory is constant and partial states computed in different
+    processes can be merged exactly.
+    """
+
+    def __init__(self, channels: int, bins: int = 0):
+        """
+        Args:
+            channels (int): The number of channels of the images.
+            bins (int): The number of histogram bins over [0, 1]. 0 disables the histogram.
+        """
+        self.count = 0
+        self.mean = torch.zeros(channels, dtype=torch.float64)
+        self.m2 = torch.zeros(channels, dtype=torch.float64)
+        self.bins = bins
+        self.histogram = torch.zeros(channels, bins, dtype=torch.float64) if bins else None
+
+    def update(self, images: Tensor) -> None:
+        """
+        Adds a batch of images to the statistics.
+
+        Args:
+            images (Tensor): A (C, H, W) image or a (B, C, H, W) batch with values in [0, 1].
+        """
+        if images.ndim == 3:
+            images = images.unsqueeze(0)
+        pixels = images.detach().cpu().transpose(0, 1).reshape(images.shape[1], -1).to(torch.float64)
+        batch = ChannelStats(pixels.shape[0], self.bins)
+        batch.count = pixels.shape[1]
+        batch.mean = pixels.mean(dim=1)
+        batch.m2 = ((pixels - batch.mean[:, None]) ** 2).sum(dim=1)
+        if self.bins:
+            batch.histogram = torch.stack(
+                [torch.histc(channel, bins=self.bins, min=0, max=1) for channel in pixels]
+            )
+        self.merge(batch)
+
+    def merge(self, other: "ChannelStats") -> "ChannelStats":
+        """
+        Merges the statistics of another stream into this one.
+
+        Args:
+            other (ChannelStats): The statistics to merge.
+
+        Returns:
+            ChannelStats: self, to allow chaining.
+        """
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta**2 * (self.count * other.count / count)
+        self.count = count
+        if self.histogram is not None:
+            self.histogram += other.histogram
+        return self
+
+    @property
+    def std(self) -> Tensor:
+        """
+        The per-channel population standard deviation.
+        """
+        return torch.sqrt(self.m2 / max(self.count, 1))
+
+    def to_dict(self) -> dict:
+        """
+        Returns the statistics in the format written by the CLI and read by train.py.
+        """
+        result = {
+            "mean": self.mean.tolist(),
+            "std": self.std.tolist(),
+            "pixels_per_channel": self.count,
+        }
+        if self.histogram is not None:
+            result["histogram"] = {
+                "bins": self.bins,
+                "counts": self.histogram.to(torch.int64).tolist(),
+            }
+        return result
+
+
+def get_mean_std(trainLoader, bins: int = 0) -> ChannelStats:
+    """
+    Computes the per-channel mean and standard deviation of the images of a DataLoader in a single streaming pass.
+
+    Args:
+        trainLoader: The DataLoader yielding (images, labels) batches.
+        bins (int): The number of histogram bins over [0, 1]. 0 disables the histogram.
+
+    Returns:
+        ChannelStats: The statistics of the images.
+    """
+    stats = None
     for batch in tqdm(trainLoader):
         image_batch = batch[0]
-        if imgs is None:
-            imgs = image_batch.cpu()
-        else:
-            imgs = torch.cat([imgs, image_batch.cpu()], dim=0)
-    imgs = imgs.numpy()
-
-    # calculate mean over each channel (r,g,b)
-    mean_r = imgs[:, 0, :, :].mean()
-    mean_g = imgs[:, 1, :, :].mean()
-    mean_b = imgs[:, 2, :, :].mean()
-    print(mean_r, mean_g, mean_b)
-
-    # calculate std over each channel (r,g,b)
-    std_r = imgs[:, 0, :, :].std()
-    std_g = imgs[:, 1, :, :].std()
-    std_b = imgs[:, 2, :, :].std()
-    print(std_r, std_g, std_b)
+        if stats is None:
+            stats = ChannelStats(image_batch.shape[1], bins)
+        stats.update(image_batch)
+    print(stats.mean.numpy(), stats.std.numpy())
+    return stats
+
+
+# Dataset of the worker process, set once by _init_worker
+_dataset: Dataset | None = None
+
+
+def _init_worker(dataset: Dataset) -> None:
+    """
+    Sets the dataset of a worker process.
+    """
+    global _dataset
+    _dataset = dataset
+    # The workers already run in parallel
+    torch.set_num_threads(1)
+
+
+def _chunk_stats(task: tuple[np.ndarray, int]) -> ChannelStats:
+    """
+    Computes the statistics of a chunk of the dataset in a worker process.
+
+    Args:
+        task (tuple[np.ndarray, int]): The indices of the chunk and the number of histogram bins.
+
+    Returns:
+        ChannelStats: The statistics of the chunk.
+    """
+    indices, bins = task
+    stats = None
+    for idx in indices:
+        image = _dataset[int(idx)][0]
+        if stats is None:
+            stats = ChannelStats(image.shape[0], bins)
+        stats.update(image)
+    return stats
+
+
+def compute_stats(
+    dataset: Dataset,
+    num_workers: int,
+    sample_size: int | None = None,
+    bins: int = 0,
+    seed: int = 42,
+    chunk_size: int = 256,
+) -> ChannelStats:
+    """
+    Computes the per-channel statistics of a dataset across worker processes. Every worker reduces chunks of the
+    dataset to partial statistics which are merged in the main process.
+
+    Args:
+        dataset (Dataset): The dataset yielding (image tensor, label) pairs.
+        num_workers (int): The number of worker processes.
+        sample_size (int | None): The number of randomly chosen images to use. None uses the whole dataset.
+        bins (int): The number of histogram bins over [0, 1]. 0 disables the histogram.
+        seed (int): The seed used to choose the random subsample.
+        chunk_size (int): The number of images per task sent to a worker.
+
+    Returns:
+        ChannelStats: The statistics of the dataset.
+    """
+    if sample_size is not None and sample_size < len(dataset):
+        indices = np.random.default_rng(seed).choice(len(dataset), sample_size, replace=False)
+    else:
+        indices = np.arange(len(dataset))
+    chunks = [(indices[i : i + chunk_size], bins) for i in range(0, len(indices), chunk_size)]
+
+    stats = None
+    with Pool(
+        processes=max(num_workers, 1), initializer=_init_worker, initargs=(dataset,)
+    ) as pool:
+        for partial in tqdm(pool.imap_unordered(_chunk_stats, chunks), total=len(chunks)):
+            stats = partial if stats is None else stats.merge(partial)
+    return stats
+
+
+def load_stats(stats_file: str | Path) -> tuple[list[float], list[float]]:
+    """
+    Loads the mean and standard deviation written by the CLI.
+
+    Args:
+        stats_file (str | Path): The json file written by this script.
+
+    Returns:
+        tuple[list[float], list[float]]: The per-channel mean and standard deviation.
+    """
+    with open(stats_file, "r") as f:
+        stats = json.load(f)
+    return stats["mean"], stats["std"]
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Compute the per-channel mean and standard deviation of the CheXpert images. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--sample_size",
+        type=int,
+        default=None,
+        help="The number of randomly chosen images to use. Defaults to the whole dataset.",
+    )
+    parser.add_argument(
+        "--bins",
+        type=int,
+        default=0,
+        help="The number of pixel histogram bins to write. Defaults to no histogram.",
+    )
+    args: Namespace = parse_arguments(parser)
+    # The same preprocessing as train.py without the random augmentations
+    resize = [] if args.use_cache else [
+        Resize((args.image_size, args.image_size), interpolation=InterpolationMode.BICUBIC)
+    ]
+    dataset = CheXpert(
+        root_dir=args.root_dir,
+        train=True,
+        transform=Compose([Grayscale(num_output_channels=3), *resize, ToTensor()]),
+        use_cache=args.use_cache,
+        image_size=args.image_size,
+    )
+    stats = compute_stats(dataset, args.num_workers, args.sample_size, args.bins)
+    print(stats.mean.numpy(), stats.std.numpy())
+
+    output = Path(args.stats_file or Path(args.root_dir) / "CheXpert" / "stats.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"image_size": args.image_size, **stats.to_dict()}, f, indent=4)
+    print(f"Statistics written to: {output}")
+
+
+if __name__ == "__main__":
+    main()
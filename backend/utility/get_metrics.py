@@ -0,0 +1,48 @@
+from torchmetrics import Metric, MetricCollection
+from torchmetrics.classification import (
+    MultilabelAccuracy,
+    MultilabelAUROC,
+    MultilabelAveragePrecision,
+    MultilabelF1Score,
+    MultilabelPrecision,
+    MultilabelRecall,
+)
+
+# The metrics that can be selected per stage. The curve metrics (auroc, auprc) are the expensive ones
+METRICS = {
+    "accuracy": MultilabelAccuracy,
+    "precision": MultilabelPrecision,
+    "recall": MultilabelRecall,
+    "f1_score": MultilabelF1Score,
+    "auroc": MultilabelAUROC,
+    "auprc": MultilabelAveragePrecision,
+}
+CURVE_METRICS = ("auroc", "auprc")
+
+
+def get_metrics(
+    names: list[str], num_classes: int, stage: str, thresholds: int | None = 200
+) -> MetricCollection:
+    """
+    Builds the stateful metrics of a stage. Every step only updates their state (counts, or a fixed number of
+    threshold bins for the curve metrics), the values are computed once per epoch and synchronized across the DDP
+    ranks by compute(). All the metrics are weighted by the number of positives of every class.
+
+    Args:
+        names (list[str]): The metrics to compute, any of the keys of METRICS.
+        num_classes (int): The number of labels.
+        stage (str): The stage, appended to the metric names, e.g. accuracy/val.
+        thresholds (int | None): The number of threshold bins of the curve metrics. None keeps all the predictions
+            and computes the exact curves, with a memory that grows with the number of samples.
+
+    Returns:
+        MetricCollection: The metrics of the stage.
+    """
+    unknown = set(names) - METRICS.keys()
+    if unknown:
+        raise ValueError(f"Unknown metrics {sorted(unknown)}. Please choose from {list(METRICS)}.")
+    metrics: dict[str, Metric] = {}
+    for name in names:
+        kwargs = {"thresholds": thresholds} if name in CURVE_METRICS else {}
+        metrics[name] = METRICS[name](num_labels=num_classes, average="weighted", **kwargs)
+    return MetricCollection(metrics, postfix=f"/{stage}")
@@ -1,19 +1,94 @@
+import torch
 from argparse import Namespace
+from contextlib import nullcontext
+from pathlib import Path
+from torch import nn
 from backend.classes.Classifier import Classifier
+from backend.classes.Distiller import Distiller
 from backend.classes.Models import EfficientNet, ResNet, DenseNet
+from backend.utility.weight_cache import get_pretrained_file
 
 
 def get_model(args: Namespace) -> Classifier:
-    if args.model_arch.lower() == "efficientnet":
-        model = EfficientNet(args.num_classes, args.model_name, args.pretrained)
-        return Classifier(model, args)
-    elif args.model_arch.lower() == "resnet":
-        model = ResNet(args.num_classes, args.model_name, args.pretrained)
-        return Classifier(model, args)
-    elif args.model_arch.lower() == "densenet":
-        model = DenseNet(args.num_classes, args.model_name, args.pretrained)
-        return Classifier(model, args)
-    else:
-        raise ValueError(
-            "Invalid model architecture. Please choose either EfficientNet, ResNet or DenseNet."
-        )
+    model = create_model(args)
+    # With a teacher checkpoint, the model is trained as its distilled student
+    classifier = Distiller if getattr(args, "teacher_checkpoint", None) else Classifier
+    return classifier(set_execution_mode(model, args), args)
+
+
+def load_classifier(checkpoint_file: str | Path, args: Namespace) -> Classifier:
+    """
+    Rebuilds a trained Classifier for inference from the .ckpt or the .pth file saved by train.py. The model is
+    created on the meta device, so neither the random initialization nor the pretrained weights are computed only
+    to be overwritten by the checkpoint.
+
+    Args:
+        checkpoint_file (str | Path): The Lightning checkpoint or the state_dict of the Classifier.
+        args (Namespace): The command-line arguments containing the model parameters it was trained with.
+
+    Returns:
+        Classifier: The trained model on the CPU, in evaluation mode.
+    """
+    # The .ckpt files also hold the state of the trainer and its callbacks, which are our own files
+    checkpoint = torch.load(checkpoint_file, map_location="cpu", weights_only=False)
+    classifier = Classifier(create_model(args, device="meta"), args)
+    classifier.load_state_dict(checkpoint.get("state_dict", checkpoint), assign=True)
+    return classifier.eval()
+
+
+def create_model(args: Namespace, device: str | torch.device | None = None) -> nn.Module:
+    """
+    Builds the model of the chosen architecture. The pretrained weights are read from the local weight cache
+    (see utility/weight_cache.py), which is filled on the first use unless --offline is set.
+
+    Args:
+        args (Namespace): The command-line arguments containing the model parameters.
+        device (str | torch.device | None): The device to create the parameters on. "meta" allocates no memory and
+            skips the initialization and the pretrained weights, for models whose weights are then loaded from a
+            checkpoint with load_state_dict(..., assign=True).
+
+    Returns:
+        nn.Module: The model.
+    """
+    pretrained = args.pretrained and str(device) != "meta"
+    pretrained_file = None
+    if pretrained:
+        weights_dir = Path(getattr(args, "weights_dir", None) or Path(args.root_dir) / "weights")
+        pretrained_file = get_pretrained_file(args.model_name, weights_dir, getattr(args, "offline", False))
+    with torch.device(device) if device is not None else nullcontext():
+        if args.model_arch.lower() == "efficientnet":
+            return EfficientNet(args.num_classes, args.model_name, pretrained, pretrained_file=pretrained_file)
+        elif args.model_arch.lower() == "resnet":
+            return ResNet(args.num_classes, args.model_name, pretrained, pretrained_file=pretrained_file)
+        elif args.model_arch.lower() == "densenet":
+            return DenseNet(
+                args.num_classes,
+                args.model_name,
+                pretrained,
+                memory_efficient=getattr(args, "memory_efficient", False),
+                pretrained_file=pretrained_file,
+            )
+        else:
+            raise ValueError(
+                "Invalid model architecture. Please choose either EfficientNet, ResNet or DenseNet."
+            )
+
+
+def set_execution_mode(model: nn.Module, args: Namespace) -> nn.Module:
+    """
+    Converts the model to the channels_last memory format and compiles it, as set by the arguments.
+    The model is compiled in place, so its state_dict keys are the same as in eager mode. The compilation itself
+    happens lazily on the first batches, see Classifier.warm_up.
+
+    Args:
+        model (nn.Module): The model to convert.
+        args (Namespace): The command-line arguments containing the execution mode parameters.
+
+    Returns:
+        nn.Module: The converted model.
+    """
+    if getattr(args, "channels_last", False):
+        model = model.to(memory_format=torch.channels_last)
+    if getattr(args, "compile", False):
+        model.compile(mode=args.compile_mode)
+    return model
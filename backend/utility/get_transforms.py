@@ -0,0 +1,65 @@
+from argparse import Namespace
+from torchvision.transforms import (
+    Compose,
+    ToTensor,
+    PILToTensor,
+    InterpolationMode,
+    Normalize,
+    Resize,
+    RandomHorizontalFlip,
+    RandomAffine,
+    ColorJitter,
+    Grayscale,
+)
+
+
+def get_transforms(args: Namespace, train: bool = True) -> Compose:
+    """
+    Builds the image transforms applied in the DataLoader workers.
+
+    Args:
+        args (Namespace): The command-line arguments containing the preprocessing parameters.
+        train (bool): Whether to build the random augmentations of the training data, or the deterministic
+            preprocessing of evaluation and inference.
+
+    Returns:
+        Compose: The transforms for the training data, or for evaluation and inference.
+    """
+    # The cached images are already grayscale and resized to image_size
+    resize = [] if args.use_cache else [
+        Resize(
+            (args.image_size, args.image_size),
+            interpolation=InterpolationMode.BICUBIC,
+        )
+    ]
+    if not train:
+        # Normalized in the workers even with batch augmentation, the model is called directly and not by the Trainer
+        return Compose(
+            [
+                Grayscale(num_output_channels=3),
+                *resize,
+                ToTensor(),
+                Normalize(mean=args.mean, std=args.std),
+            ]
+        )
+    if args.batch_augment:
+        # The workers only decode and collate, the Classifier augments and normalizes the batches on the device
+        return Compose(
+            [
+                Grayscale(num_output_channels=1),
+                *resize,
+                PILToTensor(),
+            ]
+        )
+    return Compose(
+        [
+            # Convert to 1 channel
+            Grayscale(num_output_channels=3),
+            *resize,
+            RandomHorizontalFlip(),
+            RandomAffine(degrees=30, translate=(0.30,0.30), scale=(0.70,1.30)),
+            ColorJitter(brightness=0.30, contrast=0.30),
+            ToTensor(),
+            Normalize(mean=args.mean, std=args.std),
+        ]
+    )
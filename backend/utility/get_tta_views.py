@@ -0,0 +1,56 @@
+import torch
+from torch import Tensor, nn
+
+
+def get_tta_thetas(flip: bool, shifts: list[float], scales: list[float]) -> Tensor:
+    """
+    Builds the affine transforms of the test-time augmentation views: the image itself, its horizontal flip,
+    shifts left, right, up and down, and center crops resized back to the full size.
+
+    Args:
+        flip (bool): Whether to add the horizontal flip.
+        shifts (list[float]): The shifts as fractions of the image size, each adds four views.
+        scales (list[float]): The sides of the center crops as fractions of the image size, each adds one view.
+
+    Returns:
+        Tensor: The (views, 2, 3) matrices mapping the output coordinates of every view to the input coordinates,
+            as expected by affine_grid.
+    """
+    # Scale of x, scale of y, translation of x and of y, in the [-1, 1] coordinates of affine_grid
+    views = [(1.0, 1.0, 0.0, 0.0)]
+    if flip:
+        views.append((-1.0, 1.0, 0.0, 0.0))
+    for shift in shifts:
+        views += [
+            (1.0, 1.0, 2 * shift, 0.0),
+            (1.0, 1.0, -2 * shift, 0.0),
+            (1.0, 1.0, 0.0, 2 * shift),
+            (1.0, 1.0, 0.0, -2 * shift),
+        ]
+    for scale in scales:
+        views.append((scale, scale, 0.0, 0.0))
+    return torch.tensor([[[sx, 0.0, tx], [0.0, sy, ty]] for sx, sy, tx, ty in views])
+
+
+def get_tta_views(images: Tensor, thetas: Tensor, start: int, end: int) -> Tensor:
+    """
+    Builds a range of the views of a batch, numbered view by view: view v of image i is number v * batch + i.
+    All the views of the range are resampled with one grid_sample, and only that range is in memory.
+
+    Args:
+        images (Tensor): The batch of images.
+        thetas (Tensor): The affine transforms of the views, from get_tta_thetas.
+        start (int): The first view number.
+        end (int): The view number after the last one.
+
+    Returns:
+        Tensor: The (end - start, channels, height, width) views.
+    """
+    indices = torch.arange(start, end, device=images.device)
+    view_indices, image_indices = indices // len(images), indices % len(images)
+    selected = images[image_indices]
+    grid = nn.functional.affine_grid(
+        thetas.to(images.device, images.dtype)[view_indices], list(selected.shape), align_corners=False
+    )
+    # The pixels shifted in from outside repeat the border, like the empty background of the radiographs
+    return nn.functional.grid_sample(selected, grid, mode="bilinear", padding_mode="border", align_corners=False)
@@ -0,0 +1,85 @@
+import json
+import os
+import socket
+from argparse import Namespace
+from pathlib import Path
+from typing import Any
+
+# The arguments a host profile can set
+PROFILE_KEYS = ("batch_size", "num_workers")
+# The boolean arguments the tuned settings depend on
+PROFILE_FLAGS = ("memory_efficient", "compile", "channels_last")
+
+
+def profile_file(root_dir: str | Path) -> Path:
+    """
+    Get the default profile file of this host.
+
+    Args:
+        root_dir (str | Path): The root directory of the project.
+
+    Returns:
+        Path: The profile file, <root_dir>/profiles/<hostname>.json.
+    """
+    return Path(root_dir) / "profiles" / f"{socket.gethostname()}.json"
+
+
+def profile_key(args: Namespace) -> str:
+    """
+    Get the key of the settings of a model, image size and training setup in a profile. The memory and the speed of
+    a training step also depend on the memory_efficient, compile and channels_last settings, and the batch size on
+    the gradient accumulation, so each setup is tuned and loaded on its own.
+
+    Args:
+        args (Namespace): The arguments, with the model_name, image_size, memory_efficient, compile, channels_last
+            and accumulate_grad_batches.
+
+    Returns:
+        str: The key, e.g. densenet201@512 or densenet201@512+memory_efficient+accumulate_grad_batches=4.
+    """
+    key = f"{args.model_name}@{args.image_size}"
+    key += "".join(f"+{name}" for name in PROFILE_FLAGS if getattr(args, name, False))
+    if getattr(args, "accumulate_grad_batches", 1) != 1:
+        key += f"+accumulate_grad_batches={args.accumulate_grad_batches}"
+    return key
+
+
+def load_profile(file: str | Path, args: Namespace) -> dict[str, Any]:
+    """
+    Load the tuned settings of a model, image size and training setup from a profile.
+
+    Args:
+        file (str | Path): The profile file.
+        args (Namespace): The arguments the settings are keyed by, see profile_key.
+
+    Returns:
+        dict[str, Any]: The tuned arguments, empty when the file or the settings do not exist.
+    """
+    if not Path(file).exists():
+        return {}
+    with open(file, "r") as f:
+        settings = json.load(f).get("settings", {}).get(profile_key(args), {})
+    return {key: settings[key] for key in PROFILE_KEYS if key in settings}
+
+
+def save_profile(file: str | Path, args: Namespace, settings: dict[str, Any]) -> None:
+    """
+    Add the tuned settings of a model, image size and training setup to a profile, keeping the settings of the
+    other ones.
+
+    Args:
+        file (str | Path): The profile file.
+        args (Namespace): The arguments the settings are keyed by, see profile_key.
+        settings (dict[str, Any]): The tuned arguments and the measurements they are based on.
+    """
+    file = Path(file)
+    profile = {"host": socket.gethostname(), "settings": {}}
+    if file.exists():
+        with open(file, "r") as f:
+            profile = json.load(f)
+    profile["settings"][profile_key(args)] = settings
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(profile, f, indent=4)
+    tmp_file.replace(file)
@@ -1,13 +1,48 @@
 from argparse import Namespace
 from decimal import Decimal
+from pathlib import Path
 
-from torch.utils.data import DataLoader, random_split, DistributedSampler
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, random_split, DistributedSampler, Subset
 from torchvision.transforms import Compose
 from backend.classes.CheXpert_Dataset import CheXpert
+from backend.classes.Distillation_Dataset import DistillationDataset
+from backend.classes.ResumableSampler import ResumableSampler
+from backend.classes.Shard_Dataset import CheXpertShards
+
+
+def split_dataset(dataset: Dataset, _args: Namespace) -> list[Subset]:
+    """
+    Splits the training listfile into the training, validation, and test sets, with its own generator so the split
+    does not depend on what used the global random state before, e.g. the DataLoader of the teacher logits. Seeded
+    like seed_everything(42) in train.py, so it is the split of the models trained before. utility/write_shards.py
+    writes the shards of every set from the same split.
+
+    Args:
+        dataset (Dataset): The dataset of the training listfile.
+        _args (Namespace): The command-line arguments containing the train_size and val_size.
+
+    Returns:
+        list[Subset]: The training, validation, and test sets.
+    """
+    return random_split(
+        dataset,
+        lengths=[
+            _args.train_size,
+            _args.val_size,
+            float(
+                Decimal(1)
+                - Decimal(str(_args.train_size))
+                - Decimal(str(_args.val_size))
+            ),
+        ],
+        generator=torch.Generator().manual_seed(42),
+    )
 
 
 def load_data(
-    _args: Namespace, _transforms: Compose = None
+    _args: Namespace, _transforms: Compose = None, _teacher_logits: np.ndarray | None = None
 ) -> tuple[DataLoader, DataLoader, DataLoader]:
     """
     Loads the data and splits it into training, validation, and test sets.
@@ -15,31 +50,36 @@ def load_data(
     Args:
         _args (Namespace): The command-line arguments containing data loading parameters.
         _transforms (Compose, optional): The transformations to apply to the dataset. Defaults to None.
+        _teacher_logits (np.ndarray, optional): The teacher logits of every image of the dataset, from
+            utility/distill.py. The training samples then also hold the teacher logits of their image.
+            Defaults to None.
 
     Returns:
         tuple[DataLoader, DataLoader, DataLoader]: A tuple containing the DataLoaders for the training, validation, and test sets.
     """
 
+    if _args.use_shards:
+        if _teacher_logits is not None:
+            raise ValueError("The teacher logits are indexed by image, distillation cannot stream the shards.")
+        return load_shard_data(_args, _transforms)
+
     # Load the data
     train_test_dataset: CheXpert = CheXpert(
-        root_dir=_args.root_dir, train=True, transform=_transforms
+        root_dir=_args.root_dir,
+        train=True,
+        transform=_transforms,
+        use_cache=_args.use_cache,
+        image_size=_args.image_size,
+        fast_decode=_args.fast_decode,
+        cache_sizes=_args.progressive_sizes,
     )
     # val_dataset: CheXpert = CheXpert(
     #     root_dir=_args.root_dir, train=False, transform=_transforms
     # )
-    # Split the training dataset into train, validation and test
-    train_dataset, val_dataset, test_dataset = random_split(
-        train_test_dataset,
-        lengths=[
-            _args.train_size,
-            _args.val_size,
-            float(
-                Decimal(1)
-                - Decimal(str(_args.train_size))
-                - Decimal(str(_args.val_size))
-            ),
-        ],
-    )
+    train_dataset, val_dataset, test_dataset = split_dataset(train_test_dataset, _args)
+    if _teacher_logits is not None:
+        # Same training images, with the teacher logits of every image
+        train_dataset = Subset(DistillationDataset(train_test_dataset, _teacher_logits), train_dataset.indices)
     print(f"Training dataset size: {len(train_dataset)}")
     print(f"Validation dataset size: {len(val_dataset)}")
     print(f"Test dataset size: {len(test_dataset)}")
@@ -48,24 +88,79 @@ def load_data(
         DataLoader(
             train_dataset,
             batch_size=_args.batch_size,
-            shuffle=True,
+            # Shuffles like shuffle=True, with an order that can be resumed in the middle of an epoch
+            sampler=ResumableSampler(len(train_dataset)),
             num_workers=_args.num_workers,
-            persistent_workers=True,
+            persistent_workers=_args.num_workers > 0,
+            pin_memory=_args.pin_memory,
         ),
         DataLoader(
             val_dataset,
             batch_size=_args.batch_size,
             shuffle=False,
             num_workers=_args.num_workers,
-            persistent_workers=True,
+            persistent_workers=_args.num_workers > 0,
+            pin_memory=_args.pin_memory,
         ),
         DataLoader(
             test_dataset,
             batch_size=_args.batch_size,
             shuffle=False,
             num_workers=_args.num_workers,
-            persistent_workers=True,
+            persistent_workers=_args.num_workers > 0,
             pin_memory=True,
             sampler=None if _args.devices > 1 else DistributedSampler(test_dataset)
         ),
     )
+
+
+def load_shard_data(
+    _args: Namespace, _transforms: Compose = None
+) -> tuple[DataLoader, DataLoader, DataLoader]:
+    """
+    Loads the training, validation, and test shards written by utility/write_shards.py. They hold the sets of
+    split_dataset, so the models trained on the shards are evaluated on the same images as the others.
+
+    Args:
+        _args (Namespace): The command-line arguments containing data loading parameters.
+        _transforms (Compose, optional): The transformations to apply to the dataset. Defaults to None.
+
+    Returns:
+        tuple[DataLoader, DataLoader, DataLoader]: A tuple containing the DataLoaders for the training, validation, and test sets.
+    """
+    index_file = Path(_args.root_dir) / "CheXpert" / "shards" / "train.json"
+    splits = [CheXpertShards.read_index(index_file, split) for split in ("train", "val", "test")]
+    sizes = [sum(counts) for _, counts in splits]
+    # The split only depends on the number of samples and the sizes of the sets
+    expected_sizes = [len(subset) for subset in split_dataset(range(sum(sizes)), _args)]
+    if sizes != expected_sizes:
+        raise ValueError(
+            f"The shards hold {sizes} training, validation and test samples, --train_size and --val_size split the "
+            f"dataset into {expected_sizes}. Write the shards again with utility/write_shards.py and the same "
+            "--train_size and --val_size."
+        )
+    datasets = [
+        CheXpertShards(
+            shard_files,
+            counts,
+            transform=_transforms,
+            shuffle=shuffle,
+            buffer_size=_args.shard_buffer,
+            num_workers=_args.num_workers,
+        )
+        for (shard_files, counts), shuffle in zip(splits, (True, False, False))
+    ]
+    print(f"Training dataset size: {sizes[0]}")
+    print(f"Validation dataset size: {sizes[1]}")
+    print(f"Test dataset size: {sizes[2]}")
+
+    return tuple(
+        DataLoader(
+            dataset,
+            batch_size=_args.batch_size,
+            num_workers=_args.num_workers,
+            persistent_workers=_args.num_workers > 0,
+            pin_memory=_args.pin_memory,
+        )
+        for dataset in datasets
+    )
@@ -1,5 +1,6 @@
-from argparse import ArgumentParser, Namespace
+from argparse import ArgumentParser, BooleanOptionalAction, Namespace
 from backend.CONFIG import params
+from backend.utility.host_profile import load_profile, profile_file
 
 
 def parse_arguments(parser: ArgumentParser) -> Namespace:
@@ -34,6 +35,20 @@ def parse_arguments(parser: ArgumentParser) -> Namespace:
         help="Whether to use a pretrained model.",
     )
 
+    parser.add_argument(
+        "--weights_dir",
+        type=str,
+        default=params["WEIGHTS_DIR"],
+        help="The local cache of the pretrained weights. Defaults to <root_dir>/weights.",
+    )
+
+    parser.add_argument(
+        "--offline",
+        action=BooleanOptionalAction,
+        default=params["OFFLINE"],
+        help="Whether to only read the pretrained weights from the local cache and never download them.",
+    )
+
     parser.add_argument(
         "--batch_size",
         type=int,
@@ -70,6 +85,42 @@ def parse_arguments(parser: ArgumentParser) -> Namespace:
         default=params["MOMENTUM"],
         help="The momentum for the optimizer.",
     )
+    parser.add_argument(
+        "--accumulate_grad_batches",
+        type=int,
+        default=params["ACCUMULATE_GRAD_BATCHES"],
+        help="The number of batches whose gradients are accumulated per optimizer step.",
+    )
+
+    parser.add_argument(
+        "--base_batch_size",
+        type=int,
+        default=params["BASE_BATCH_SIZE"],
+        help="The effective batch size the learning rate is tuned for.",
+    )
+
+    parser.add_argument(
+        "--lr_scaling",
+        type=str,
+        choices=["linear", "sqrt", "none"],
+        default=params["LR_SCALING"],
+        help="How to scale the learning rate from the base batch size to the effective batch size.",
+    )
+
+    parser.add_argument(
+        "--warmup_epochs",
+        type=float,
+        default=params["WARMUP_EPOCHS"],
+        help="The number of epochs of linear learning rate warm-up.",
+    )
+
+    parser.add_argument(
+        "--sync_batchnorm",
+        action=BooleanOptionalAction,
+        default=params["SYNC_BATCHNORM"],
+        help="Whether to compute the batch norm statistics over the batches of all the devices.",
+    )
+
     parser.add_argument(
         "--image_size",
         type=int,
@@ -88,6 +139,12 @@ def parse_arguments(parser: ArgumentParser) -> Namespace:
         default=params["NUM_WORKERS"],
         help="The number of worker threads for data loading.",
     )
+    parser.add_argument(
+        "--pin_memory",
+        action=BooleanOptionalAction,
+        default=params["PIN_MEMORY"],
+        help="Whether the training and validation DataLoaders use pinned memory.",
+    )
     parser.add_argument(
         "--num_classes",
         type=int,
@@ -124,4 +181,241 @@ def parse_arguments(parser: ArgumentParser) -> Namespace:
         default=params["TEST_SIZE"],
         help="The size of the validation set as a fraction of the total dataset.",
     )
+    parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        default=params["CHECKPOINT_DIR"],
+        help="The directory of the periodic checkpoints. Defaults to <root_dir>/checkpoints/<model_name>.",
+    )
+    parser.add_argument(
+        "--keep_last",
+        type=int,
+        default=params["KEEP_LAST"],
+        help="The number of most recent checkpoints to keep, next to the best one and last.ckpt.",
+    )
+    parser.add_argument(
+        "--checkpoint_every_n_steps",
+        type=int,
+        default=params["CHECKPOINT_EVERY_N_STEPS"],
+        help="Save a checkpoint every n training steps instead of at the end of every epoch.",
+    )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=params["RESUME"],
+        help="The checkpoint to resume training from, or last for the most recent one in --checkpoint_dir.",
+    )
+    parser.add_argument(
+        "--use_cache",
+        action=BooleanOptionalAction,
+        default=params["USE_CACHE"],
+        help="Whether to read the preprocessed image cache built by utility/build_cache.py instead of the JPEGs.",
+    )
+    parser.add_argument(
+        "--progressive_sizes",
+        type=int,
+        nargs="+",
+        default=params["PROGRESSIVE_SIZES"],
+        help="The image sizes of the progressive resizing schedule, ending at --image_size. Needs --use_cache.",
+    )
+    parser.add_argument(
+        "--progressive_epochs",
+        type=int,
+        nargs="+",
+        default=params["PROGRESSIVE_EPOCHS"],
+        help="The epoch at which every size of --progressive_sizes starts, starting at 0.",
+    )
+    parser.add_argument(
+        "--use_shards",
+        action=BooleanOptionalAction,
+        default=params["USE_SHARDS"],
+        help="Whether to stream the tar shards written by utility/write_shards.py instead of reading the JPEGs.",
+    )
+    parser.add_argument(
+        "--shard_buffer",
+        type=int,
+        default=params["SHARD_BUFFER"],
+        help="The number of samples in the shuffle buffer of every DataLoader worker when streaming shards.",
+    )
+    parser.add_argument(
+        "--fast_decode",
+        action=BooleanOptionalAction,
+        default=params["FAST_DECODE"],
+        help="Whether to decode the JPEGs at the smallest scale that is still at least the image size.",
+    )
+    parser.add_argument(
+        "--batch_augment",
+        action=BooleanOptionalAction,
+        default=params["BATCH_AUGMENT"],
+        help="Whether to run the augmentations on whole batches on the device instead of per image in the DataLoader workers.",
+    )
+    parser.add_argument(
+        "--memory_efficient",
+        action=BooleanOptionalAction,
+        default=params["MEMORY_EFFICIENT"],
+        help="Whether to checkpoint the dense layers of DenseNet, trading compute for activation memory.",
+    )
+    parser.add_argument(
+        "--channels_last",
+        action=BooleanOptionalAction,
+        default=params["CHANNELS_LAST"],
+        help="Whether to run the model and its inputs in the channels_last memory format.",
+    )
+    parser.add_argument(
+        "--compile",
+        action=BooleanOptionalAction,
+        default=params["COMPILE"],
+        help="Whether to compile the model with torch.compile.",
+    )
+    parser.add_argument(
+        "--compile_mode",
+        type=str,
+        choices=["default", "reduce-overhead", "max-autotune", "max-autotune-no-cudagraphs"],
+        default=params["COMPILE_MODE"],
+        help="The torch.compile mode.",
+    )
+    parser.add_argument(
+        "--compile_warmup",
+        type=int,
+        default=params["COMPILE_WARMUP"],
+        help="The number of training steps on random data that trigger the compilation before fitting.",
+    )
+    parser.add_argument(
+        "--mean",
+        type=float,
+        nargs=3,
+        default=params["MEAN"],
+        help="The per-channel mean used to normalize the images.",
+    )
+    parser.add_argument(
+        "--std",
+        type=float,
+        nargs=3,
+        default=params["STD"],
+        help="The per-channel standard deviation used to normalize the images.",
+    )
+    parser.add_argument(
+        "--stats_file",
+        type=str,
+        default=params["STATS_FILE"],
+        help="The json file written by utility/find_mean_std.py. Its mean and std override --mean and --std.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=params["PROFILE"],
+        help="The host profile written by utility/tune.py. Defaults to <root_dir>/profiles/<hostname>.json when it exists. Its batch size and number of workers override CONFIG.py, the command line overrides both.",
+    )
+    parser.add_argument(
+        "--train_metrics",
+        type=str,
+        nargs="+",
+        default=params["TRAIN_METRICS"],
+        help="The metrics accumulated over the training epochs.",
+    )
+    parser.add_argument(
+        "--val_metrics",
+        type=str,
+        nargs="+",
+        default=params["VAL_METRICS"],
+        help="The metrics accumulated over the validation epochs. Must contain accuracy.",
+    )
+    parser.add_argument(
+        "--test_metrics",
+        type=str,
+        nargs="+",
+        default=params["TEST_METRICS"],
+        help="The metrics accumulated over the test set.",
+    )
+    parser.add_argument(
+        "--metric_thresholds",
+        type=int,
+        default=params["METRIC_THRESHOLDS"],
+        help="The number of threshold bins of the auroc and auprc metrics.",
+    )
+    parser.add_argument(
+        "--test_auc_bins",
+        type=int,
+        default=params["TEST_AUC_BINS"],
+        help="The number of probability bins of the per-class test ROC AUC histograms.",
+    )
+    parser.add_argument(
+        "--tta",
+        action=BooleanOptionalAction,
+        default=params["TTA"],
+        help="Whether to test and serve on the aggregated logits of augmented views of every image.",
+    )
+    parser.add_argument(
+        "--tta_flip",
+        action=BooleanOptionalAction,
+        default=params["TTA_FLIP"],
+        help="Whether to add the horizontal flip to the test-time augmentation views.",
+    )
+    parser.add_argument(
+        "--tta_shifts",
+        type=float,
+        nargs="*",
+        default=params["TTA_SHIFTS"],
+        help="The test-time augmentation shifts as fractions of the image size, each adds shifts left, right, up and down.",
+    )
+    parser.add_argument(
+        "--tta_scales",
+        type=float,
+        nargs="*",
+        default=params["TTA_SCALES"],
+        help="The sides of the test-time augmentation center crops as fractions of the image size.",
+    )
+    parser.add_argument(
+        "--tta_aggregation",
+        type=str,
+        default=params["TTA_AGGREGATION"],
+        help="How the logits of the test-time augmentation views are aggregated: mean or max.",
+    )
+    parser.add_argument(
+        "--tta_memory_mb",
+        type=float,
+        default=params["TTA_MEMORY_MB"],
+        help="The activation memory budget of a forward pass of test-time augmentation views, in MiB.",
+    )
+    parser.add_argument(
+        "--teacher_checkpoint",
+        type=str,
+        default=params["TEACHER_CHECKPOINT"],
+        help="The .ckpt or .pth file of a trained model to distill into the model being trained.",
+    )
+    parser.add_argument(
+        "--teacher_arch",
+        type=str,
+        default=params["TEACHER_ARCH"],
+        help="The architecture of the teacher checkpoint.",
+    )
+    parser.add_argument(
+        "--teacher_name",
+        type=str,
+        default=params["TEACHER_NAME"],
+        help="The timm model name of the teacher checkpoint.",
+    )
+    parser.add_argument(
+        "--teacher_image_size",
+        type=int,
+        default=params["TEACHER_IMAGE_SIZE"],
+        help="The image size the teacher was trained at.",
+    )
+    parser.add_argument(
+        "--distill_alpha",
+        type=float,
+        default=params["DISTILL_ALPHA"],
+        help="The weight of the teacher targets in the distillation loss, the labels get the rest.",
+    )
+    parser.add_argument(
+        "--distill_temperature",
+        type=float,
+        default=params["DISTILL_TEMPERATURE"],
+        help="The temperature softening the teacher and student logits of the distillation loss.",
+    )
+    # Load the tuned settings of this host as new defaults, so the command line still overrides them
+    args, _ = parser.parse_known_args()
+    parser.set_defaults(
+        **load_profile(args.profile or profile_file(args.root_dir), args)
+    )
     return parser.parse_args()
@@ -0,0 +1,472 @@
+import copy
+import itertools
+import json
+import math
+from argparse import ArgumentParser, Namespace
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Callable, Iterable
+import timm.optim
+import torch
+from lightning import seed_everything
+from timm.models._efficientnet_blocks import EdgeResidual, InvertedResidual
+from timm.models.densenet import DenseLayer
+from timm.models.resnet import BasicBlock, Bottleneck
+from torch import Tensor, nn
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+from backend.utility.export_model import evaluate, measure_latency, to_torchscript
+from backend.utility.find_mean_std import load_stats
+from backend.utility.get_model import load_classifier
+from backend.utility.get_transforms import get_transforms
+from backend.utility.load_data import load_data
+from backend.utility.parse_args import parse_arguments
+
+# The name of a group of channels, the batch norm ranking them, the modules whose output channels they are (convolutions
+# and batch norms), and the convolutions whose input channels they are
+ChannelGroup = tuple[str, nn.BatchNorm2d, list[nn.Module], list[nn.Conv2d]]
+
+
+def get_channel_groups(model: nn.Module) -> list[ChannelGroup]:
+    """
+    Finds the channels that can be removed without changing the shape of any other layer: the channels inside the
+    blocks, whose producers and consumers are all in the block. The channels of the residual connections and of the
+    dense concatenations are left alone, removing one would change every block that adds or concatenates it.
+
+    Args:
+        model (nn.Module): The EfficientNet, ResNet or DenseNet model, e.g. Classifier.model.
+
+    Returns:
+        list[ChannelGroup]: The groups of channels removed together.
+    """
+    groups: list[ChannelGroup] = []
+    for name, module in model.named_modules():
+        if isinstance(module, BasicBlock):
+            groups.append((f"{name}.conv1", module.bn1, [module.conv1, module.bn1], [module.conv2]))
+        elif isinstance(module, Bottleneck):
+            groups.append((f"{name}.conv1", module.bn1, [module.conv1, module.bn1], [module.conv2]))
+            groups.append((f"{name}.conv2", module.bn2, [module.conv2, module.bn2], [module.conv3]))
+        elif isinstance(module, InvertedResidual):
+            # The expansion and the depthwise convolution over it, then the squeeze-and-excitation gates it
+            outputs, inputs = [module.conv_pw, module.bn1, module.conv_dw, module.bn2], [module.conv_pwl]
+            if hasattr(module.se, "conv_reduce"):
+                outputs.append(module.se.conv_expand)
+                inputs.append(module.se.conv_reduce)
+            groups.append((f"{name}.conv_pw", module.bn2, outputs, inputs))
+        elif isinstance(module, EdgeResidual):
+            outputs, inputs = [module.conv_exp, module.bn1], [module.conv_pwl]
+            if hasattr(module.se, "conv_reduce"):
+                outputs.append(module.se.conv_expand)
+                inputs.append(module.se.conv_reduce)
+            groups.append((f"{name}.conv_exp", module.bn1, outputs, inputs))
+        elif isinstance(module, DenseLayer):
+            groups.append((f"{name}.conv1", module.norm2, [module.conv1, module.norm2], [module.conv2]))
+    # Grouped convolutions (other than depthwise) tie the channels of their groups together
+    return [
+        group
+        for group in groups
+        if all(
+            not isinstance(conv, nn.Conv2d) or conv.groups == 1 or _is_depthwise(conv)
+            for conv in group[2] + group[3]
+        )
+    ]
+
+
+def get_importance(
+    model: nn.Module, groups: list[ChannelGroup], criterion: str, loader: Iterable, device: torch.device
+) -> list[Tensor]:
+    """
+    Ranks the channels of every group by importance.
+    "bn" is the magnitude of the batch norm scale: a channel scaled close to zero contributes little to the next
+    layer. "taylor" is the first order Taylor estimate of the change of the loss when the channel is removed, from the
+    gradients of the batch norm scale and shift: (weight * grad_weight + bias * grad_bias)^2 summed over the
+    calibration batches.
+
+    Args:
+        model (nn.Module): The model in evaluation mode.
+        groups (list[ChannelGroup]): The groups of channels.
+        criterion (str): "bn" or "taylor".
+        loader (Iterable): The calibration batches of images and labels, for "taylor".
+        device (torch.device): The device to compute the gradients on.
+
+    Returns:
+        list[Tensor]: The importance of every channel of every group.
+    """
+    if criterion == "bn":
+        return [bn.weight.detach().abs().cpu() for _, bn, _, _ in groups]
+    if criterion != "taylor":
+        raise ValueError("Invalid pruning criterion. Please choose either bn or taylor.")
+    importance = [torch.zeros(bn.num_features) for _, bn, _, _ in groups]
+    model.to(device)
+    # The running statistics and the dropout are those of evaluation, only the gradients are computed
+    for images, labels in tqdm(loader, desc="Ranking channels"):
+        model.zero_grad(set_to_none=True)
+        loss = nn.functional.binary_cross_entropy_with_logits(model(images.to(device)), labels.to(device))
+        loss.backward()
+        for i, (_, bn, _, _) in enumerate(groups):
+            importance[i] += (bn.weight * bn.weight.grad + bn.bias * bn.bias.grad).detach().pow(2).cpu()
+    model.zero_grad(set_to_none=True)
+    return importance
+
+
+def count_flops(model: nn.Module, image_size: int) -> tuple[int, dict[nn.Module, int]]:
+    """
+    Counts the multiply-accumulates of the convolutions and the linear layers for one image.
+
+    Args:
+        model (nn.Module): The model.
+        image_size (int): The image size.
+
+    Returns:
+        tuple[int, dict[nn.Module, int]]: The multiply-accumulates, and the number of output positions of every
+            convolution.
+    """
+    flops = 0
+    positions: dict[nn.Module, int] = {}
+
+    def count(module: nn.Module, inputs: Any, output: Tensor) -> None:
+        nonlocal flops
+        if isinstance(module, nn.Conv2d):
+            positions[module] = output.shape[-2] * output.shape[-1]
+            flops += positions[module] * module.weight.numel()
+        else:
+            flops += module.weight.numel()
+
+    handles = [
+        module.register_forward_hook(count)
+        for module in model.modules()
+        if isinstance(module, (nn.Conv2d, nn.Linear))
+    ]
+    was_training = model.training
+    try:
+        with torch.no_grad():
+            model.eval()(torch.zeros(1, 3, image_size, image_size, device=next(model.parameters()).device))
+    finally:
+        model.train(was_training)
+        for handle in handles:
+            handle.remove()
+    return flops, positions
+
+
+def select_channels(
+    groups: list[ChannelGroup],
+    importance: list[Tensor],
+    positions: dict[nn.Module, int],
+    flops: int,
+    target_flops: float,
+    min_keep: float,
+) -> list[Tensor]:
+    """
+    Removes the least important channels across all the groups until the model fits the FLOP budget. The importance
+    is divided by the mean of its group, so the groups are compared by how their channels rank within the group and
+    not by the scale of their layer. The multiply-accumulates saved by every channel are updated as the channels of
+    the neighboring groups are removed, so the budget is met exactly, unless every group is down to min_keep first.
+
+    Args:
+        groups (list[ChannelGroup]): The groups of channels.
+        importance (list[Tensor]): The importance of every channel of every group.
+        positions (dict[nn.Module, int]): The number of output positions of every convolution, from count_flops.
+        flops (int): The multiply-accumulates of the model.
+        target_flops (float): The multiply-accumulates to reach.
+        min_keep (float): The fraction of the channels of every group that is always kept.
+
+    Returns:
+        list[Tensor]: The sorted indices of the channels kept in every group.
+    """
+    channels = {
+        conv: [conv.in_channels, conv.out_channels]
+        for _, _, outputs, inputs in groups
+        for conv in outputs + inputs
+        if isinstance(conv, nn.Conv2d)
+    }
+    scores = torch.cat([values / values.mean().clamp_min(1e-12) for values in importance])
+    group_of = torch.cat([torch.full((len(values),), i) for i, values in enumerate(importance)])
+    channel_of = torch.cat([torch.arange(len(values)) for values in importance])
+    kept = [torch.ones(len(values), dtype=torch.bool) for values in importance]
+    remaining = [len(values) for values in importance]
+    for index in scores.argsort().tolist():
+        if flops <= target_flops:
+            break
+        g = group_of[index].item()
+        if remaining[g] - 1 < max(math.ceil(min_keep * len(kept[g])), 1):
+            continue
+        kept[g][channel_of[index]] = False
+        remaining[g] -= 1
+        _, _, outputs, inputs = groups[g]
+        for conv in outputs:
+            if isinstance(conv, nn.Conv2d):
+                kernel = conv.kernel_size[0] * conv.kernel_size[1]
+                # A depthwise convolution loses its input channel with its output channel
+                flops -= positions[conv] * kernel * (1 if _is_depthwise(conv) else channels[conv][0])
+                channels[conv][1] -= 1
+                if _is_depthwise(conv):
+                    channels[conv][0] -= 1
+        for conv in inputs:
+            flops -= positions[conv] * conv.kernel_size[0] * conv.kernel_size[1] * channels[conv][1]
+            channels[conv][0] -= 1
+    return [mask.nonzero().flatten() for mask in kept]
+
+
+def prune_channels(groups: list[ChannelGroup], keep: list[Tensor]) -> None:
+    """
+    Removes the channels of every group from the weights of its layers, in place.
+
+    Args:
+        groups (list[ChannelGroup]): The groups of channels.
+        keep (list[Tensor]): The indices of the channels kept in every group.
+    """
+    for (_, _, outputs, inputs), indices in zip(groups, keep):
+        for module in outputs:
+            module.weight = nn.Parameter(module.weight.data[indices].clone())
+            if module.bias is not None:
+                module.bias = nn.Parameter(module.bias.data[indices].clone())
+            if isinstance(module, nn.BatchNorm2d):
+                module.running_mean = module.running_mean[indices].clone()
+                module.running_var = module.running_var[indices].clone()
+                module.num_features = len(indices)
+            else:
+                if _is_depthwise(module):
+                    module.in_channels = module.groups = len(indices)
+                module.out_channels = len(indices)
+        for conv in inputs:
+            conv.weight = nn.Parameter(conv.weight.data[:, indices].clone())
+            conv.in_channels = len(indices)
+
+
+def finetune(model: nn.Module, loader: DataLoader, steps: int, args: Namespace, device: torch.device) -> None:
+    """
+    Trains the pruned model for a few steps, so the next layers adapt to the removed channels.
+
+    Args:
+        model (nn.Module): The pruned model.
+        loader (DataLoader): The training loader, cycled if shorter than the steps.
+        steps (int): The number of optimizer steps.
+        args (Namespace): The command-line arguments containing the optimizer parameters.
+        device (torch.device): The device to train on.
+    """
+    model.to(device).train()
+    optimizer = timm.optim.create_optimizer_v2(
+        model_or_params=model,
+        opt=args.optimizer,
+        lr=args.finetune_lr,
+        weight_decay=args.weight_decay,
+        momentum=args.momentum,
+    )
+    # Same precision as the training, bf16-mixed
+    autocast = torch.autocast("cuda", dtype=torch.bfloat16) if device.type == "cuda" else nullcontext()
+    batches = itertools.islice(itertools.chain.from_iterable(itertools.repeat(loader)), steps)
+    for images, labels in tqdm(batches, total=steps, desc="Fine-tuning"):
+        with autocast:
+            logits = model(images.to(device, non_blocking=True))
+        loss = nn.functional.binary_cross_entropy_with_logits(logits.float(), labels.to(device, non_blocking=True))
+        optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        optimizer.step()
+    model.eval()
+
+
+def _is_depthwise(conv: nn.Module) -> bool:
+    return isinstance(conv, nn.Conv2d) and conv.groups > 1 and conv.groups == conv.in_channels == conv.out_channels
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Prune the channels of a trained checkpoint to several FLOP budgets, fine-tune every pruned model briefly, and report the ROC AUC and the CPU latency of every budget. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="The .ckpt or .pth file saved by train.py. Defaults to <root_dir>/<model_name>.pth.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="The directory to write the pruned TorchScript models and report.json to. Defaults to <root_dir>/prune/<model_name>.",
+    )
+    parser.add_argument(
+        "--sparsities",
+        type=float,
+        nargs="+",
+        default=[0.25, 0.5, 0.75],
+        help="The fractions of the multiply-accumulates to remove, one pruned model per fraction.",
+    )
+    parser.add_argument(
+        "--criterion",
+        type=str,
+        default="taylor",
+        help="How the channels are ranked: bn (the batch norm scales) or taylor (the first order Taylor estimate of the loss change, on calibration batches).",
+    )
+    parser.add_argument(
+        "--calibration_batches",
+        type=int,
+        default=32,
+        help="The number of training batches the taylor criterion is computed on.",
+    )
+    parser.add_argument(
+        "--min_keep",
+        type=float,
+        default=0.1,
+        help="The fraction of the channels of every block that is always kept.",
+    )
+    parser.add_argument(
+        "--finetune_steps",
+        type=int,
+        default=500,
+        help="The number of optimizer steps every pruned model is fine-tuned for.",
+    )
+    parser.add_argument(
+        "--finetune_lr",
+        type=float,
+        default=1e-4,
+        help="The learning rate of the fine-tuning.",
+    )
+    parser.add_argument(
+        "--eval_batches",
+        type=int,
+        default=None,
+        help="The number of test batches the ROC AUC is computed on. Defaults to the whole test split.",
+    )
+    parser.add_argument(
+        "--target_latency_ms",
+        type=float,
+        default=None,
+        help="The latency budget of a single image, the most accurate model within it is selected.",
+    )
+    parser.add_argument(
+        "--latency_runs",
+        type=int,
+        default=20,
+        help="The number of single images timed per model.",
+    )
+    parser.add_argument(
+        "--throughput_batches",
+        type=int,
+        default=5,
+        help="The number of batches timed per model.",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="The number of CPU threads, as on the serving machines. Defaults to the PyTorch default.",
+    )
+    args: Namespace = parse_arguments(parser)
+    if args.stats_file:
+        args.mean, args.std = load_stats(args.stats_file)
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    checkpoint = Path(args.checkpoint or Path(args.root_dir) / f"{args.model_name}.pth")
+    output_dir = Path(args.output_dir or Path(args.root_dir) / "prune" / args.model_name)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    classifier = load_classifier(checkpoint, args)
+    model = classifier.model
+    # load_data only builds the DistributedSampler of the test loader (which needs DDP) for a single device
+    loader_args = copy.copy(args)
+    loader_args.devices = max(args.devices, 2)
+    # Without batch augmentation, the images are normalized by the workers as the model is called directly
+    loader_args.batch_augment = False
+    # Same seed as train.py, for the shuffling of the fine-tuning batches. load_data seeds the split itself
+    seed_everything(42)
+    train_loader, _, _ = load_data(_args=loader_args, _transforms=get_transforms(loader_args))
+    calibration_loader, _, test_loader = load_data(_args=loader_args, _transforms=get_transforms(args, train=False))
+
+    groups = get_channel_groups(model)
+    if not groups:
+        raise ValueError(f"{args.model_name} has no channels inside its blocks that can be pruned.")
+    importance = get_importance(
+        model, groups, args.criterion, itertools.islice(calibration_loader, args.calibration_batches), device
+    )
+    model.cpu()
+    flops = count_flops(model, args.image_size)[0]
+
+    # Every budget is pruned from the trained model, the predictions of all of them are computed on the same batches
+    models: dict[str, nn.Module] = {"dense": model}
+    for sparsity in args.sparsities:
+        pruned = copy.deepcopy(model)
+        pruned_groups = get_channel_groups(pruned)
+        pruned_positions = count_flops(pruned, args.image_size)[1]
+        keep = select_channels(
+            pruned_groups, importance, pruned_positions, flops, (1 - sparsity) * flops, args.min_keep
+        )
+        prune_channels(pruned_groups, keep)
+        models[f"{sparsity}_pruned"] = copy.deepcopy(pruned)
+        if args.finetune_steps:
+            finetune(pruned, train_loader, args.finetune_steps, args, device)
+            models[str(sparsity)] = pruned.cpu()
+    for pruned in models.values():
+        pruned.to(device).eval()
+    eval_loader = itertools.islice(test_loader, args.eval_batches) if args.eval_batches else test_loader
+    predictors: dict[str, Callable[[Tensor], Tensor]] = {
+        name: lambda images, pruned=pruned: pruned(images.to(device)).float().cpu() for name, pruned in models.items()
+    }
+    aurocs, _ = evaluate(predictors, eval_loader, args.num_classes, args.test_auc_bins)
+
+    def mean_auroc(values: Tensor) -> float:
+        # Classes without positive or negative test samples have no ROC AUC
+        return values[~torch.isnan(values)].mean().item()
+
+    results: list[dict[str, Any]] = []
+    example = torch.zeros(1, 3, args.image_size, args.image_size)
+    for sparsity in [0.0, *args.sparsities]:
+        name = "dense" if sparsity == 0.0 else str(sparsity) if args.finetune_steps else f"{sparsity}_pruned"
+        pruned = models[name].cpu()
+        file = None
+        if sparsity:
+            file = output_dir / f"pruned_{round(100 * sparsity)}.pt"
+            to_torchscript(pruned, example, file)
+        pruned_flops = count_flops(pruned, args.image_size)[0]
+        results.append(
+            {
+                "sparsity": sparsity,
+                "file": str(file) if file else None,
+                "flops": pruned_flops,
+                "flop_ratio": pruned_flops / flops,
+                "parameters": sum(parameter.numel() for parameter in pruned.parameters()),
+                **measure_latency(
+                    pruned, args.image_size, args.batch_size, args.latency_runs, args.throughput_batches
+                ),
+                "mean_auroc_before_finetune": mean_auroc(aurocs[f"{sparsity}_pruned"]) if sparsity else None,
+                "mean_auroc": mean_auroc(aurocs[name]),
+                "auroc": {
+                    class_name: None if math.isnan(value) else value
+                    for class_name, value in zip(classifier.class_names, aurocs[name].tolist())
+                },
+            }
+        )
+        print(
+            f"sparsity {sparsity:4.2f}: {pruned_flops / 1e9:6.2f} GMACs ({pruned_flops / flops:.2f}x), "
+            f"p50 {results[-1]['latency_ms_p50']:8.1f} ms, {results[-1]['images_per_sec']:7.1f} images/sec, "
+            f"mean ROC AUC {results[-1]['mean_auroc']:.4f}"
+        )
+
+    # The most accurate pruned model within the latency budget
+    selected = None
+    if args.target_latency_ms is not None:
+        candidates = [result for result in results[1:] if result["latency_ms_p50"] <= args.target_latency_ms]
+        selected = max(candidates, key=lambda result: result["mean_auroc"])["file"] if candidates else None
+        print(f"Selected: {selected}" if selected else f"No pruned model is within {args.target_latency_ms} ms.")
+    with open(output_dir / "report.json", "w") as f:
+        json.dump(
+            {
+                "checkpoint": str(checkpoint),
+                "model_name": args.model_name,
+                "image_size": args.image_size,
+                "criterion": args.criterion,
+                "finetune_steps": args.finetune_steps,
+                "num_threads": torch.get_num_threads(),
+                "prunable_groups": len(groups),
+                "selected": selected,
+                "results": results,
+            },
+            f,
+            indent=4,
+        )
+    print(f"Report saved to: {output_dir / 'report.json'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+from argparse import ArgumentParser, BooleanOptionalAction, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Sequence
+import numpy as np
+import torch
+from aiohttp import web
+from PIL import Image
+from torch import Tensor
+from backend.classes.Classifier import Classifier
+from backend.classes.GradCAM import GradCAM
+from backend.classes.MicroBatcher import MicroBatcher
+from backend.classes.PredictionCache import PredictionCache
+from backend.utility.find_mean_std import load_stats
+from backend.utility.get_model import create_model, load_classifier
+from backend.utility.get_transforms import get_transforms
+from backend.utility.open_image import open_image
+from backend.utility.parse_args import parse_arguments
+
+# Full resolution radiographs are larger than the default limit of aiohttp
+MAX_UPLOAD_BYTES = 32 * 2**20
+
+
+def load_predictor(
+    checkpoint_file: str | Path, args: Namespace, heatmaps: bool = False
+) -> tuple[Callable[[Tensor], Sequence[Any]], list[str], GradCAM | None]:
+    """
+    Loads the model to serve, either a checkpoint saved by train.py or a TorchScript artifact written by
+    utility/export_model.py.
+
+    Args:
+        checkpoint_file (str | Path): The .ckpt or .pth checkpoint, or the .pt TorchScript artifact.
+        args (Namespace): The command-line arguments containing the model parameters it was trained with.
+        heatmaps (bool): Whether to also compute the Grad-CAM heatmap of the most probable class of every image,
+            in the same forward pass. Needs a checkpoint, TorchScript artifacts have no classifier head to take
+            the gradient of. The test-time augmentation of --tta is applied to the predictions of checkpoints
+            without heatmaps.
+
+    Returns:
+        tuple[Callable[[Tensor], Sequence[Any]], list[str], GradCAM | None]: The function returning the
+            probabilities of a batch of normalized images (and their heatmaps), the class names of the
+            probabilities, and the Grad-CAM of the model when computing heatmaps.
+    """
+    if args.tta and heatmaps:
+        raise ValueError("The heatmaps are computed on the images themselves, serve either --tta or --heatmaps.")
+    if str(checkpoint_file).endswith(".pt"):
+        if heatmaps or args.tta:
+            raise ValueError("Heatmaps and --tta need a .ckpt or .pth checkpoint, not a TorchScript artifact.")
+        model = torch.jit.load(checkpoint_file, map_location="cpu")
+        # The class names without the weights, on the meta device
+        class_names = Classifier(create_model(args, device="meta"), args).class_names
+    else:
+        model = load_classifier(checkpoint_file, args)
+        class_names = model.class_names
+    if args.tta:
+        return lambda images: torch.sigmoid(model.forward_tta(images).float()), class_names, None
+    if not heatmaps:
+        return lambda images: torch.sigmoid(model(images).float()), class_names, None
+
+    cam = GradCAM(model.model).eval()
+
+    def predict(images: Tensor) -> list[tuple[Tensor, Tensor]]:
+        logits, cams = cam(images)
+        probabilities = torch.sigmoid(logits.float())
+        top = probabilities.argmax(dim=1)
+        return list(zip(probabilities, cams[torch.arange(len(top)), top]))
+
+    return predict, class_names, cam
+
+
+def create_app(
+    predict: Callable[[Tensor], Sequence[Any]],
+    class_names: list[str],
+    args: Namespace,
+    cam: GradCAM | None = None,
+    cache: PredictionCache | None = None,
+) -> web.Application:
+    """
+    Creates the inference server. POST /predict takes a single image, either as the "file" field of a multipart
+    form or as the raw request body, and returns the probability of every class. With a Grad-CAM, it also returns
+    the heatmap of the most probable class over the image, as a base64 JPEG. With a cache, the images already
+    seen are answered without running the model. GET /health returns the batching and the cache counters.
+
+    Args:
+        predict (Callable[[Tensor], Sequence[Any]]): The function returning the probabilities of a batch of images,
+            or their probabilities and heatmaps with a Grad-CAM.
+        class_names (list[str]): The class names of the probabilities.
+        args (Namespace): The command-line arguments containing the preprocessing and batching parameters.
+        cam (GradCAM | None): The Grad-CAM the heatmaps were computed with, to draw them.
+        cache (PredictionCache | None): The cache of the predictions and the drawn heatmaps.
+
+    Returns:
+        web.Application: The aiohttp application.
+    """
+    transform = get_transforms(args, train=False)
+    batcher = MicroBatcher(predict, args.max_batch_size, args.max_wait_ms)
+    # Decoding runs next to the model, PIL releases the GIL while decoding
+    decoder = ThreadPoolExecutor(max_workers=args.decode_threads, thread_name_prefix="decode")
+    # Requests being decoded or waiting for the model, bounded so an overload is rejected instead of timing out
+    pending = 0
+
+    def decode(data: bytes) -> tuple[Tensor, str | None]:
+        image = transform(open_image(io.BytesIO(data), args.image_size if args.fast_decode else None))
+        return image, PredictionCache.key(image) if cache is not None else None
+
+    def draw(image: Tensor, heatmap: Tensor) -> bytes:
+        # Undo the normalization of the first channel, the images are grayscale
+        gray = ((image[0] * args.std[0] + args.mean[0]) * 255).round().clamp(0, 255).to(torch.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(cam.overlay(gray[None], heatmap[None])[0].numpy()).save(buffer, format="JPEG", quality=85)
+        return buffer.getvalue()
+
+    async def predict_route(request: web.Request) -> web.Response:
+        nonlocal pending
+        if pending >= args.max_queue:
+            return web.json_response({"error": "The server is overloaded"}, status=503)
+        pending += 1
+        try:
+            return await handle(request)
+        finally:
+            pending -= 1
+
+    async def handle(request: web.Request) -> web.Response:
+        if request.content_type.startswith("multipart/"):
+            field = (await request.post()).get("file")
+            data = field.file.read() if isinstance(field, web.FileField) else b""
+        else:
+            data = await request.read()
+        if not data:
+            return web.json_response({"error": "No image uploaded"}, status=400)
+        loop = asyncio.get_running_loop()
+        try:
+            image, key = await loop.run_in_executor(decoder, decode, data)
+        except OSError:
+            # Not an image, or a truncated one
+            return web.json_response({"error": "The upload is not a readable image"}, status=400)
+        entry = await cache.get(key, heatmap=cam is not None) if cache is not None else None
+        cached = entry is not None
+        if entry is None:
+            output = await batcher.submit(image)
+            if cam is None:
+                entry = (output.numpy().tobytes(), None)
+            else:
+                entry = (output[0].numpy().tobytes(), await loop.run_in_executor(decoder, draw, image, output[1]))
+            if cache is not None:
+                cache.put(key, *entry)
+        probabilities = np.frombuffer(entry[0], dtype=np.float32)
+        response = {"predictions": dict(zip(class_names, probabilities.tolist())), "cached": cached}
+        if cam is not None:
+            response["heatmap_class"] = class_names[probabilities.argmax()]
+            response["heatmap"] = base64.b64encode(entry[1]).decode()
+        return web.json_response(response)
+
+    async def health_route(request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "status": "ok",
+                "model_name": args.model_name,
+                "pending": pending,
+                **batcher.stats(),
+                "cache": cache.stats() if cache is not None else None,
+            }
+        )
+
+    async def on_startup(app: web.Application) -> None:
+        await batcher.start()
+
+    async def on_cleanup(app: web.Application) -> None:
+        await batcher.stop()
+        decoder.shutdown(wait=False)
+        if cache is not None:
+            cache.close()
+
+    app = web.Application(client_max_size=MAX_UPLOAD_BYTES)
+    app.router.add_post("/predict", predict_route)
+    app.router.add_get("/health", health_route)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Serve a trained model over HTTP, batching the concurrent requests. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="The .ckpt or .pth file saved by train.py, or a .pt TorchScript artifact of utility/export_model.py. Defaults to <root_dir>/<model_name>.pth.",
+    )
+    parser.add_argument(
+        "--heatmaps",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Whether to return the Grad-CAM heatmap of the most probable class with the predictions.",
+    )
+    parser.add_argument(
+        "--cache",
+        action=BooleanOptionalAction,
+        default=True,
+        help="Whether to cache the predictions by the content of the images, --no-cache turns it off.",
+    )
+    parser.add_argument(
+        "--cache_file",
+        type=str,
+        default=None,
+        help="The SQLite file of the persistent tier of the prediction cache. Defaults to <root_dir>/cache/predictions.sqlite.",
+    )
+    parser.add_argument(
+        "--cache_memory_mb",
+        type=float,
+        default=256,
+        help="The size in MiB of the memory tier of the prediction cache.",
+    )
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="The address to listen on.")
+    parser.add_argument("--port", type=int, default=8000, help="The port to listen on.")
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=16,
+        help="The largest batch of requests run through the model at once.",
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=10,
+        help="The longest time a request waits for others to share its batch.",
+    )
+    parser.add_argument(
+        "--max_queue",
+        type=int,
+        default=256,
+        help="The number of requests being decoded or waiting for the model above which new ones are rejected with 503.",
+    )
+    parser.add_argument(
+        "--decode_threads",
+        type=int,
+        default=4,
+        help="The number of threads decoding and preprocessing the uploads.",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="The number of CPU threads of the model. Defaults to the PyTorch default.",
+    )
+    args: Namespace = parse_arguments(parser)
+    if args.stats_file:
+        args.mean, args.std = load_stats(args.stats_file)
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+
+    checkpoint = Path(args.checkpoint or Path(args.root_dir) / f"{args.model_name}.pth")
+    predict, class_names, cam = load_predictor(checkpoint, args, args.heatmaps)
+    cache = None
+    if args.cache:
+        # The entries of any other checkpoint are invalidated
+        with open(checkpoint, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256")
+        if args.tta:
+            # The same pixels have other predictions with test-time augmentation, and with other views
+            digest.update(
+                json.dumps(
+                    [args.tta, args.tta_flip, args.tta_shifts, args.tta_scales, args.tta_aggregation]
+                ).encode()
+            )
+        model_id = digest.hexdigest()
+        cache = PredictionCache(
+            model_id, args.cache_file or Path(args.root_dir) / "cache" / "predictions.sqlite", args.cache_memory_mb
+        )
+    # The first calls of a TorchScript model optimize its graph, run them before accepting requests
+    with torch.inference_mode():
+        for batch_size in (1, args.max_batch_size, 1):
+            predict(torch.zeros(batch_size, 3, args.image_size, args.image_size))
+    web.run_app(create_app(predict, class_names, args, cam, cache), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
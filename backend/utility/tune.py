@@ -0,0 +1,241 @@
+import itertools
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from copy import copy
+from typing import Any
+import psutil
+import torch
+from torch import nn
+from backend.utility.get_model import get_model
+from backend.utility.get_transforms import get_transforms
+from backend.utility.host_profile import profile_file, save_profile
+from backend.utility.load_data import load_data
+from backend.utility.parse_args import parse_arguments
+
+
+def _train_steps(args: Namespace, device: str, steps: int) -> dict[str, Any]:
+    """
+    Runs training steps of the model on random data with the batch size of the arguments and measures their memory.
+    Runs in a fresh process for every batch size, so an out of memory or a fragmented allocator does not affect the
+    next probe, and the peak resident memory on the CPU only covers this batch size.
+
+    Args:
+        args (Namespace): The arguments of get_model, including batch_size and image_size.
+        device (str): The device to train on.
+        steps (int): The number of steps, the first one is not timed.
+
+    Returns:
+        dict[str, Any]: Whether it ran out of memory, the step time in seconds, the peak memory and the memory
+            capacity of the device in bytes.
+    """
+    cuda = device.startswith("cuda")
+    classifier = get_model(args).to(device).train()
+    optimizer = torch.optim.SGD(classifier.parameters(), lr=args.lr, momentum=args.momentum)
+    images = torch.randn(args.batch_size, 3, args.image_size, args.image_size, device=device)
+    labels = (torch.rand(args.batch_size, args.num_classes, device=device) > 0.5).float()
+    start = 0.0
+    try:
+        for step in range(steps):
+            if step == 1:
+                start = time.perf_counter()
+            optimizer.zero_grad(set_to_none=True)
+            # Same precision as the Trainer of train.py
+            with torch.autocast(device_type="cuda", dtype=torch.bfloat16, enabled=cuda):
+                logits = classifier(images)
+            nn.functional.binary_cross_entropy_with_logits(logits.float(), labels).backward()
+            optimizer.step()
+            if cuda:
+                torch.cuda.synchronize()
+    except torch.OutOfMemoryError:
+        return {"oom": True}
+    step_time = (time.perf_counter() - start) / max(steps - 1, 1)
+    if cuda:
+        return {
+            "oom": False,
+            "step_s": step_time,
+            "peak": torch.cuda.max_memory_reserved(),
+            "capacity": torch.cuda.get_device_properties(device).total_memory,
+        }
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {"oom": False, "step_s": step_time, "peak": peak, "capacity": psutil.virtual_memory().total}
+
+
+def probe_batch_size(
+    args: Namespace, device: str, max_batch_size: int, memory_margin: float, multiple: int = 8
+) -> tuple[int, float, list[dict[str, Any]]]:
+    """
+    Finds the largest batch size that trains without running out of memory and leaves a margin of the device
+    memory free. The batch size is doubled until it no longer fits, then bisected.
+
+    Args:
+        args (Namespace): The arguments of get_model.
+        device (str): The device to train on.
+        max_batch_size (int): The largest batch size to try.
+        memory_margin (float): The fraction of the device memory to leave free.
+        multiple (int): The batch size is a multiple of this, unless even this does not fit.
+
+    Returns:
+        tuple[int, float, list[dict[str, Any]]]: The batch size, the step time at that batch size in seconds and
+            all the probes.
+    """
+    probes: dict[int, dict[str, Any]] = {}
+
+    def fits(batch_size: int) -> bool:
+        probe_args = copy(args)
+        probe_args.batch_size = batch_size
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                result = pool.submit(_train_steps, probe_args, device, 3).result()
+        except BrokenProcessPool:
+            # Killed by the kernel out of memory killer
+            result = {"oom": True}
+        result["fits"] = not result["oom"] and result["peak"] <= (1 - memory_margin) * result["capacity"]
+        probes[batch_size] = result
+        print(f"batch size {batch_size:5d}: {'fits' if result['fits'] else 'does not fit'}")
+        return result["fits"]
+
+    good, bad = 0, None
+    batch_size = multiple
+    # Grow exponentially until the first batch size that does not fit
+    while batch_size <= max_batch_size:
+        if not fits(batch_size):
+            bad = batch_size
+            break
+        good, batch_size = batch_size, batch_size * 2
+    if good == 0:
+        # Not even the smallest multiple fits, look below it
+        good = next((size for size in range(multiple - 1, 0, -1) if fits(size)), 0)
+        if good == 0:
+            raise RuntimeError(f"{args.model_name} does not fit with a batch size of 1 at {args.image_size}x{args.image_size}.")
+    elif bad is not None:
+        # Bisect between the last batch size that fits and the first one that does not
+        while bad - good > multiple:
+            middle = (good + bad) // 2 // multiple * multiple
+            if fits(middle):
+                good = middle
+            else:
+                bad = middle
+    return good, probes[good]["step_s"], [{"batch_size": size, **probe} for size, probe in sorted(probes.items())]
+
+
+def probe_workers(args: Namespace, worker_counts: list[int], num_batches: int) -> list[dict[str, float]]:
+    """
+    Measures the throughput of the training DataLoader of load_data for every number of workers.
+
+    Args:
+        args (Namespace): The arguments of load_data, including batch_size.
+        worker_counts (list[int]): The numbers of workers to measure.
+        num_batches (int): The number of batches timed, after the first one.
+
+    Returns:
+        list[dict[str, float]]: The number of workers and the images per second of every measurement.
+    """
+    results = []
+    for num_workers in worker_counts:
+        loader_args = copy(args)
+        loader_args.num_workers = num_workers
+        # load_data only builds the DistributedSampler of the test loader (which needs DDP) for a single device
+        loader_args.devices = max(args.devices, 2)
+        train_loader = load_data(_args=loader_args, _transforms=get_transforms(loader_args))[0]
+        batches = iter(train_loader)
+        # The first batch includes the start of the workers
+        next(batches)
+        start = time.perf_counter()
+        images = sum(len(labels) for _, labels in itertools.islice(batches, num_batches))
+        if images == 0:
+            raise ValueError(f"The training set has fewer than 2 batches of {args.batch_size}, use a smaller --max_batch_size.")
+        images_per_sec = images / (time.perf_counter() - start)
+        results.append({"num_workers": num_workers, "images_per_sec": images_per_sec})
+        print(f"{num_workers:3d} workers: {images_per_sec:9.1f} images/sec")
+        del batches, train_loader
+    return results
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Find the largest batch size that fits for --model_name at --image_size and the number of DataLoader workers that keeps the model fed, and save them to the profile of this host. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda" if torch.cuda.is_available() else "cpu",
+        help="The device to probe the batch size on.",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=1024,
+        help="The largest batch size to try.",
+    )
+    parser.add_argument(
+        "--memory_margin",
+        type=float,
+        default=0.1,
+        help="The fraction of the device memory to leave free.",
+    )
+    parser.add_argument(
+        "--worker_counts",
+        type=int,
+        nargs="+",
+        default=None,
+        help="The numbers of DataLoader workers to measure. Defaults to 0 and the powers of 2 up to the number of CPUs per device.",
+    )
+    parser.add_argument(
+        "--num_batches",
+        type=int,
+        default=20,
+        help="The number of batches timed per number of workers.",
+    )
+    parser.add_argument(
+        "--headroom",
+        type=float,
+        default=1.2,
+        help="How much faster than the model the input pipeline must be.",
+    )
+    args: Namespace = parse_arguments(parser)
+
+    batch_size, step_time, batch_probes = probe_batch_size(
+        args, args.device, args.max_batch_size, args.memory_margin
+    )
+    # Every DDP rank feeds its device from its own DataLoader, so one loader only has to keep up with one device
+    model_images_per_sec = batch_size / step_time
+    print(f"Batch size {batch_size}: the model trains {model_images_per_sec:.1f} images/sec per device")
+
+    args.batch_size = batch_size
+    # The DataLoaders of all the ranks share the CPUs
+    devices = args.devices if args.device.startswith("cuda") else 1
+    cpus = max((os.cpu_count() or 1) // devices, 1)
+    worker_counts = args.worker_counts or [0] + [2**i for i in range(cpus.bit_length()) if 2**i <= cpus]
+    worker_probes = probe_workers(args, worker_counts, args.num_batches)
+    # The fewest workers that keep up with the model, or the fastest setting when none does
+    target = args.headroom * model_images_per_sec
+    fed = [probe for probe in worker_probes if probe["images_per_sec"] >= target]
+    num_workers = (fed[0] if fed else max(worker_probes, key=lambda probe: probe["images_per_sec"]))["num_workers"]
+    if not fed:
+        print(f"No number of workers keeps up with the model ({target:.1f} images/sec needed), the input pipeline is the bottleneck.")
+
+    file = args.profile or profile_file(args.root_dir)
+    save_profile(
+        file,
+        args,
+        {
+            "batch_size": batch_size,
+            "num_workers": num_workers,
+            "device": args.device,
+            "model_images_per_sec": model_images_per_sec,
+            "batch_probes": batch_probes,
+            "worker_probes": worker_probes,
+        },
+    )
+    print(f"Batch size {batch_size} and {num_workers} workers saved to: {file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+import timm
+from safetensors.torch import load_file, save_file
+from backend.utility.parse_args import parse_arguments
+
+
+def _sha256(file: Path) -> str:
+    """
+    Hash a file in chunks.
+
+    Args:
+        file (Path): The file to hash.
+
+    Returns:
+        str: The hex sha256 of the file.
+    """
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_index(weights_dir: Path) -> dict[str, dict[str, str | int]]:
+    """
+    Read the index mapping the model names to their weight files.
+
+    Args:
+        weights_dir (Path): The directory of the weight cache.
+
+    Returns:
+        dict[str, dict[str, str | int]]: The file name and size of the weights of every cached model.
+    """
+    index_file = weights_dir / "index.json"
+    if not index_file.exists():
+        return {}
+    with open(index_file, "r") as f:
+        return json.load(f)
+
+
+def add_weights(weights_dir: Path, model_name: str, source_file: Path) -> Path:
+    """
+    Add a weight file to the cache. The file is stored under its sha256, so a model name always points to exactly the
+    weights it was added with, and identical weights are only stored once.
+
+    Args:
+        weights_dir (Path): The directory of the weight cache.
+        model_name (str): The timm model name the weights belong to.
+        source_file (Path): The safetensors file of the weights, moved into the cache.
+
+    Returns:
+        Path: The cached weight file.
+    """
+    weights_dir.mkdir(parents=True, exist_ok=True)
+    cached_file = weights_dir / f"{_sha256(source_file)}.safetensors"
+    shutil.move(source_file, cached_file)
+    index = _read_index(weights_dir)
+    index[model_name] = {"file": cached_file.name, "size": cached_file.stat().st_size}
+    # Write atomically so a concurrent reader never sees a partial index
+    tmp_file = weights_dir / f"index.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(index, f, indent=4)
+    tmp_file.replace(weights_dir / "index.json")
+    return cached_file
+
+
+def get_pretrained_file(model_name: str, weights_dir: Path, offline: bool = False) -> Path:
+    """
+    Get the local file of the pretrained weights of a timm model, downloading them into the cache the first time.
+
+    Args:
+        model_name (str): The timm model name.
+        weights_dir (Path): The directory of the weight cache.
+        offline (bool): Whether to only read the cache and never download.
+
+    Returns:
+        Path: The cached safetensors file, to pass to timm as pretrained_cfg_overlay=dict(file=...).
+    """
+    entry = _read_index(weights_dir).get(model_name)
+    if entry is not None:
+        cached_file = weights_dir / entry["file"]
+        if cached_file.exists() and cached_file.stat().st_size == entry["size"]:
+            return cached_file
+    if offline:
+        raise FileNotFoundError(
+            f"No pretrained weights of {model_name} in {weights_dir}. "
+            f"Run python -m backend.utility.weight_cache --model_name {model_name} on a machine with network access first."
+        )
+    # Download through timm once and keep the state_dict of the full model
+    weights_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = weights_dir / f"{model_name}.{os.getpid()}.tmp"
+    state_dict = timm.create_model(model_name, pretrained=True).state_dict()
+    save_file({key: value.contiguous() for key, value in state_dict.items()}, tmp_file)
+    return add_weights(weights_dir, model_name, tmp_file)
+
+
+def verify_weights(weights_dir: Path) -> list[str]:
+    """
+    Check that every cached file still hashes to its name.
+
+    Args:
+        weights_dir (Path): The directory of the weight cache.
+
+    Returns:
+        list[str]: The model names whose weights are missing or corrupted.
+    """
+    return [
+        model_name
+        for model_name, entry in _read_index(weights_dir).items()
+        if not (weights_dir / entry["file"]).exists()
+        or _sha256(weights_dir / entry["file"]) != Path(entry["file"]).stem
+    ]
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Download the pretrained weights of --model_name into the local weight cache, or import a weight file for machines without network access. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--import_file",
+        type=str,
+        default=None,
+        help="A safetensors file (or a checkpoint loadable by timm) to add to the cache as the weights of --model_name.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the hashes of all the cached weights.",
+    )
+    args: Namespace = parse_arguments(parser)
+    weights_dir = Path(args.weights_dir or Path(args.root_dir) / "weights")
+    if args.verify:
+        corrupted = verify_weights(weights_dir)
+        print(f"Missing or corrupted weights: {corrupted}" if corrupted else "All the cached weights are valid.")
+        return
+    if args.import_file:
+        tmp_file = weights_dir / f"{args.model_name}.{os.getpid()}.tmp"
+        weights_dir.mkdir(parents=True, exist_ok=True)
+        if args.import_file.endswith(".safetensors"):
+            # Validate it is readable before adding it
+            load_file(args.import_file)
+            shutil.copyfile(args.import_file, tmp_file)
+        else:
+            state_dict = timm.models.load_state_dict(args.import_file)
+            save_file({key: value.contiguous() for key, value in state_dict.items()}, tmp_file)
+        cached_file = add_weights(weights_dir, args.model_name, tmp_file)
+    else:
+        cached_file = get_pretrained_file(args.model_name, weights_dir)
+    print(f"Weights of {args.model_name} cached at: {cached_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import io
+import json
+import tarfile
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Sequence
+import numpy as np
+from tqdm import tqdm
+from backend.classes.CheXpert_Dataset import CheXpert
+from backend.utility.load_data import split_dataset
+from backend.utility.parse_args import parse_arguments
+
+
+def _read_bytes(path: str) -> bytes:
+    """
+    Read a whole file.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        bytes: The content of the file.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    """
+    Add an in-memory file to a tar archive.
+
+    Args:
+        tar (tarfile.TarFile): The archive opened for writing.
+        name (str): The name of the member.
+        data (bytes): The content of the member.
+    """
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shards(
+    dataset: CheXpert,
+    output_dir: Path,
+    shard_size: int,
+    num_workers: int,
+    splits: dict[str, Sequence[int]],
+    seed: int = 42,
+) -> Path:
+    """
+    Pack the images and labels of the dataset into tar shards that can be read sequentially, with separate shards for
+    every split. The samples of every split are written in a random order, so every shard is a random subset of its
+    split. Every sample is stored as two members with the same key: <key>.jpg with the original JPEG bytes and
+    <key>.cls with the 14 labels as uint8 bytes.
+
+    Args:
+        dataset (CheXpert): The dataset to pack.
+        output_dir (Path): The directory to write the shards and their index to.
+        shard_size (int): The number of samples per shard.
+        num_workers (int): The number of threads reading the source images.
+        splits (dict[str, Sequence[int]]): The indices of the samples of every split, by split name.
+        seed (int): The seed of the random sample order.
+
+    Returns:
+        Path: The json index listing the shards of every split and their sample counts.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    labels = dataset.labels.astype(np.uint8)
+
+    split_shards: dict[str, list[dict[str, str | int]]] = {}
+    with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+        for split, split_indices in splits.items():
+            order = rng.permutation(np.asarray(split_indices))
+            shards = split_shards[split] = []
+            for start in tqdm(range(0, len(order), shard_size), desc=f"Writing {split} shards"):
+                indices = order[start : start + shard_size]
+                shard_file = output_dir / f"{split}-{len(shards):05d}.tar"
+                tmp_file = shard_file.with_suffix(".tmp")
+                # Read the source images in parallel, the shard itself is written sequentially
+                images = pool.map(_read_bytes, (dataset.image_path(idx) for idx in indices))
+                with tarfile.open(tmp_file, "w") as tar:
+                    for idx, image in zip(indices, images):
+                        key = f"{idx:07d}"
+                        _add_member(tar, f"{key}.jpg", image)
+                        _add_member(tar, f"{key}.cls", labels[idx].tobytes())
+                tmp_file.replace(shard_file)
+                shards.append({"file": shard_file.name, "count": len(indices)})
+
+    index_file = output_dir / f"{'train' if dataset.train else 'valid'}.json"
+    with open(index_file, "w") as f:
+        json.dump({"classes": CheXpert.CLASSES, "splits": split_shards}, f, indent=4)
+    print(f"{sum(len(shards) for shards in split_shards.values())} shards written to: {output_dir}")
+    return index_file
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(
+        description="Pack the CheXpert images and labels into tar shards for sequential streaming, split into the training, validation and test shards by --train_size and --val_size. Arguments to this script override the default CONFIG.py file."
+    )
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=2000,
+        help="The number of samples per shard.",
+    )
+    parser.add_argument(
+        "--valid",
+        action="store_true",
+        help="Pack the validation listfile instead of the training listfile.",
+    )
+    args: Namespace = parse_arguments(parser)
+    dataset = CheXpert(root_dir=args.root_dir, train=not args.valid)
+    if args.valid:
+        splits = {"valid": range(len(dataset))}
+    else:
+        # The training, validation and test sets of load_data, so a model trained on the shards is evaluated
+        # on the same images as one trained on the JPEGs
+        splits = dict(zip(("train", "val", "test"), (subset.indices for subset in split_dataset(dataset, args))))
+    write_shards(dataset, dataset.DATA_DIR / "shards", args.shard_size, args.num_workers, splits)
+
+
+if __name__ == "__main__":
+    main()